@@ -1,11 +1,20 @@
 """Dify Agent 节点工厂函数"""
 
+import uuid
 from typing import Dict, Any, Callable
 from langchain_core.messages import AIMessage
 from langchain_core.runnables import RunnableConfig
+from langgraph.config import get_stream_writer
 from app.agent.state import AgentState
+from app.services.dify.circuit_breaker import (
+    DifyCallTimeoutError,
+    DifyCircuitOpenError,
+    dify_breakers,
+    format_unavailable_message,
+)
 from app.services.dify.client import DifyClient
 from app.services.dify.manager import DifyAgentConfig
+from app.services.dify.streaming import run_dify_agent
 from app.core.logger import logger
 
 
@@ -44,17 +53,17 @@ def create_dify_agent_node(agent_config: DifyAgentConfig) -> Callable:
             last_message = messages[-1]
             query = last_message.content if hasattr(last_message, "content") else str(last_message)
 
-            # 获取用户 ID 和会话 ID
+            # 获取用户 ID 和会话 ID（Dify conversation_id 按会话映射复用）
             user_id = config.get("configurable", {}).get("user_id", "default")
-            conversation_id = config.get("configurable", {}).get("thread_id")
+            session_id = config.get("configurable", {}).get("thread_id")
 
             logger.info(
                 f"Dify Agent '{agent_config.name}' 处理消息: "
-                f"user_id={user_id}, conversation_id={conversation_id}, "
+                f"user_id={user_id}, session_id={session_id}, "
                 f"query={query[:100]}..."
             )
 
-            # 创建 Dify 客户端
+            # 创建 Dify 客户端（底层复用进程级共享连接）
             client = DifyClient(
                 base_url=agent_config.base_url,
                 api_key=agent_config.api_key,
@@ -62,46 +71,20 @@ def create_dify_agent_node(agent_config: DifyAgentConfig) -> Callable:
             )
 
             try:
-                # 根据 Agent 类型调用不同的 API
-                if agent_config.agent_type == "workflow":
-                    # 工作流类型
-                    inputs = agent_config.config.get("inputs", {})
-                    inputs["query"] = query  # 将查询添加到输入中
-
-                    result = await client.run_workflow(
-                        inputs=inputs,
-                        user_id=user_id,
-                        response_mode="blocking",
-                    )
-
-                    # 提取工作流输出
-                    if "data" in result and "outputs" in result["data"]:
-                        output = result["data"]["outputs"]
-                        # 尝试获取文本输出
-                        if isinstance(output, dict):
-                            response_text = output.get("text") or output.get("result") or str(output)
-                        else:
-                            response_text = str(output)
-                    else:
-                        response_text = str(result)
-
-                else:
-                    # Chatbot 或 Agent 类型
-                    result = await client.chat(
+                # 工作流类型将查询合并进输入；对话类型在同一会话内复用 Dify conversation_id
+                result = await dify_breakers.get(agent_config.id, agent_config.name).call(
+                    lambda: run_dify_agent(
+                        client,
+                        agent_type=agent_config.agent_type,
                         query=query,
                         user_id=user_id,
-                        conversation_id=conversation_id,
-                        inputs=agent_config.config.get("inputs"),
-                        response_mode="blocking",
-                    )
-
-                    # 提取回答
-                    if "answer" in result:
-                        response_text = result["answer"]
-                    elif "data" in result and "answer" in result["data"]:
-                        response_text = result["data"]["answer"]
-                    else:
-                        response_text = str(result)
+                        inputs=dict(agent_config.config.get("inputs") or {}),
+                        session_id=session_id,
+                        agent_id=agent_config.id,
+                    ),
+                    max_timeout=agent_config.config.get("timeout", 60),
+                )
+                response_text = result.text
 
                 logger.info(
                     f"Dify Agent '{agent_config.name}' 返回结果: "
@@ -112,9 +95,12 @@ def create_dify_agent_node(agent_config: DifyAgentConfig) -> Callable:
                 return {"messages": [AIMessage(content=response_text)]}
 
             finally:
-                # 关闭客户端
+                # 释放客户端（共享连接保留给后续调用）
                 await client.close()
 
+        except (DifyCircuitOpenError, DifyCallTimeoutError) as e:
+            logger.warning(f"Dify Agent '{agent_config.name}' 快速失败: {e}")
+            return {"messages": [AIMessage(content=format_unavailable_message(e))]}
         except Exception as e:
             logger.error(
                 f"Dify Agent '{agent_config.name}' 执行失败: {e}",
@@ -133,7 +119,8 @@ def create_dify_agent_streaming_node(agent_config: DifyAgentConfig) -> Callable:
     """
     创建支持流式输出的 Dify Agent 节点
 
-    注意: 流式节点需要特殊处理,暂时保留此函数作为未来扩展
+    回答通过 LangGraph 的自定义流逐段输出，节点结束时返回拼装好的完整 AIMessage。
+    无法获取 stream writer（不在图运行上下文中）时回退到阻塞节点。
 
     Args:
         agent_config: Dify Agent 配置
@@ -141,22 +128,104 @@ def create_dify_agent_streaming_node(agent_config: DifyAgentConfig) -> Callable:
     Returns:
         流式节点函数
     """
+    blocking_node = create_dify_agent_node(agent_config)
 
     async def dify_agent_streaming_node(
         state: AgentState,
         config: RunnableConfig,
     ) -> Dict[str, Any]:
         """
-        Dify Agent 流式节点 (未实现)
+        Dify Agent 流式节点 - 以流式模式调用 Dify API
 
-        流式输出需要在 Graph 层面支持,目前暂不实现
+        Args:
+            state: Agent 状态
+            config: 运行配置
+
+        Returns:
+            更新后的状态
         """
-        logger.warning(f"Dify Agent '{agent_config.name}' 流式节点暂未实现,使用阻塞模式")
-        # 回退到阻塞模式
-        blocking_node = create_dify_agent_node(agent_config)
-        return await blocking_node(state, config)
+        try:
+            writer = get_stream_writer()
+        except Exception:
+            writer = None
+        if writer is None:
+            return await blocking_node(state, config)
+
+        try:
+            messages = state["messages"]
+            if not messages:
+                logger.warning(f"Dify Agent '{agent_config.name}' 收到空消息列表")
+                return {"messages": [AIMessage(content="没有收到消息")]}
+
+            # 获取最后一条用户消息
+            last_message = messages[-1]
+            query = last_message.content if hasattr(last_message, "content") else str(last_message)
+
+            # 获取用户 ID 和会话 ID（Dify conversation_id 按会话映射复用）
+            user_id = config.get("configurable", {}).get("user_id", "default")
+            session_id = config.get("configurable", {}).get("thread_id")
+
+            logger.info(
+                f"Dify Agent '{agent_config.name}' 流式处理消息: "
+                f"user_id={user_id}, session_id={session_id}, "
+                f"query={query[:100]}..."
+            )
+
+            # 增量内容与最终消息使用同一个 ID，流式处理方据此避免重复输出
+            message_id = f"dify-{uuid.uuid4().hex}"
+
+            def on_delta(delta: str):
+                writer({
+                    "type": "dify_delta",
+                    "target": "assistant",
+                    "message_id": message_id,
+                    "agent": agent_config.name,
+                    "delta": delta,
+                })
+
+            # 创建 Dify 客户端（底层复用进程级共享连接）
+            client = DifyClient(
+                base_url=agent_config.base_url,
+                api_key=agent_config.api_key,
+                timeout=agent_config.config.get("timeout", 60),
+            )
+
+            try:
+                result = await dify_breakers.get(agent_config.id, agent_config.name).call(
+                    lambda: run_dify_agent(
+                        client,
+                        agent_type=agent_config.agent_type,
+                        query=query,
+                        user_id=user_id,
+                        inputs=dict(agent_config.config.get("inputs") or {}),
+                        session_id=session_id,
+                        agent_id=agent_config.id,
+                        on_delta=on_delta,
+                    ),
+                    max_timeout=agent_config.config.get("timeout", 60),
+                )
+            finally:
+                # 释放客户端（共享连接保留给后续调用）
+                await client.close()
+
+            logger.info(
+                f"Dify Agent '{agent_config.name}' 流式返回结果: "
+                f"{result.text[:200]}..."
+            )
+
+            return {"messages": [AIMessage(content=result.text, id=message_id)]}
+
+        except (DifyCircuitOpenError, DifyCallTimeoutError) as e:
+            logger.warning(f"Dify Agent '{agent_config.name}' 快速失败: {e}")
+            return {"messages": [AIMessage(content=format_unavailable_message(e), id=message_id)]}
+        except Exception as e:
+            logger.error(
+                f"Dify Agent '{agent_config.name}' 流式执行失败: {e}",
+                exc_info=True
+            )
+            error_message = f"调用 Dify Agent '{agent_config.name}' 失败: {str(e)}"
+            return {"messages": [AIMessage(content=error_message)]}
 
     dify_agent_streaming_node.__name__ = f"dify_agent_streaming_{agent_config.name}"
 
     return dify_agent_streaming_node
-
@@ -9,7 +9,9 @@ from langchain_core.runnables import RunnableConfig
 from app.core.logger import logger
 from app.agent.state import AgentState
 from app.core.llm import get_llm, LLMInitializationError
-from langgraph.types import interrupt
+from langgraph.types import Command, interrupt
+from langgraph.errors import GraphBubbleUp
+from app.core.config import settings
 import os
 
 
@@ -132,6 +134,9 @@ def create_call_model_with_tools(tools: List[tool]):
                     ai_message = full_response
                     logger.info("异步流式模型调用成功")
 
+                except GraphBubbleUp:
+                    # 用户中断触发的 interrupt 需要交给图处理，不能当作流式错误
+                    raise
                 except Exception as stream_error:
                     # 如果在流式传输过程中发生中断或其他错误，但已有累积内容，则返回它
                     if accumulated_content:
@@ -140,6 +145,8 @@ def create_call_model_with_tools(tools: List[tool]):
                     else:
                         raise stream_error
 
+            except GraphBubbleUp:
+                raise
             except Exception as stream_error:
                 # 回退到异步普通调用
                 logger.info(f"非流式上下文或流式调用失败，回退到 ainvoke: {stream_error}")
@@ -148,6 +155,8 @@ def create_call_model_with_tools(tools: List[tool]):
 
             return {"messages": [ai_message]}
 
+        except GraphBubbleUp:
+            raise
         except Exception as e:
             logger.error(f"调用模型失败: {e}", exc_info=True)
             return {"messages": [AIMessage(content=f"模型调用失败: {str(e)}")]}
@@ -220,11 +229,74 @@ def should_continue(state: AgentState) -> str:
     return "end"
 
 
+# ========================
+# 入口路由：Dify 直连
+# ========================
+def create_dify_router(dify_nodes: Dict[str, str]):
+    """
+    创建入口路由节点（闭包）
+
+    路由对最新的用户消息打分，最优 Dify Agent 的综合得分达到阈值且明显领先第二名时，
+    直接进入对应的 Dify 节点，省去一次主模型调用；否则进入 agent 节点。
+
+    Args:
+        dify_nodes: Dify Agent ID -> 图中的节点名称
+    """
+
+    async def dify_router(state: AgentState, config: RunnableConfig) -> Command:
+        """入口路由节点"""
+        messages = state["messages"]
+        if not messages or not isinstance(messages[-1], HumanMessage):
+            return Command(goto="agent")
+
+        query = messages[-1].content if isinstance(messages[-1].content, str) else str(messages[-1].content)
+        try:
+            from app.services.dify.manager import get_dify_manager
+            matches = await get_dify_manager().rank_agents(query, top_k=2)
+        except Exception as e:
+            logger.warning(f"Dify 直连路由打分失败，交给 agent 处理: {e}")
+            return Command(goto="agent")
+
+        if not matches:
+            return Command(goto="agent")
+
+        best = matches[0]
+        runner_up = matches[1].score if len(matches) > 1 else 0.0
+        node_name = dify_nodes.get(best.agent.id)
+        confident = (
+            best.score >= settings.dify_direct_routing_threshold
+            and best.score - runner_up >= settings.dify_direct_routing_margin
+        )
+        if node_name and confident:
+            from app.services.dify.circuit_breaker import dify_breakers
+            if not dify_breakers.is_available(best.agent.id):
+                logger.info(f"Dify 直连路由命中 '{best.agent.name}' 但该 Agent 已熔断，交给 agent 处理")
+                return Command(goto="agent")
+            logger.info(
+                f"Dify 直连路由命中 '{best.agent.name}': score={best.score:.2f}, "
+                f"keyword={best.keyword_score}, semantic={best.semantic_score}"
+            )
+            return Command(goto=node_name)
+
+        logger.debug(f"Dify 直连路由置信度不足（best={best.score:.2f}, second={runner_up:.2f}），交给 agent 处理")
+        return Command(goto="agent")
+
+    return dify_router
+
+
 # ========================
 # 构建图：create_graph
 # ========================
-async def create_graph_async(checkpointer=None, store=None):
-    """创建 graph 图（异步版本 - 支持MCP工具加载和Dify Agent工具）"""
+async def create_graph_async(checkpointer=None, store=None, mcp_tools: Optional[List] = None):
+    """
+    创建 graph 图（异步版本 - 支持MCP工具加载和Dify Agent工具）
+
+    Args:
+        checkpointer: 检查点保存器
+        store: 长期记忆存储
+        mcp_tools: 调用方通过 mcp_manager.lease_tools() 租用的MCP工具集，
+            为None时直接取当前工具集
+    """
     from app.agent.state import AgentState
     from app.agent.tools import tool_manager, mcp_manager, dify_tool_manager
 
@@ -235,7 +307,8 @@ async def create_graph_async(checkpointer=None, store=None):
     logger.info(f"自定义工具数量: {len(custom_tools)}")
 
     # 异步加载MCP工具
-    mcp_tools = await mcp_manager.get_mcp_tools()
+    if mcp_tools is None:
+        mcp_tools = await mcp_manager.get_mcp_tools()
     logger.info(f"MCP工具数量: {len(mcp_tools)}")
 
     # 异步加载 Dify Agent 工具
@@ -262,8 +335,14 @@ async def create_graph_async(checkpointer=None, store=None):
     if tool_node:
         builder.add_node("tools", tool_node)
 
-    # 设置入口
-    builder.set_entry_point("agent")
+    # 设置入口：启用 Dify 直连时先经过路由节点
+    dify_nodes = await _add_dify_direct_nodes(builder) if settings.dify_direct_routing else {}
+    if dify_nodes:
+        # 路由节点通过 Command(goto=...) 跳转，不需要显式的出边
+        builder.add_node("router", create_dify_router(dify_nodes))
+        builder.set_entry_point("router")
+    else:
+        builder.set_entry_point("agent")
 
     # 添加条件边
     if tool_node:
@@ -283,6 +362,34 @@ async def create_graph_async(checkpointer=None, store=None):
     return builder.compile(checkpointer=checkpointer, store=store)
 
 
+async def _add_dify_direct_nodes(builder: StateGraph) -> Dict[str, str]:
+    """
+    为每个启用的 Dify Agent 添加直连节点，节点执行完直接结束
+
+    Returns:
+        Dify Agent ID -> 节点名称
+    """
+    from app.agent.dify_nodes import create_dify_agent_streaming_node
+    from app.services.dify.manager import get_dify_manager
+
+    try:
+        agents = await get_dify_manager().load_agents()
+    except Exception as e:
+        logger.error(f"加载 Dify Agent 失败，不启用直连路由: {e}")
+        return {}
+
+    dify_nodes = {}
+    for agent in agents:
+        node_name = f"dify_agent_{agent.id}"
+        builder.add_node(node_name, create_dify_agent_streaming_node(agent))
+        builder.add_edge(node_name, END)
+        dify_nodes[agent.id] = node_name
+
+    if dify_nodes:
+        logger.info(f"启用 Dify 直连路由，共 {len(dify_nodes)} 个 Dify 节点")
+    return dify_nodes
+
+
 def create_graph(checkpointer=None, store=None):
     """创建 graph 图（同步版本 - 仅自定义工具，不包含MCP工具）"""
     from app.agent.state import AgentState
@@ -4,7 +4,7 @@ from typing import List, Optional, Type, Dict, Any
 from langchain.tools import BaseTool
 from pydantic import BaseModel, Field, create_model
 from app.core.logger import logger
-from app.core.user_context import get_user_id
+from app.core.user_context import get_user_id, get_session_id
 
 
 class DifyAgentInput(BaseModel):
@@ -36,9 +36,16 @@ class DifyAgentTool(BaseTool):
         inputs: Optional[Dict[str, Any]] = None,
         run_manager=None
     ) -> str:
-        """异步调用 Dify Agent"""
+        """异步调用 Dify Agent（流式调用，增量内容转发到图的自定义流）"""
         try:
             from app.services.dify.client import DifyClient
+            from app.services.dify.streaming import DifyStreamError, run_dify_agent
+            from app.services.dify.circuit_breaker import (
+                DifyCallTimeoutError,
+                DifyCircuitOpenError,
+                dify_breakers,
+                format_unavailable_message,
+            )
             import httpx
 
             # 从上下文获取 user_id
@@ -48,7 +55,7 @@ class DifyAgentTool(BaseTool):
                 f"调用 Dify Agent '{self.name}': user_id={user_id}"
             )
 
-            # 创建 Dify 客户端
+            # 创建 Dify 客户端（底层复用进程级共享连接）
             client = DifyClient(
                 base_url=self.agent_config.get("base_url", "https://api.dify.ai/v1"),
                 api_key=self.agent_config["api_key"],
@@ -63,58 +70,51 @@ class DifyAgentTool(BaseTool):
                 if inputs:
                     final_inputs.update(inputs)
 
-                # 根据 Agent 类型调用不同的 API
-                if agent_type == "workflow":
-                    # 工作流类型
-                    workflow_inputs = final_inputs.copy()
-                    workflow_inputs["query"] = query
-
-                    result = await client.run_workflow(
-                        inputs=workflow_inputs,
-                        user_id=user_id,
-                        response_mode="blocking",
-                    )
-
-                    # 提取工作流输出
-                    if "data" in result and "outputs" in result["data"]:
-                        output = result["data"]["outputs"]
-                        if isinstance(output, dict):
-                            response_text = output.get("text") or output.get("result") or str(output)
-                        else:
-                            response_text = str(output)
-                    else:
-                        response_text = str(result)
-
-                else:
-                    # Chatbot 或 Agent 类型 - 暂时不传 conversation_id
+                breaker = dify_breakers.get(self.agent_config.get("agent_id"), self.name)
+                if agent_type == "workflow" and self.agent_config.get("async_mode"):
+                    # 长时间工作流在后台运行，超过等待时间先返回句柄
                     try:
-                        result = await client.chat(
+                        breaker.ensure_available()
+                    except DifyCircuitOpenError as e:
+                        return format_unavailable_message(e)
+                    return await self._submit_workflow(client, query, user_id, final_inputs)
+
+                try:
+                    # Chatbot 或 Agent 类型在同一会话内复用 Dify conversation_id；
+                    # 熔断器按该 Agent 最近的耗时收紧超时，熔断打开时直接失败
+                    result = await breaker.call(
+                        lambda: run_dify_agent(
+                            client,
+                            agent_type=agent_type,
                             query=query,
                             user_id=user_id,
-                            conversation_id=None,  # 暂时不传 conversation_id
                             inputs=final_inputs,
-                            response_mode="blocking",
-                        )
-                    except httpx.HTTPStatusError as e:
-                        # 直接返回 Dify API 的错误信息
-                        try:
-                            error_data = e.response.json()
-                            error_message = error_data.get("message", str(e))
-                        except:
-                            error_message = str(e)
-
-                        logger.error(
-                            f"Dify API 错误 [{e.response.status_code}]: {error_message}"
-                        )
-                        return f"Dify API 调用失败: {error_message}"
-
-                    # 提取回答
-                    if "answer" in result:
-                        response_text = result["answer"]
-                    elif "data" in result and "answer" in result["data"]:
-                        response_text = result["data"]["answer"]
-                    else:
-                        response_text = str(result)
+                            session_id=get_session_id(),
+                            agent_id=self.agent_config.get("agent_id"),
+                            on_delta=self._get_delta_writer(),
+                        ),
+                        max_timeout=self.agent_config.get("timeout", 360),
+                    )
+                except (DifyCircuitOpenError, DifyCallTimeoutError) as e:
+                    logger.warning(f"Dify Agent 工具 '{self.name}' 快速失败: {e}")
+                    return format_unavailable_message(e)
+                except httpx.HTTPStatusError as e:
+                    # 直接返回 Dify API 的错误信息
+                    try:
+                        error_data = e.response.json()
+                        error_message = error_data.get("message", str(e))
+                    except:
+                        error_message = str(e)
+
+                    logger.error(
+                        f"Dify API 错误 [{e.response.status_code}]: {error_message}"
+                    )
+                    return f"Dify API 调用失败: {error_message}"
+                except DifyStreamError as e:
+                    logger.error(f"Dify API 错误 [{e.code}]: {e.message}")
+                    return f"Dify API 调用失败: {e.message}"
+
+                response_text = result.text
 
                 logger.info(
                     f"Dify Agent 工具 '{self.name}' 返回结果: "
@@ -124,7 +124,7 @@ class DifyAgentTool(BaseTool):
                 return response_text
 
             finally:
-                # 关闭客户端
+                # 释放客户端（共享连接保留给后续调用）
                 await client.close()
 
         except Exception as e:
@@ -132,50 +132,126 @@ class DifyAgentTool(BaseTool):
             logger.error(error_msg, exc_info=True)
             return error_msg
 
+    async def _submit_workflow(self, client, query: str, user_id: str, inputs: Dict[str, Any]) -> str:
+        """在后台启动工作流，等待 DIFY_WORKFLOW_ASYNC_WAIT 秒，未完成时返回运行句柄"""
+        from app.core.config import settings
+        from app.services.dify.workflow_runs import dify_workflow_runs, summarize_run
+
+        run = await dify_workflow_runs.submit(
+            client,
+            agent_id=self.agent_config.get("agent_id"),
+            agent_name=self.name,
+            query=query,
+            user_id=user_id,
+            inputs=inputs,
+            session_id=get_session_id(),
+        )
+        state = await dify_workflow_runs.wait(run.id, timeout=settings.dify_workflow_async_wait)
+        return summarize_run(state)
+
+    def _get_delta_writer(self):
+        """获取把 Dify 增量回答写入图自定义流的回调，不在流式运行中时返回 None"""
+        try:
+            from langgraph.config import get_stream_writer
+            writer = get_stream_writer()
+        except Exception:
+            return None
+
+        def _on_delta(delta: str):
+            writer({
+                "type": "dify_delta",
+                "target": "tool",
+                "tool_name": self.name,
+                "delta": delta,
+            })
+
+        return _on_delta
+
+
+class DifyWorkflowResultInput(BaseModel):
+    """查询后台工作流结果的输入参数"""
+    run_id: str = Field(description="工作流后台运行时返回的 run_id")
+    wait_seconds: int = Field(
+        default=0,
+        description="最多等待多少秒直到工作流结束；为 0 时只查询当前进度",
+    )
+
+
+class DifyWorkflowResultTool(BaseTool):
+    """查询（或限时等待）后台运行的 Dify 工作流"""
+
+    name: str = "get_dify_workflow_result"
+    description: str = (
+        "查询在后台运行的 Dify 工作流的进度或结果。"
+        "长时间运行的工作流会先返回 run_id，使用该工具查询已完成的节点，"
+        "或指定 wait_seconds 等待工作流结束并获取结果。"
+    )
+    args_schema: Type[BaseModel] = DifyWorkflowResultInput
+
+    def _run(self, run_id: str, wait_seconds: int = 0) -> str:
+        """同步调用（不支持）"""
+        raise NotImplementedError("该工具只支持异步调用")
+
+    async def _arun(self, run_id: str, wait_seconds: int = 0, run_manager=None) -> str:
+        from app.core.config import settings
+        from app.services.dify.workflow_runs import dify_workflow_runs, summarize_run
+
+        wait_seconds = min(max(wait_seconds, 0), settings.dify_workflow_max_wait)
+        try:
+            state = await dify_workflow_runs.wait(run_id, timeout=wait_seconds)
+        except Exception as e:
+            logger.error(f"查询 Dify 工作流运行失败: {e}", exc_info=True)
+            return f"查询工作流运行失败: {str(e)}"
+
+        session_id = get_session_id()
+        if not state or (state["session_id"] and session_id and state["session_id"] != str(session_id)):
+            return f"工作流运行 {run_id} 不存在或已过期"
+        return summarize_run(state)
+
 
 class DifyToolManager:
     """Dify Agent 工具管理器"""
 
     def __init__(self):
         self._tools_cache: Optional[List[BaseTool]] = None
-        self._cache_timestamp: Optional[float] = None
-        self._cache_ttl = 300  # 缓存 5 分钟
+        # 生成工具缓存时使用的 Agent 列表；Agent 管理器刷新后列表对象会变化，工具随之重建
+        self._tools_source: Optional[list] = None
 
     def clear_cache(self):
         """清空缓存"""
         logger.info("清空 Dify 工具缓存")
         self._tools_cache = None
-        self._cache_timestamp = None
-    
+        self._tools_source = None
+
     async def get_dify_tools(self, force_reload: bool = False) -> List[BaseTool]:
         """
         获取所有 Dify Agent 工具
-        
+
+        工具缓存跟随 Agent 管理器的缓存：Agent 列表未变化时直接复用已生成的工具，
+        不再单独设置过期时间。
+
         Args:
             force_reload: 是否强制重新加载
             
         Returns:
             Dify Agent 工具列表
         """
-        import time
-        
-        # 检查缓存
-        if not force_reload and self._tools_cache is not None:
-            if self._cache_timestamp and (time.time() - self._cache_timestamp) < self._cache_ttl:
-                logger.info(f"使用缓存的 Dify 工具: {len(self._tools_cache)} 个")
-                return self._tools_cache
-        
         # 加载 Dify Agent 配置
         try:
             from app.services.dify.manager import get_dify_manager
             
             dify_manager = get_dify_manager()
             agents = await dify_manager.load_agents()
+
+            # 检查缓存
+            if not force_reload and self._tools_cache is not None and self._tools_source is agents:
+                logger.debug(f"使用缓存的 Dify 工具: {len(self._tools_cache)} 个")
+                return self._tools_cache
             
             if not agents:
                 logger.info("没有可用的 Dify Agent 配置")
                 self._tools_cache = []
-                self._cache_timestamp = time.time()
+                self._tools_source = agents
                 return []
             
             # 将每个 Dify Agent 转换为工具
@@ -210,20 +286,26 @@ class DifyToolManager:
                     name=f"dify_{agent.name}",
                     description=tool_description,
                     agent_config={
+                        "agent_id": agent.id,
                         "agent_type": agent.agent_type,
                         "base_url": agent.base_url,
                         "api_key": agent.api_key,
                         "default_inputs": agent.config.get("default_inputs", {}),
                         "timeout": agent.config.get("timeout", 360),
+                        "async_mode": agent.config.get("async_mode", False),
                     }
                 )
 
                 tools.append(tool)
                 logger.info(f"创建 Dify 工具: {tool.name}")
             
+            # 存在后台运行的工作流时提供结果查询工具
+            if any(agent.agent_type == "workflow" and agent.config.get("async_mode") for agent in agents):
+                tools.append(DifyWorkflowResultTool())
+
             # 更新缓存
             self._tools_cache = tools
-            self._cache_timestamp = time.time()
+            self._tools_source = agents
             
             logger.info(f"加载了 {len(tools)} 个 Dify Agent 工具")
             return tools
@@ -1,8 +1,15 @@
 from typing import List, Dict, Any, Optional
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from datetime import datetime
 from langchain_core.tools import BaseTool
+from app.agent.tools.tool_results import wrap_mcp_tool
+from app.core.config import settings
 from app.core.logger import logger
 from app.services.mcp import mcp_config_service
 import asyncio
+import shutil
+import time
 
 try:
     from langchain_mcp_adapters.client import MultiServerMCPClient
@@ -11,13 +18,94 @@ except ImportError:
     logger.warning("langchain-mcp-adapters not installed. MCP tools will be disabled.")
     MCP_AVAILABLE = False
 
+try:
+    from langchain_mcp_adapters.callbacks import Callbacks
+    MCP_PROGRESS_AVAILABLE = True
+except ImportError:
+    MCP_PROGRESS_AVAILABLE = False
+
+
+async def _forward_mcp_progress(progress: float, total: Optional[float], message: Optional[str], context: Any) -> None:
+    """
+    把MCP进度通知写入LangGraph自定义流
+
+    回调运行在工具调用创建的会话中，可以拿到当前图运行的 stream writer；
+    非流式运行（或不在图中调用）时直接忽略。
+    """
+    try:
+        from langgraph.config import get_stream_writer
+        writer = get_stream_writer()
+    except Exception:
+        return
+
+    writer({
+        "type": "tool_progress",
+        "tool_name": getattr(context, "tool_name", None),
+        "server_name": getattr(context, "server_name", None),
+        "progress": progress,
+        "total": total,
+        "message": message,
+    })
+
+
+def _create_mcp_client(servers_config: Dict[str, Dict[str, Any]]) -> "MultiServerMCPClient":
+    """创建MCP客户端，适配器支持时注册进度通知回调"""
+    if MCP_PROGRESS_AVAILABLE:
+        return MultiServerMCPClient(servers_config, callbacks=Callbacks(on_progress=_forward_mcp_progress))
+    return MultiServerMCPClient(servers_config)
+
+@dataclass
+class MCPToolSnapshot:
+    """
+    MCP工具集快照
+
+    一次加载得到的客户端和工具集合，创建后不再修改。重载时构建新快照并整体替换，
+    正在运行的图继续使用旧快照，旧快照在所有运行结束后再关闭。
+    """
+    version: int
+    servers_config: Dict[str, Dict[str, Any]]
+    client: Optional[Any]
+    tools: List[BaseTool]
+    created_at: float = field(default_factory=time.time)
+    active_runs: int = 0
+    drained: asyncio.Event = field(default_factory=asyncio.Event)
+
+
 class MCPToolWrapper:
     """MCP工具包装器 - 使用LangGraph官方适配器"""
 
     def __init__(self):
-        self.tools: Dict[str, BaseTool] = {}
-        self.mcp_client: Optional[MultiServerMCPClient] = None
+        self._snapshot: Optional[MCPToolSnapshot] = None
+        self._version = 0
+        self._reload_lock = asyncio.Lock()
+        self._reload_task: Optional[asyncio.Task] = None
+        # 已被替换、等待排空后关闭的旧快照
+        self._retired_snapshots: Dict[int, MCPToolSnapshot] = {}
+        self._drain_tasks: Dict[int, asyncio.Task] = {}
         self.mcp_servers_config = self._load_mcp_servers_config()
+        # 连接诊断结果缓存
+        self._diagnosis_cache: Optional[Dict[str, Any]] = None
+        self._diagnosis_timestamp: Optional[float] = None
+        self._diagnosis_lock = asyncio.Lock()
+        # 配置变更通知到达时在后台重建快照
+        mcp_config_service.add_change_listener(self._on_config_changed)
+
+    @property
+    def tools(self) -> Dict[str, BaseTool]:
+        """当前快照中的工具（按名称索引）"""
+        if not self._snapshot:
+            return {}
+        return {tool.name: tool for tool in self._snapshot.tools}
+
+    @property
+    def mcp_client(self) -> Optional[Any]:
+        """当前快照使用的MCP客户端"""
+        return self._snapshot.client if self._snapshot else None
+
+    @property
+    def snapshot_version(self) -> Optional[int]:
+        """当前快照版本号，尚未加载时为None"""
+        return self._snapshot.version if self._snapshot else None
 
     def _load_mcp_servers_config(self) -> Dict[str, Dict[str, Any]]:
         """从数据库加载MCP服务器配置"""
@@ -42,124 +130,230 @@ class MCPToolWrapper:
             logger.info("将使用空配置")
             return {}
 
-    async def _initialize_mcp_client(self) -> bool:
-        """初始化MCP客户端"""
-        if not MCP_AVAILABLE:
-            logger.warning("MCP适配器不可用，跳过MCP客户端初始化")
-            return False
+    def _validate_servers_config(self, servers_config: Dict[str, Dict[str, Any]]) -> None:
+        """验证MCP服务器配置格式，不合法时抛出ValueError"""
+        for name, config in servers_config.items():
+            if not isinstance(config, dict):
+                raise ValueError(f"配置 '{name}' 必须是字典格式")
+            if "transport" not in config:
+                raise ValueError(f"配置 '{name}' 缺少必需的 'transport' 字段")
+
+            transport = config["transport"]
+            if transport == "stdio":
+                if "command" not in config:
+                    raise ValueError(f"stdio配置 '{name}' 缺少 'command' 字段")
+                if "args" not in config:
+                    raise ValueError(f"stdio配置 '{name}' 缺少 'args' 字段")
+            elif transport == "streamable_http":
+                if "url" not in config:
+                    raise ValueError(f"http配置 '{name}' 缺少 'url' 字段")
+            else:
+                logger.warning(f"配置 '{name}' 使用了未知的传输类型: {transport}")
 
-        if not self.mcp_servers_config:
-            logger.info("没有配置MCP服务器，跳过MCP客户端初始化")
-            return False
+    async def _build_snapshot(self, servers_config: Dict[str, Dict[str, Any]]) -> MCPToolSnapshot:
+        """
+        根据配置构建新的工具快照
+
+        构建过程不影响当前快照，失败时直接抛出异常。
+        """
+        self._version += 1
+        version = self._version
+
+        if not servers_config:
+            logger.info("没有配置MCP服务器，创建空的工具快照")
+            return MCPToolSnapshot(version=version, servers_config={}, client=None, tools=[])
+
+        logger.info(f"正在构建MCP工具快照 v{version}，配置: {servers_config}")
+        self._validate_servers_config(servers_config)
+
+        client = _create_mcp_client(servers_config)
+        try:
+            # 设置30秒超时
+            tools = await asyncio.wait_for(client.get_tools(), timeout=30.0)
+        except asyncio.TimeoutError:
+            await self._close_client(client)
+            raise TimeoutError("获取MCP工具超时（30秒），可能是服务器响应慢或无法连接")
+        except Exception:
+            await self._close_client(client)
+            raise
+
+        # 结果后处理：展平内容块并按 token 预算截断，避免超大结果进入消息历史
+        tools = [wrap_mcp_tool(tool) for tool in tools]
+
+        logger.info(f"MCP工具快照 v{version} 构建完成，共 {len(tools)} 个工具: {[tool.name for tool in tools]}")
+        return MCPToolSnapshot(version=version, servers_config=servers_config, client=client, tools=tools)
+
+    def _log_snapshot_error(self, error: Exception, servers_config: Dict[str, Dict[str, Any]]) -> None:
+        """记录构建快照失败的详细原因"""
+        error_str = str(error)
+
+        # 特别处理连接错误
+        if "ConnectError" in error_str or "All connection attempts failed" in error_str:
+            logger.error("❌ MCP服务器连接失败")
+            logger.error(f"无法连接到MCP服务器，请检查：")
+            for name, config in servers_config.items():
+                if config.get("transport") == "sse":
+                    logger.error(f"  - SSE服务器 '{name}': {config.get('url')}")
+                elif config.get("transport") == "streamable_http":
+                    logger.error(f"  - HTTP服务器 '{name}': {config.get('url')}")
+                elif config.get("transport") == "stdio":
+                    logger.error(f"  - Stdio服务器 '{name}': {config.get('command')}")
+            logger.error("请确保MCP服务器已启动并且网络连接正常")
+            return
+
+        # 特别处理TaskGroup错误
+        if "TaskGroup" in error_str or "unhandled errors" in error_str:
+            logger.error("检测到TaskGroup错误，这可能是MCP服务器连接问题")
+            logger.error("建议检查MCP服务器配置和服务器状态")
+            return
+
+        logger.error(f"构建MCP工具快照失败: {error}")
+        logger.error(f"错误类型: {type(error).__name__}")
+        import traceback
+        logger.error(f"详细错误信息: {traceback.format_exc()}")
+
+    def _swap_snapshot(self, new_snapshot: MCPToolSnapshot) -> None:
+        """原子替换当前快照，旧快照排空后关闭"""
+        old_snapshot = self._snapshot
+        self._snapshot = new_snapshot
+        logger.info(f"MCP工具快照已切换到 v{new_snapshot.version}")
+
+        if old_snapshot is not None:
+            version = old_snapshot.version
+            self._retired_snapshots[version] = old_snapshot
+            task = asyncio.create_task(self._drain_and_close(old_snapshot))
+            self._drain_tasks[version] = task
+            task.add_done_callback(lambda _: self._drain_tasks.pop(version, None))
+
+    async def _drain_and_close(self, snapshot: MCPToolSnapshot) -> None:
+        """等待旧快照上的运行全部结束后关闭其客户端"""
+        if snapshot.active_runs > 0:
+            logger.info(f"等待MCP工具快照 v{snapshot.version} 上的 {snapshot.active_runs} 个运行结束")
+            try:
+                await asyncio.wait_for(snapshot.drained.wait(), timeout=settings.mcp_snapshot_drain_timeout)
+            except asyncio.TimeoutError:
+                logger.warning(
+                    f"MCP工具快照 v{snapshot.version} 排空超时，仍有 {snapshot.active_runs} 个运行，强制关闭"
+                )
+        self._retired_snapshots.pop(snapshot.version, None)
+        await self._close_client(snapshot.client)
+        logger.info(f"MCP工具快照 v{snapshot.version} 已关闭")
 
+    async def _close_client(self, client: Optional[Any]) -> None:
+        """关闭MCP客户端连接"""
+        if not client:
+            return
         try:
-            logger.info(f"正在初始化MCP客户端，配置: {self.mcp_servers_config}")
-
-            # 验证配置格式
-            for name, config in self.mcp_servers_config.items():
-                if not isinstance(config, dict):
-                    raise ValueError(f"配置 '{name}' 必须是字典格式")
-                if "transport" not in config:
-                    raise ValueError(f"配置 '{name}' 缺少必需的 'transport' 字段")
-
-                transport = config["transport"]
-                if transport == "stdio":
-                    if "command" not in config:
-                        raise ValueError(f"stdio配置 '{name}' 缺少 'command' 字段")
-                    if "args" not in config:
-                        raise ValueError(f"stdio配置 '{name}' 缺少 'args' 字段")
-                elif transport == "streamable_http":
-                    if "url" not in config:
-                        raise ValueError(f"http配置 '{name}' 缺少 'url' 字段")
-                else:
-                    logger.warning(f"配置 '{name}' 使用了未知的传输类型: {transport}")
-
-            self.mcp_client = MultiServerMCPClient(self.mcp_servers_config)
-            logger.info(f"MCP客户端初始化成功，连接到 {len(self.mcp_servers_config)} 个服务器")
-            return True
+            # 注意: MultiServerMCPClient可能没有显式的close方法
+            if hasattr(client, 'close'):
+                await client.close()
         except Exception as e:
-            logger.error(f"MCP客户端初始化失败: {e}")
-            logger.error(f"错误类型: {type(e).__name__}")
-            import traceback
-            logger.error(f"详细错误信息: {traceback.format_exc()}")
-            return False
+            logger.error(f"关闭MCP客户端失败: {e}")
+
+    async def _ensure_snapshot(self) -> Optional[MCPToolSnapshot]:
+        """确保存在可用快照，并发的冷启动请求只触发一次构建"""
+        if self._snapshot is not None:
+            return self._snapshot
+
+        async with self._reload_lock:
+            if self._snapshot is not None:
+                return self._snapshot
+
+            servers_config = self.mcp_servers_config
+            try:
+                self._swap_snapshot(await self._build_snapshot(servers_config))
+            except Exception as e:
+                self._log_snapshot_error(e, servers_config)
+                logger.warning("将继续运行，但MCP工具不可用")
+            return self._snapshot
+
+    async def reload_snapshot(self) -> MCPToolSnapshot:
+        """
+        重新加载配置并构建新快照
+
+        新快照构建成功后才会替换当前快照；构建失败时抛出异常，当前快照保持不变。
+        """
+        async with self._reload_lock:
+            servers_config = self._load_mcp_servers_config()
+            try:
+                new_snapshot = await self._build_snapshot(servers_config)
+            except Exception as e:
+                self._log_snapshot_error(e, servers_config)
+                raise
+            self.mcp_servers_config = servers_config
+            self._swap_snapshot(new_snapshot)
+            return new_snapshot
+
+    def schedule_reload(self, only_if_changed: bool = False) -> None:
+        """
+        在后台重建快照，期间继续使用当前快照提供服务
+
+        Args:
+            only_if_changed: 仅当启用的配置与当前快照不同时才重建
+        """
+        if self._reload_task and not self._reload_task.done():
+            return
+
+        async def _background_reload():
+            try:
+                if only_if_changed and self._snapshot is not None:
+                    if self._load_mcp_servers_config() == self._snapshot.servers_config:
+                        logger.info("MCP启用配置未变化，无需重建工具快照")
+                        return
+                await self.reload_snapshot()
+            except Exception as e:
+                logger.error(f"后台重载MCP工具失败，继续使用当前快照: {e}")
+
+        self._reload_task = asyncio.create_task(_background_reload())
+
+    def _on_config_changed(self) -> None:
+        """MCP配置变更通知回调：已有快照时在后台按需重建"""
+        if self._snapshot is not None:
+            self.schedule_reload(only_if_changed=True)
 
     async def register_mcp_tools(self) -> List[BaseTool]:
-        """从MCP服务器注册工具"""
+        """从MCP服务器注册工具（返回当前快照中的工具）"""
         if not MCP_AVAILABLE:
             logger.info("MCP适配器不可用，跳过工具注册")
             return []
 
-        try:
-            # 重新加载配置（确保获取最新的启用状态）
-            self.mcp_servers_config = self._load_mcp_servers_config()
-
-            # 初始化MCP客户端
-            if not self.mcp_client:
-                success = await self._initialize_mcp_client()
-                if not success:
-                    logger.warning("MCP客户端初始化失败，无法注册工具")
-                    return []
-
-            logger.info("开始获取MCP工具...")
-            # 获取所有MCP工具，使用超时机制
-            try:
-                # 设置30秒超时
-                tools = await asyncio.wait_for(
-                    self.mcp_client.get_tools(),
-                    timeout=30.0
-                )
-                logger.info(f"从MCP服务器获取到 {len(tools)} 个工具")
-            except asyncio.TimeoutError:
-                logger.error("获取MCP工具超时（30秒），可能是服务器响应慢或无法连接")
-                self.mcp_client = None
-                return []
-            except Exception as tool_error:
-                error_str = str(tool_error)
-
-                # 特别处理连接错误
-                if "ConnectError" in error_str or "All connection attempts failed" in error_str:
-                    logger.error("❌ MCP服务器连接失败")
-                    logger.error(f"无法连接到MCP服务器，请检查：")
-                    for name, config in self.mcp_servers_config.items():
-                        if config.get("transport") == "sse":
-                            logger.error(f"  - SSE服务器 '{name}': {config.get('url')}")
-                        elif config.get("transport") == "streamable_http":
-                            logger.error(f"  - HTTP服务器 '{name}': {config.get('url')}")
-                        elif config.get("transport") == "stdio":
-                            logger.error(f"  - Stdio服务器 '{name}': {config.get('command')}")
-                    logger.error("请确保MCP服务器已启动并且网络连接正常")
-                    self.mcp_client = None
-                    return []
-
-                # 特别处理TaskGroup错误
-                if "TaskGroup" in error_str or "unhandled errors" in error_str:
-                    logger.error("检测到TaskGroup错误，这可能是MCP服务器连接问题")
-                    logger.error("建议检查MCP服务器配置和服务器状态")
-                    # 尝试重置客户端
-                    self.mcp_client = None
-                    return []
-
-                # 其他错误
-                logger.error(f"获取MCP工具时发生未知错误: {tool_error}")
-                self.mcp_client = None
-                return []
-
-            # 缓存工具
-            for tool in tools:
-                self.tools[tool.name] = tool
-                logger.debug(f"缓存工具: {tool.name}")
-
-            logger.info(f"成功注册 {len(tools)} 个MCP工具: {[tool.name for tool in tools]}")
-            return tools
+        # 获取最新的启用配置（来自内存快照，变更后才会访问数据库）
+        self.mcp_servers_config = self._load_mcp_servers_config()
 
-        except Exception as e:
-            logger.error(f"注册MCP工具失败: {e}")
-            logger.error(f"错误类型: {type(e).__name__}")
-            import traceback
-            logger.error(f"详细错误信息: {traceback.format_exc()}")
-            logger.warning("将继续运行，但MCP工具不可用")
-            return []
+        snapshot = self._snapshot
+        if snapshot is None:
+            snapshot = await self._ensure_snapshot()
+        elif snapshot.servers_config != self.mcp_servers_config:
+            # 配置发生变化：后台构建新快照，本次继续使用旧快照
+            logger.info(f"检测到MCP配置变化，后台重建工具快照（当前 v{snapshot.version}）")
+            self.schedule_reload()
+
+        return list(snapshot.tools) if snapshot else []
+
+    @asynccontextmanager
+    async def lease(self):
+        """
+        租用当前工具快照
+
+        在 async with 块内快照不会被关闭，块结束后如果快照已被替换且没有其他运行，
+        旧客户端会被关闭。未能加载任何快照时产出None。
+        """
+        await self.register_mcp_tools()
+        snapshot = self._snapshot
+        if snapshot is None:
+            yield None
+            return
+
+        snapshot.active_runs += 1
+        if snapshot.active_runs == 1:
+            # 快照重新有运行在用，之前的排空信号不再有效
+            snapshot.drained.clear()
+        try:
+            yield snapshot
+        finally:
+            snapshot.active_runs -= 1
+            if snapshot.active_runs == 0:
+                snapshot.drained.set()
 
     def get_mcp_tool(self, tool_name: str) -> Optional[BaseTool]:
         """根据名称获取MCP工具"""
@@ -202,17 +396,132 @@ class MCPToolWrapper:
 
         return result
 
+    async def diagnose_servers(self, force_refresh: bool = False) -> Dict[str, Any]:
+        """
+        并发诊断所有启用的MCP服务器
+
+        对每个服务器执行真实的 initialize + list_tools 握手，并用一次 ping 作为
+        样例调用测量往返延迟。结果会短暂缓存，便于监控面板轮询。
+
+        Args:
+            force_refresh: 是否忽略缓存强制重新探测
+
+        Returns:
+            诊断结果字典
+        """
+        if not force_refresh and self._is_diagnosis_cache_valid():
+            return {**self._diagnosis_cache, "cached": True}
+
+        # 同一时刻只执行一轮探测，并发的轮询请求等待并复用这一轮的结果
+        async with self._diagnosis_lock:
+            if not force_refresh and self._is_diagnosis_cache_valid():
+                return {**self._diagnosis_cache, "cached": True}
+
+            config = mcp_config_service.get_enabled_configs_dict()
+            start = time.perf_counter()
+            servers = await asyncio.gather(
+                *(self._probe_server(name, cfg) for name, cfg in config.items())
+            )
+
+            diagnosis = {
+                "timestamp": datetime.now().isoformat(),
+                "total_configs": len(config),
+                "healthy_count": sum(1 for server in servers if server["status"] == "healthy"),
+                "elapsed_ms": round((time.perf_counter() - start) * 1000, 2),
+                "servers": list(servers),
+            }
+
+            self._diagnosis_cache = diagnosis
+            self._diagnosis_timestamp = time.time()
+            return {**diagnosis, "cached": False}
+
+    def _is_diagnosis_cache_valid(self) -> bool:
+        """检查诊断缓存是否有效"""
+        if self._diagnosis_cache is None or self._diagnosis_timestamp is None:
+            return False
+        return (time.time() - self._diagnosis_timestamp) < settings.mcp_diagnose_cache_ttl
+
+    async def _probe_server(self, name: str, config: Dict[str, Any]) -> Dict[str, Any]:
+        """对单个MCP服务器执行握手探测"""
+        transport = config.get("transport")
+        server_info = {
+            "name": name,
+            "transport": transport,
+            "status": "unknown",
+            "error": None,
+            "handshake_latency_ms": None,
+            "list_tools_latency_ms": None,
+            "sample_call_latency_ms": None,
+            "tool_count": None,
+        }
+
+        if transport in ("sse", "streamable_http"):
+            server_info["url"] = config.get("url")
+        elif transport == "stdio":
+            command = config.get("command")
+            server_info["command"] = command
+            # 命令不存在时无需启动进程即可判定失败
+            if not command or not shutil.which(command):
+                server_info["status"] = "command_not_found"
+                server_info["error"] = f"命令未找到: {command}"
+                return server_info
+
+        if not MCP_AVAILABLE:
+            server_info["status"] = "adapter_unavailable"
+            server_info["error"] = "langchain-mcp-adapters 未安装"
+            return server_info
+
+        timeout = settings.mcp_diagnose_timeout
+
+        async def _handshake():
+            client = MultiServerMCPClient({name: config})
+            start = time.perf_counter()
+            # session() 会完成 initialize 握手
+            async with client.session(name) as session:
+                server_info["handshake_latency_ms"] = round((time.perf_counter() - start) * 1000, 2)
+
+                list_start = time.perf_counter()
+                tools_result = await session.list_tools()
+                server_info["list_tools_latency_ms"] = round((time.perf_counter() - list_start) * 1000, 2)
+                server_info["tool_count"] = len(tools_result.tools)
+
+                # 使用 ping 作为样例调用，避免触发真实工具产生副作用
+                ping_start = time.perf_counter()
+                await session.send_ping()
+                server_info["sample_call_latency_ms"] = round((time.perf_counter() - ping_start) * 1000, 2)
+
+        try:
+            await asyncio.wait_for(_handshake(), timeout=timeout)
+            server_info["status"] = "healthy"
+        except asyncio.TimeoutError:
+            server_info["status"] = "timeout"
+            server_info["error"] = f"握手超时（{timeout}秒）"
+        except Exception as e:
+            # 传输层错误通常被 TaskGroup 包装，取出最内层的异常便于定位
+            root = e
+            while getattr(root, "exceptions", None):
+                root = root.exceptions[0]
+            error_str = str(root)
+            if type(root).__name__ == "ConnectError" or "All connection attempts failed" in error_str:
+                server_info["status"] = "unreachable"
+                server_info["error"] = f"连接失败: {error_str}"
+            else:
+                server_info["status"] = "error"
+                server_info["error"] = f"{type(root).__name__}: {error_str}"
+
+        return server_info
+
     async def close(self):
-        """关闭MCP客户端连接"""
-        if self.mcp_client:
-            try:
-                # 注意: MultiServerMCPClient可能没有显式的close方法
-                # 这里只是示例，实际实现可能需要根据具体API调整
-                if hasattr(self.mcp_client, 'close'):
-                    await self.mcp_client.close()
-                logger.info("MCP客户端连接已关闭")
-            except Exception as e:
-                logger.error(f"关闭MCP客户端失败: {e}")
+        """关闭当前快照及所有待排空快照的MCP客户端连接"""
+        for task in list(self._drain_tasks.values()):
+            task.cancel()
+        for snapshot in list(self._retired_snapshots.values()):
+            await self._close_client(snapshot.client)
+        self._retired_snapshots.clear()
+        if self._snapshot:
+            await self._close_client(self._snapshot.client)
+            self._snapshot = None
+        logger.info("MCP客户端连接已关闭")
 
 # 全局MCP工具管理器实例
 mcp_tool_manager = MCPToolWrapper()
\ No newline at end of file
@@ -0,0 +1,230 @@
+"""
+MCP工具结果后处理
+
+MCP工具返回的内容块会原样写入 ToolMessage 并随检查点持久化，之后每一步都会再次发送给模型。
+这里在结果进入消息历史前做规整：展平内容块、去掉冗余元数据，超过 token 预算时截断，
+完整内容写入旁路存储，模型可通过 read_tool_result 工具分页读取。
+"""
+import asyncio
+import json
+from typing import Any, Dict, List, Optional, Tuple
+from uuid import uuid4
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from langchain_core.tools import BaseTool, tool
+
+from app.core.config import settings
+from app.core.logger import logger
+from app.core.user_context import get_session_id
+
+# 内容块中对模型没有意义的字段
+_REDUNDANT_BLOCK_KEYS = {"annotations", "_meta", "meta", "id", "index"}
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：中日韩字符按 1 个 token，其余按 4 个字符 1 个 token"""
+    cjk = sum(1 for ch in text if "⺀" <= ch <= "鿿" or "가" <= ch <= "힯")
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _flatten_block(block: Any) -> str:
+    """把单个内容块转换为文本"""
+    if block is None:
+        return ""
+    if isinstance(block, str):
+        return block
+    if not isinstance(block, dict):
+        # 兼容 mcp.types 中的内容对象
+        if hasattr(block, "model_dump"):
+            block = block.model_dump()
+        else:
+            return str(block)
+
+    block_type = block.get("type")
+    if block_type == "text":
+        return block.get("text", "")
+    if block_type in ("image", "image_url", "audio"):
+        mime_type = block.get("mimeType") or block.get("mime_type") or block_type
+        return f"[{block_type}: {mime_type}]"
+    if block_type == "resource":
+        resource = block.get("resource") or {}
+        if resource.get("text"):
+            return resource["text"]
+        return f"[resource: {resource.get('uri', '')}]"
+    if block_type == "resource_link":
+        return f"[resource: {block.get('uri', '')}]"
+
+    cleaned = {k: v for k, v in block.items() if k not in _REDUNDANT_BLOCK_KEYS}
+    return json.dumps(cleaned, ensure_ascii=False, default=str)
+
+
+def flatten_content(content: Any) -> str:
+    """展平工具返回的内容（字符串、内容块或内容块列表）为纯文本"""
+    if isinstance(content, (list, tuple)):
+        parts = [_flatten_block(block) for block in content]
+        return "\n".join(part for part in parts if part)
+    return _flatten_block(content)
+
+
+def _save_full_result(session_id: Optional[str], tool_name: str, content: str) -> str:
+    """把完整结果写入旁路存储，顺带清理过期记录，返回结果句柄"""
+    result_id = uuid4().hex[:12]
+    conn = psycopg2.connect(settings.database_url)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "DELETE FROM tool_results WHERE created_at < NOW() - make_interval(hours => %s)",
+                (settings.mcp_result_retention_hours,),
+            )
+            cursor.execute(
+                """
+                INSERT INTO tool_results (id, session_id, tool_name, content, total_chars)
+                VALUES (%s, %s, %s, %s, %s)
+                """,
+                (result_id, session_id, tool_name, content, len(content)),
+            )
+        conn.commit()
+    finally:
+        conn.close()
+    return result_id
+
+
+def _truncate(text: str, token_budget: int) -> Tuple[str, str]:
+    """按 token 预算保留开头和结尾，返回 (开头, 结尾)"""
+    total_tokens = max(estimate_tokens(text), 1)
+    keep_chars = max(int(len(text) * token_budget / total_tokens), 1)
+    head_chars = int(keep_chars * 0.8)
+    tail_chars = keep_chars - head_chars
+    return text[:head_chars], text[-tail_chars:] if tail_chars else ""
+
+
+async def process_tool_result(content: Any, tool_name: str) -> str:
+    """
+    规整工具结果
+
+    Args:
+        content: 工具返回的原始内容
+        tool_name: 工具名称
+
+    Returns:
+        展平后的文本；超过预算时为截断文本及完整结果的读取说明
+    """
+    text = flatten_content(content)
+    token_budget = settings.mcp_result_token_budget
+    if token_budget <= 0:
+        return text
+
+    tokens = estimate_tokens(text)
+    if tokens <= token_budget:
+        return text
+
+    head, tail = _truncate(text, token_budget)
+    try:
+        session_id = get_session_id()
+        result_id = await asyncio.to_thread(
+            _save_full_result, str(session_id) if session_id else None, tool_name, text
+        )
+        retrieval_hint = (
+            f"完整结果已保存，句柄 result_id={result_id}，"
+            f"如需查看省略部分请调用 read_tool_result(result_id, offset, limit) 分页读取"
+        )
+    except Exception as e:
+        logger.error(f"保存工具 {tool_name} 的完整结果失败: {e}")
+        retrieval_hint = "完整结果保存失败，无法分页读取"
+
+    logger.info(f"工具 {tool_name} 结果约 {tokens} tokens，超过预算 {token_budget}，已截断")
+    omitted = len(text) - len(head) - len(tail)
+    return (
+        f"{head}\n\n"
+        f"...[结果过长已截断：共 {len(text)} 字符（约 {tokens} tokens），省略中间 {omitted} 字符。{retrieval_hint}]...\n\n"
+        f"{tail}"
+    )
+
+
+def _strip_artifact(artifact: Any) -> Any:
+    """去掉与文本内容重复的结构化内容，只保留图片等非文本附件"""
+    if isinstance(artifact, dict):
+        artifact = {k: v for k, v in artifact.items() if k != "structured_content"}
+        return artifact or None
+    return artifact
+
+
+def wrap_mcp_tool(mcp_tool: BaseTool) -> BaseTool:
+    """
+    为MCP工具加上结果后处理
+
+    返回一个替换了协程的工具副本，原工具不变。
+    """
+    original = getattr(mcp_tool, "coroutine", None)
+    if original is None:
+        return mcp_tool
+
+    tool_name = mcp_tool.name
+    content_and_artifact = getattr(mcp_tool, "response_format", "content") == "content_and_artifact"
+
+    async def _call(*args, **kwargs):
+        result = await original(*args, **kwargs)
+        if content_and_artifact and isinstance(result, tuple) and len(result) == 2:
+            content, artifact = result
+            return await process_tool_result(content, tool_name), _strip_artifact(artifact)
+        return await process_tool_result(result, tool_name)
+
+    return mcp_tool.model_copy(update={"coroutine": _call})
+
+
+@tool
+def read_tool_result(result_id: str, offset: int = 0, limit: Optional[int] = None) -> Dict[str, Any]:
+    """分页读取被截断的工具结果。
+
+    当工具结果过长被截断时，结果中会给出 result_id，使用该工具按字符偏移读取完整内容。
+
+    Args:
+        result_id: 截断提示中给出的结果句柄
+        offset: 起始字符偏移，默认为 0
+        limit: 本次读取的最大字符数，默认使用系统配置的分页大小
+
+    Returns:
+        包含本页内容、总长度和下一页偏移的字典
+    """
+    page_chars = settings.mcp_result_page_chars
+    limit = min(limit or page_chars, page_chars)
+    offset = max(offset, 0)
+
+    try:
+        conn = psycopg2.connect(settings.database_url)
+        try:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(
+                    """
+                    SELECT session_id, tool_name, total_chars,
+                           substr(content, %s, %s) AS page
+                    FROM tool_results WHERE id = %s
+                    """,
+                    (offset + 1, limit, result_id),
+                )
+                row = cursor.fetchone()
+        finally:
+            conn.close()
+    except Exception as e:
+        logger.error(f"读取工具结果失败: {e}")
+        return {"status": "error", "message": f"读取工具结果失败: {str(e)}"}
+
+    session_id = get_session_id()
+    if not row or (row["session_id"] and session_id and str(row["session_id"]) != str(session_id)):
+        return {"status": "error", "message": f"结果 {result_id} 不存在或已过期"}
+
+    next_offset = offset + len(row["page"])
+    return {
+        "status": "success",
+        "tool_name": row["tool_name"],
+        "total_chars": row["total_chars"],
+        "offset": offset,
+        "content": row["page"],
+        "next_offset": next_offset if next_offset < row["total_chars"] else None,
+    }
+
+
+def get_result_tools() -> List[BaseTool]:
+    """获取工具结果相关的工具"""
+    return [read_tool_result]
@@ -1,5 +1,5 @@
 from fastapi import APIRouter
-from app.api.routes import sessions, tools, users, agent, approvals, mcp_config, tasks, interrupts, dify_config
+from app.api.routes import sessions, tools, users, agent, approvals, mcp_config, tasks, interrupts, dify_config, realtime, confirmations
 
 api_router = APIRouter()
 # 先注册更具体的路由（带参数的）
@@ -10,8 +10,10 @@ api_router.include_router(tools.router)
 api_router.include_router(users.router)
 api_router.include_router(approvals.router)
 api_router.include_router(tasks.router)
+api_router.include_router(realtime.router)
 api_router.include_router(mcp_config.router, prefix="/api/mcp-configs", tags=["MCP配置"])
 api_router.include_router(dify_config.router, prefix="/api/dify-agents", tags=["Dify Agents"])
 api_router.include_router(interrupts.router)
+api_router.include_router(confirmations.router)
 
 __all__ = ["api_router"]
\ No newline at end of file
@@ -5,7 +5,9 @@ from datetime import datetime
 from pydantic import BaseModel
 from app.api.deps import get_db
 from app.agent.tools import tool_manager
+from app.core.config import settings
 from app.core.logger import logger
+from app.core.ttl_registry import TTLRegistry
 
 router = APIRouter(prefix="/api/approvals", tags=["approvals"])
 
@@ -23,8 +25,10 @@ class ApprovalItem(BaseModel):
     session_id: str
     created_at: datetime
 
-# 存储待审批项的内存存储（在实际应用中应使用数据库）
-pending_approvals = {}
+# 存储待审批项的内存存储（在实际应用中应使用数据库），与确认请求同样在 USER_CONFIRMATION_EXPIRE_HOURS 后过期
+pending_approvals: TTLRegistry[Dict[str, Any]] = TTLRegistry(
+    "pending_approvals", ttl=settings.user_confirmation_expire_hours * 3600
+)
 
 @router.post("/")
 def request_approval(request: ApprovalRequest, db = Depends(get_db)):
@@ -34,14 +38,14 @@ def request_approval(request: ApprovalRequest, db = Depends(get_db)):
         created_at = datetime.now()
         
         # 存储待审批项
-        pending_approvals[approval_id] = {
+        pending_approvals.set(approval_id, {
             "id": approval_id,
             "tool_name": request.tool_name,
             "tool_input": request.tool_input,
             "user_id": request.user_id,
             "session_id": request.session_id,
             "created_at": created_at
-        }
+        })
         
         return {
             "approval_id": approval_id,
@@ -69,14 +73,14 @@ def list_approvals(db = Depends(get_db)):
 def approve_execution(approval_id: str, db = Depends(get_db)):
     """批准工具执行"""
     try:
-        if approval_id not in pending_approvals:
+        # 只查一次：待审批项可能随时过期，先判断存在再取值会取到 None
+        approval_item = pending_approvals.get(approval_id)
+        if approval_item is None:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="审批请求未找到"
             )
         
-        approval_item = pending_approvals[approval_id]
-        
         # 执行工具
         result = tool_manager.execute_tool(
             approval_item["tool_name"], 
@@ -85,7 +89,7 @@ def approve_execution(approval_id: str, db = Depends(get_db)):
         )
         
         # 从待审批列表中移除
-        del pending_approvals[approval_id]
+        pending_approvals.pop(approval_id)
         
         return {
             "approval_id": approval_id,
@@ -104,15 +108,14 @@ def approve_execution(approval_id: str, db = Depends(get_db)):
 def reject_execution(approval_id: str, db = Depends(get_db)):
     """拒绝工具执行"""
     try:
-        if approval_id not in pending_approvals:
+        # 从待审批列表中移除
+        approval_item = pending_approvals.pop(approval_id)
+        if approval_item is None:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="审批请求未找到"
             )
         
-        # 从待审批列表中移除
-        approval_item = pending_approvals.pop(approval_id)
-        
         return {
             "approval_id": approval_id,
             "message": "工具执行已拒绝",
@@ -0,0 +1,98 @@
+"""
+用户确认API路由模块
+ask_user 暂停对话后，前端通过这里取回待确认问题并提交回答；回答后对话从检查点恢复
+"""
+from fastapi import APIRouter, HTTPException, status, Depends
+from uuid import UUID
+from datetime import datetime
+from app.core.logger import logger
+from app.api.deps import get_db
+from app.core.user_context import set_user_context
+from app.models.schemas import ConfirmationAnswerRequest
+from app.services.agent.confirmations import (
+    answer_confirmation,
+    build_resume_command,
+    list_pending_confirmations,
+    reopen_confirmation,
+)
+from app.services.agent.handlers import handle_blocking_chat, handle_streaming_chat
+from app.services.agent.utils import create_agent_config, format_error_message
+
+# 创建路由器
+router = APIRouter(prefix="/api/sessions", tags=["confirmations"])
+
+
+def _ensure_session_exists(db, session_id: UUID) -> None:
+    cursor = db.cursor()
+    cursor.execute(
+        "SELECT session_id FROM user_sessions WHERE session_id = %s",
+        (str(session_id),)
+    )
+    if not cursor.fetchone():
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="会话不存在"
+        )
+
+
+@router.get("/{session_id}/confirmations")
+async def get_pending_confirmations(session_id: UUID, db = Depends(get_db)):
+    """获取会话中等待用户回答的确认请求（前端连接或刷新后据此恢复确认对话框）"""
+    _ensure_session_exists(db, session_id)
+    try:
+        confirmations = await list_pending_confirmations(str(session_id))
+    except Exception as e:
+        logger.error(f"获取待确认问题失败: {str(e)}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"获取待确认问题失败: {str(e)}"
+        )
+    return {"session_id": str(session_id), "confirmations": confirmations}
+
+
+@router.post("/{session_id}/confirmations/{confirmation_id}")
+async def submit_confirmation(
+    session_id: UUID,
+    confirmation_id: str,
+    request: ConfirmationAnswerRequest,
+    db = Depends(get_db)
+):
+    """
+    回答确认请求，并从检查点恢复对话
+
+    恢复后的输出与聊天接口相同（按 response_mode 返回阻塞响应或SSE流）。
+    """
+    _ensure_session_exists(db, session_id)
+
+    response = {
+        "type": "user_confirmation_response",
+        "confirmation_id": confirmation_id,
+        "status": request.status,
+        "value": request.value,
+        "timestamp": datetime.now().isoformat()
+    }
+    user_id = await answer_confirmation(str(session_id), response)
+    if not user_id:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="确认请求不存在、已回答或已过期"
+        )
+
+    inputs = build_resume_command(response)
+    try:
+        # 设置用户上下文
+        set_user_context(user_id, str(session_id))
+
+        config = create_agent_config(session_id)
+        if request.response_mode == "streaming":
+            # 流式输出中的失败由 stream_chat_chunks 退回确认请求
+            return await handle_streaming_chat(session_id, inputs, config)
+        return await handle_blocking_chat(session_id, inputs, config)
+    except Exception as e:
+        logger.error(f"恢复对话失败: {str(e)}", exc_info=True)
+        # 线程仍停在确认请求上，退回等待状态以便用户重新回答
+        await reopen_confirmation(str(session_id), inputs)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"恢复对话失败: {format_error_message(e)}"
+        )
@@ -1,7 +1,7 @@
 """Dify Agent 配置管理 API 路由"""
 
 from fastapi import APIRouter, HTTPException, status, Depends
-from typing import List
+from typing import List, Optional
 from uuid import UUID
 import time
 
@@ -11,6 +11,7 @@ from app.models.schemas import (
     DifyAgentResponse,
     DifyAgentTestRequest,
     DifyAgentTestResponse,
+    DifyBenchmarkRequest,
 )
 from app.services.dify.manager import get_dify_manager
 from app.services.dify.client import DifyClient
@@ -127,6 +128,99 @@ async def list_dify_agents(
         )
 
 
+@router.get("/breakers")
+async def list_dify_breakers():
+    """查看各 Dify Agent 的熔断状态、失败率和 p99 耗时"""
+    from app.services.dify.circuit_breaker import dify_breakers
+    return {"breakers": dify_breakers.snapshot()}
+
+
+@router.post("/benchmark")
+async def benchmark_dify_agents(request: DifyBenchmarkRequest):
+    """并发探测 Dify Agent，返回 p50/p95/p99 延迟、首字节时间、错误率和吞吐量，并保存历史"""
+    from app.core.config import settings
+    from app.services.dify.benchmark import dify_benchmark_service
+    try:
+        agents = await get_dify_manager().load_agents()
+        if request.agent_ids:
+            wanted = set(request.agent_ids)
+            agents = [agent for agent in agents if agent.id in wanted]
+        if not agents:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="没有可测试的 Dify Agent",
+            )
+
+        logger.info(f"收到 Dify 基准测试请求: Agent 数={len(agents)}, 每个探测 {request.probes_per_agent} 次")
+        return await dify_benchmark_service.run(
+            agents,
+            probes_per_agent=request.probes_per_agent,
+            concurrency=request.concurrency or settings.dify_benchmark_concurrency,
+            queries=request.queries,
+            timeout=request.timeout,
+            user_id=request.user_id,
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Dify 基准测试失败: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Dify 基准测试失败: {str(e)}",
+        )
+
+
+@router.get("/benchmark/history")
+async def get_benchmark_history(agent_id: Optional[str] = None, limit: int = 20):
+    """查询基准测试历史；指定 agent_id 时返回该 Agent 每次测试的指标，用于趋势对比"""
+    from app.services.dify.benchmark import dify_benchmark_service
+    try:
+        history = await dify_benchmark_service.history(agent_id, min(max(limit, 1), 200))
+        return {"history": history}
+    except Exception as e:
+        logger.error(f"查询 Dify 基准测试历史失败: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"查询 Dify 基准测试历史失败: {str(e)}",
+        )
+
+
+@router.get("/runs")
+async def list_workflow_runs(session_id: Optional[str] = None, limit: int = 20):
+    """列出最近的后台工作流运行（可按会话过滤）"""
+    from app.services.dify.workflow_runs import dify_workflow_runs
+    try:
+        runs = await dify_workflow_runs.list_runs(session_id, min(max(limit, 1), 100))
+        return {"runs": runs}
+    except Exception as e:
+        logger.error(f"查询 Dify 工作流运行失败: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"查询 Dify 工作流运行失败: {str(e)}",
+        )
+
+
+@router.get("/runs/{run_id}")
+async def get_workflow_run(run_id: str, wait: float = 0):
+    """查询后台工作流运行的状态、节点进度和结果；wait > 0 时最多等待该秒数直到运行结束"""
+    from app.core.config import settings
+    from app.services.dify.workflow_runs import dify_workflow_runs
+    try:
+        run = await dify_workflow_runs.wait(run_id, timeout=min(max(wait, 0), settings.dify_workflow_max_wait))
+    except Exception as e:
+        logger.error(f"查询 Dify 工作流运行失败: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"查询 Dify 工作流运行失败: {str(e)}",
+        )
+    if not run:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"工作流运行不存在: {run_id}",
+        )
+    return run
+
+
 @router.get("/{agent_id}", response_model=DifyAgentResponse)
 async def get_dify_agent(
     agent_id: UUID,
@@ -289,7 +383,7 @@ async def test_dify_agent(
                 detail=f"Dify Agent 不存在: {agent_id}",
             )
 
-        # 创建客户端并测试
+        # 创建客户端并测试（复用共享连接，延迟不含连接建立开销）
         client = DifyClient(
             base_url=agent.base_url,
             api_key=agent.api_key,
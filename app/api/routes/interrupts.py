@@ -47,7 +47,7 @@ async def interrupt_session(
         
         # 请求中断
         interrupt_service = get_interrupt_service()
-        interrupt_service.request_interrupt(str(session_id), request.reason)
+        await interrupt_service.request_interrupt(str(session_id), request.reason)
         
         logger.info(f"已请求中断会话: session_id={session_id}, reason={request.reason}")
         
@@ -5,7 +5,6 @@ MCP服务器配置管理API路由
 from fastapi import APIRouter, HTTPException, status, Depends
 from typing import List, Dict, Any
 from uuid import UUID
-from datetime import datetime
 
 from app.models.schemas import (
     MCPServerConfig, 
@@ -36,6 +35,7 @@ def create_mcp_config(
 
         config = mcp_config_service.create_mcp_config(config_data)
         logger.info(f"创建MCP配置成功: {config.name}")
+        mcp_config_service.publish_config_change("created", config.name)
         return config
         
     except ValueError as e:
@@ -112,6 +112,7 @@ def update_mcp_config(
             )
             
         logger.info(f"更新MCP配置成功: {config.name}")
+        mcp_config_service.publish_config_change("updated", config.name)
         return config
         
     except ValueError as e:
@@ -144,6 +145,7 @@ def delete_mcp_config(
             )
             
         logger.info(f"删除MCP配置成功: {config_id}")
+        mcp_config_service.publish_config_change("deleted", str(config_id))
         return {"message": "MCP配置删除成功"}
         
     except HTTPException:
@@ -177,6 +179,7 @@ def toggle_mcp_config(
         
         status_text = "启用" if updated_config.enabled else "禁用"
         logger.info(f"{status_text}MCP配置: {updated_config.name}")
+        mcp_config_service.publish_config_change("enabled" if updated_config.enabled else "disabled", updated_config.name)
         
         return {
             "message": f"MCP配置已{status_text}",
@@ -261,78 +264,23 @@ async def test_mcp_config(db = Depends(get_db)):
         )
 
 @router.post("/diagnose")
-async def diagnose_mcp_connection(db = Depends(get_db)):
-    """诊断MCP服务器连接状态"""
-    try:
-        import httpx
-        from app.services.mcp import mcp_config_service
-
-        logger.info("收到MCP连接诊断请求")
+async def diagnose_mcp_connection(refresh: bool = False, db = Depends(get_db)):
+    """
+    诊断MCP服务器连接状态
 
-        # 获取所有启用的配置
-        configs = mcp_config_service.list_mcp_configs(enabled_only=True)
+    并发对所有启用的服务器执行真实的MCP握手，返回握手延迟、工具数量和样例调用延迟。
+    结果会短暂缓存，传入 refresh=true 可强制重新探测。
+    """
+    try:
+        from app.agent.tools.mcp_tools import mcp_tool_manager
 
-        diagnosis = {
-            "timestamp": datetime.now().isoformat(),
-            "total_configs": len(configs),
-            "servers": []
-        }
+        logger.info(f"收到MCP连接诊断请求: refresh={refresh}")
+        diagnosis = await mcp_tool_manager.diagnose_servers(force_refresh=refresh)
 
-        # 测试每个服务器的连接
-        for config in configs:
-            server_info = {
-                "name": config.name,
-                "transport": config.config.get("transport"),
-                "status": "unknown",
-                "error": None
-            }
-
-            try:
-                transport = config.config.get("transport")
-
-                if transport == "sse" or transport == "streamable_http":
-                    url = config.config.get("url")
-                    if url:
-                        server_info["url"] = url
-                        # 尝试连接
-                        async with httpx.AsyncClient(timeout=5.0) as client:
-                            try:
-                                response = await client.head(url)
-                                server_info["status"] = "reachable"
-                                server_info["http_status"] = response.status_code
-                            except httpx.ConnectError as e:
-                                server_info["status"] = "unreachable"
-                                server_info["error"] = f"连接失败: {str(e)}"
-                            except httpx.TimeoutException:
-                                server_info["status"] = "timeout"
-                                server_info["error"] = "连接超时（5秒）"
-                            except Exception as e:
-                                server_info["status"] = "error"
-                                server_info["error"] = str(e)
-
-                elif transport == "stdio":
-                    command = config.config.get("command")
-                    if command:
-                        server_info["command"] = command
-                        # 检查命令是否存在
-                        import shutil
-                        if shutil.which(command):
-                            server_info["status"] = "command_found"
-                        else:
-                            server_info["status"] = "command_not_found"
-                            server_info["error"] = f"命令未找到: {command}"
-
-                else:
-                    server_info["status"] = "unknown_transport"
-                    server_info["error"] = f"未知的传输类型: {transport}"
-
-            except Exception as e:
-                server_info["status"] = "error"
-                server_info["error"] = str(e)
-
-            diagnosis["servers"].append(server_info)
-
-        logger.info(f"MCP连接诊断完成: {diagnosis}")
+        logger.info(
+            f"MCP连接诊断完成: {diagnosis['healthy_count']}/{diagnosis['total_configs']} 个服务器正常, "
+            f"耗时 {diagnosis['elapsed_ms']}ms, cached={diagnosis['cached']}"
+        )
         return diagnosis
 
     except Exception as e:
@@ -0,0 +1,198 @@
+"""
+实时通道 API 路由模块
+一个 WebSocket 连接同时承载对话流、工具事件、任务变更、用户确认和中断，
+消息均为带 type 字段的 JSON 帧；原有 SSE 对话接口和任务 WebSocket 保持不变
+"""
+import asyncio
+import json
+from typing import Any, Dict, Optional
+from uuid import UUID, uuid4
+
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+
+from app.core.config import settings
+from app.core.db_pool import pooled_connection
+from app.core.logger import logger
+from app.core.user_context import set_user_context
+from app.core.ws_connections import ConnectionClosedError, SessionConnection, session_connections
+from app.models.schemas import ChunkChatCompletionResponse
+from app.services.agent.confirmations import answer_confirmation, build_resume_command
+from app.services.agent.handlers import stream_chat_chunks
+from app.services.agent.interrupt_service import get_interrupt_service
+from app.services.agent.utils import build_agent_inputs, create_agent_config
+
+# 创建路由器
+router = APIRouter(prefix="/api/realtime", tags=["realtime"])
+
+# 会话不存在时的关闭码
+SESSION_NOT_FOUND_CLOSE_CODE = 4404
+
+# 对话流响应块的 message_type -> 帧类型
+CHAT_FRAME_TYPES = {
+    "assistant": "chat_delta",
+    "tool_call": "tool_call",
+    "tool_progress": "tool_progress",
+    "tool_result": "tool_result",
+}
+
+
+def _chat_frame_type(chunk: ChunkChatCompletionResponse) -> str:
+    if chunk.status == "error":
+        return "chat_error"
+    if chunk.is_final:
+        return "chat_done"
+    return CHAT_FRAME_TYPES.get(chunk.message_type, "chat_delta")
+
+
+async def _get_session_user_id(session_id: str) -> Optional[str]:
+    """查询会话所属用户，会话不存在时返回 None"""
+    async with pooled_connection() as conn:
+        cursor = await conn.execute(
+            "SELECT user_id FROM user_sessions WHERE session_id = %s",
+            (session_id,),
+        )
+        row = await cursor.fetchone()
+    return str(row[0]) if row else None
+
+
+async def _run_chat(
+    connection: SessionConnection,
+    session_id: str,
+    user_id: str,
+    request_id: str,
+    inputs: Any,
+) -> None:
+    """
+    执行一次对话，把响应块作为带序号的帧发送（受客户端确认窗口限制）
+
+    inputs 为新消息构造的输入，或回答确认请求后恢复线程的 Command。
+    """
+    set_user_context(user_id, session_id)
+    config = create_agent_config(UUID(session_id))
+    try:
+        async for chunk in stream_chat_chunks(UUID(session_id), inputs, config):
+            await connection.send_flow({
+                "type": _chat_frame_type(chunk),
+                "request_id": request_id,
+                "data": chunk.model_dump(exclude_none=True),
+            })
+    except ConnectionClosedError as e:
+        logger.warning(f"实时通道已关闭，停止对话输出: session_id={session_id}, request_id={request_id}, 原因={e}")
+    except Exception as e:
+        # 恢复对话时确认请求已由 stream_chat_chunks 退回等待状态
+        logger.error(f"实时通道对话失败: session_id={session_id}, request_id={request_id}, error={e}", exc_info=True)
+        connection.send_json({
+            "type": "error",
+            "code": "chat_failed",
+            "message": f"对话执行失败: {e}",
+            "request_id": request_id,
+        })
+
+
+@router.websocket("/ws/{session_id}")
+async def realtime_channel(websocket: WebSocket, session_id: UUID):
+    """
+    实时通道
+
+    客户端帧：
+        chat（message, request_id）、ack（seq）、interrupt（reason）、
+        user_confirmation_response（回答后在本连接上恢复对话，request_id 可选）、heartbeat
+    服务端帧：
+        connected、chat_delta / tool_call / tool_progress / tool_result / chat_done / chat_error（带 seq，需要 ack）、
+        task_update、user_confirmation_request、interrupt_ack、heartbeat_ack、error
+        对话停在 ask_user 上时 chat_done 的 data.status 为 waiting_confirmation
+    """
+    session_id_str = str(session_id)
+    await websocket.accept()
+
+    user_id = await _get_session_user_id(session_id_str)
+    if not user_id:
+        await websocket.send_text(json.dumps({"type": "error", "code": "session_not_found", "message": "会话不存在"}))
+        await websocket.close(code=SESSION_NOT_FOUND_CLOSE_CODE)
+        return
+
+    # 与任务 WebSocket 共用连接注册表，任务变更和确认请求经同一个连接送达
+    connection = await session_connections.connect(session_id_str, websocket)
+    logger.info(f"实时通道已建立: session_id={session_id_str}, connection={connection.id}")
+    chat_task: Optional[asyncio.Task] = None
+
+    def _send_error(code: str, message: str, request_id: Optional[str] = None) -> None:
+        frame: Dict[str, Any] = {"type": "error", "code": code, "message": message}
+        if request_id:
+            frame["request_id"] = request_id
+        connection.send_json(frame)
+
+    try:
+        connection.send_json({
+            "type": "connected",
+            "session_id": session_id_str,
+            "connection_id": connection.id,
+            "flow_window": settings.ws_flow_window,
+        })
+
+        while not connection.closed:
+            data = await asyncio.wait_for(websocket.receive_text(), timeout=60.0)
+            try:
+                message = json.loads(data)
+            except json.JSONDecodeError:
+                logger.warning(f"实时通道收到无效的JSON消息: {data}")
+                continue
+
+            if not isinstance(message, dict):
+                _send_error("bad_frame", "帧必须是 JSON 对象")
+                continue
+
+            frame_type = message.get("type")
+            if frame_type == "ack":
+                # 格式错误的确认帧只回复错误，不关闭连接（否则会中断进行中的对话）
+                try:
+                    seq = int(message.get("seq") or 0)
+                except (TypeError, ValueError):
+                    _send_error("bad_frame", f"ack 帧的 seq 无效: {message.get('seq')!r}")
+                    continue
+                connection.ack(seq)
+            elif frame_type == "heartbeat":
+                connection.send_json({"type": "heartbeat_ack"})
+            elif frame_type == "chat":
+                request_id = str(message.get("request_id") or uuid4().hex[:8])
+                text = (message.get("message") or "").strip()
+                if not text:
+                    _send_error("empty_message", "消息内容不能为空", request_id)
+                elif chat_task is not None and not chat_task.done():
+                    _send_error("busy", "当前连接上已有进行中的对话", request_id)
+                else:
+                    inputs = build_agent_inputs(text, session_id, user_id)
+                    chat_task = asyncio.create_task(
+                        _run_chat(connection, session_id_str, user_id, request_id, inputs)
+                    )
+            elif frame_type == "interrupt":
+                reason = message.get("reason") or "User requested interrupt"
+                await get_interrupt_service().request_interrupt(session_id_str, reason)
+                connection.send_json({"type": "interrupt_ack", "session_id": session_id_str})
+            elif frame_type == "user_confirmation_response":
+                request_id = str(message.get("request_id") or uuid4().hex[:8])
+                if chat_task is not None and not chat_task.done():
+                    _send_error("busy", "当前连接上已有进行中的对话", request_id)
+                elif not await answer_confirmation(session_id_str, message):
+                    _send_error("confirmation_not_pending", "确认请求不存在、已回答或已过期", request_id)
+                else:
+                    # 回答生效后从检查点恢复对话，输出与普通对话一样经本连接发送
+                    chat_task = asyncio.create_task(
+                        _run_chat(connection, session_id_str, user_id, request_id, build_resume_command(message))
+                    )
+            else:
+                _send_error("unknown_type", f"未知的帧类型: {frame_type}")
+    except WebSocketDisconnect:
+        logger.info(f"实时通道断开: session_id={session_id_str}, connection={connection.id}")
+    except Exception as e:
+        logger.error(f"实时通道异常: session_id={session_id_str}, connection={connection.id}, error={e}")
+    finally:
+        # 客户端离开时停止本连接发起的对话，与 SSE 断开时的行为一致
+        if chat_task is not None and not chat_task.done():
+            chat_task.cancel()
+            await asyncio.gather(chat_task, return_exceptions=True)
+        try:
+            await session_connections.disconnect(connection)
+        except Exception as e:
+            logger.error(f"取消会话消息订阅失败: {e}")
+        logger.info(f"实时通道已关闭: session_id={session_id_str}, connection={connection.id}")
@@ -4,7 +4,10 @@ from uuid import UUID, uuid4
 from datetime import datetime, timedelta
 from app.models.schemas import Session, SessionCreate
 from app.api.deps import get_db
+from psycopg2.extras import RealDictCursor
 from app.core.logger import logger
+from app.services.tasks import MAX_PAGE_SIZE, TASK_VIEWS, VIEW_FLAT, build_task_page, build_task_queries
+from app.agent.tools.custom_tools import TaskStatus
 
 router = APIRouter(prefix="/api/sessions", tags=["sessions"])
 
@@ -122,6 +125,13 @@ def delete_session(session_id: UUID, db = Depends(get_db)):
         db.commit()
         logger.info(f"已删除 {task_count} 个与会话 {session_id} 相关的任务")
         
+        # 清除该会话复用的 Dify conversation_id 映射
+        cursor.execute(
+            "DELETE FROM dify_conversations WHERE session_id = %s",
+            (str(session_id),)
+        )
+        db.commit()
+
         # 然后删除LangGraph检查点数据
         from langgraph.checkpoint.postgres import PostgresSaver
         from app.core.config import settings
@@ -396,36 +406,37 @@ def get_session_messages(session_id: UUID, db = Depends(get_db)):
 
 
 @router.get("/{session_id}/tasks")
-def get_session_tasks(session_id: UUID, db = Depends(get_db)):
+def get_session_tasks(
+    session_id: UUID,
+    view: str = Query(VIEW_FLAT, description="flat: 平铺列表；tree: 嵌套任务树，附带按状态汇总的 rollup"),
+    task_status: Optional[str] = Query(None, alias="status", description="按任务状态筛选"),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE, description="每页数量，树形视图中按根任务计；不传时返回全部"),
+    offset: int = Query(0, ge=0),
+    db = Depends(get_db),
+):
     """获取会话任务列表"""
+    if view not in TASK_VIEWS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"view 必须是 {', '.join(TASK_VIEWS)} 之一"
+        )
+    task_statuses = [item.value for item in TaskStatus]
+    if task_status and task_status not in task_statuses:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"status 必须是 {', '.join(task_statuses)} 之一"
+        )
     try:
-        cursor = db.cursor()
-        
-        # 查询该会话下的所有任务
-        cursor.execute("""
-            SELECT id, user_id, session_id, content, status, parent_task_id, created_at, updated_at
-            FROM tasks 
-            WHERE session_id = %s
-            ORDER BY created_at ASC
-        """, (str(session_id),))
-        
-        tasks = cursor.fetchall()
-        
-        # 格式化任务数据
-        formatted_tasks = []
-        for task in tasks:
-            formatted_tasks.append({
-                "id": task[0],
-                "user_id": str(task[1]) if task[1] else None,
-                "session_id": str(task[2]) if task[2] else None,
-                "content": task[3],
-                "status": task[4],
-                "parent_task_id": task[5],
-                "created_at": task[6].isoformat() if task[6] else None,
-                "updated_at": task[7].isoformat() if task[7] else None
-            })
-        
-        return {"tasks": formatted_tasks}
+        counts_query, tasks_query = build_task_queries(
+            view, str(session_id), status=task_status, limit=limit, offset=offset
+        )
+        with db.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute(*counts_query)
+            counts_rows = cursor.fetchall()
+            cursor.execute(*tasks_query)
+            task_rows = cursor.fetchall()
+
+        return build_task_page(view, counts_rows, task_rows, task_status, limit, offset)
         
     except Exception as e:
         logger.error(f"获取会话任务失败: {e}")
@@ -1,88 +1,117 @@
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
-from typing import Dict, List
+from typing import Any, Dict, List, Optional, Set
 from uuid import UUID
 from app.core.logger import logger
+from app.core.session_backplane import get_session_backplane
+from app.core.ws_connections import session_connections
 import json
 import asyncio
-from fastapi.responses import StreamingResponse
-from datetime import datetime
 
 router = APIRouter(prefix="/api/tasks", tags=["tasks"])
 
-# 存储WebSocket连接
-# 修改为每个会话只保持一个WebSocket连接
-websocket_connections: Dict[str, WebSocket] = {}
+async def notify_task_update(session_id: str, tasks: Optional[List[Dict[str, Any]]] = None):
+    """
+    通知指定会话的任务更新
 
-# 存储连接状态信息
-connection_status: Dict[str, dict] = {}
-
-# 导出 websocket_connections 供其他模块使用
-__all__ = ["router", "notify_task_update", "websocket_connections", "connection_status"]
-
-async def notify_task_update(session_id: str):
-    """通知指定会话的任务更新"""
+    Args:
+        session_id: 会话ID
+        tasks: 变更任务的最新状态，客户端按 id 原地更新；为 None 时要求客户端整体刷新
+    """
     session_id_str = str(session_id)
-    logger.info(f"准备通知任务更新: session_id={session_id_str}")
-    
-    if session_id_str in websocket_connections:
-        # 更新连接状态
-        if session_id_str in connection_status:
-            connection_status[session_id_str]["last_activity"] = datetime.now().isoformat()
-        
-        # 向WebSocket连接发送更新消息
-        try:
-            await websocket_connections[session_id_str].send_text(json.dumps({
-                "type": "task_update", 
-                "session_id": session_id_str
-            }))
-            logger.info(f"已向会话 {session_id_str} 发送任务更新通知")
-        except WebSocketDisconnect:
-            # 连接已断开，清理连接
-            del websocket_connections[session_id_str]
-            if session_id_str in connection_status:
-                connection_status[session_id_str]["state"] = "disconnected"
-                connection_status[session_id_str]["disconnected_at"] = datetime.now().isoformat()
-            logger.info(f"WebSocket连接已断开并清理: session_id={session_id_str}")
-        except Exception as e:
-            logger.error(f"向WebSocket发送消息失败: {e}", exc_info=True)
+    logger.info(f"准备通知任务更新: session_id={session_id_str}, 变更任务数={len(tasks) if tasks is not None else '全部'}")
+    message = {"type": "task_update", "session_id": session_id_str}
+    if tasks is None:
+        message["refetch"] = True
     else:
-        logger.info(f"会话 {session_id_str} 没有活跃的WebSocket连接")
+        message["task_ids"] = [task["id"] for task in tasks]
+        message["tasks"] = tasks
+
+    # 经会话消息总线广播，由持有该会话连接的 worker 转发给前端
+    backplane = get_session_backplane()
+    try:
+        await backplane.publish(session_id_str, message)
+    except ValueError:
+        # 变更内容超过通知负载上限时改为通知前端整体刷新
+        await backplane.publish(session_id_str, {"type": "task_update", "session_id": session_id_str, "refetch": True})
+    logger.info(f"已发布会话 {session_id_str} 的任务更新通知")
+
+# 经任务WebSocket回答确认后在后台恢复的对话（保留引用，避免任务被回收）
+_resume_tasks: Set[asyncio.Task] = set()
+
+async def _resume_in_background(session_id_str: str, user_id: str, response: Dict[str, Any]) -> None:
+    """从检查点恢复对话直到结束，完成后通知前端重新加载会话消息"""
+    # 延迟导入以避免循环导入
+    from app.core.user_context import set_user_context
+    from app.services.agent.confirmations import build_resume_command
+    from app.services.agent.handlers import stream_chat_chunks
+    from app.services.agent.utils import create_agent_config
+
+    set_user_context(user_id, session_id_str)
+    status = "completed"
+    try:
+        async for chunk in stream_chat_chunks(UUID(session_id_str), build_resume_command(response), create_agent_config(UUID(session_id_str))):
+            if chunk.is_final:
+                status = chunk.status
+    except Exception as e:
+        # 确认请求已由 stream_chat_chunks 退回等待状态，前端重新加载后可再次回答
+        logger.error(f"确认后恢复对话失败: session_id={session_id_str}, error={e}", exc_info=True)
+        status = "error"
+    await get_session_backplane().publish(session_id_str, {
+        "type": "conversation_resumed",
+        "session_id": session_id_str,
+        "status": status,
+    })
+    logger.info(f"确认后恢复的对话已结束: session_id={session_id_str}, status={status}")
+
+async def route_confirmation_response(session_id_str: str, message: Dict[str, Any]) -> bool:
+    """
+    处理前端经任务WebSocket提交的用户确认响应：记录回答并在后台从检查点恢复对话
+
+    Returns:
+        回答是否生效（确认请求不存在、已回答或已过期时为 False）
+    """
+    # 延迟导入以避免循环导入
+    from app.services.agent.confirmations import answer_confirmation
+
+    user_id = await answer_confirmation(session_id_str, message)
+    if not user_id:
+        return False
+    task = asyncio.create_task(_resume_in_background(session_id_str, user_id, message))
+    _resume_tasks.add(task)
+    task.add_done_callback(_resume_tasks.discard)
+    return True
+
+@router.get("/connections")
+async def list_connections():
+    """本进程内各会话的WebSocket连接状态"""
+    return session_connections.snapshot()
 
 @router.websocket("/ws/{session_id}")
 async def websocket_tasks(websocket: WebSocket, session_id: UUID):
-    """任务WebSocket端点"""
+    """任务WebSocket端点（同一会话允许多个连接，消息广播给全部连接）"""
     session_id_str = str(session_id)
-    
-    # 如果会话已有连接，先关闭旧连接
-    if session_id_str in websocket_connections:
-        try:
-            await websocket_connections[session_id_str].close()
-            del websocket_connections[session_id_str]
-            logger.info(f"已关闭会话 {session_id_str} 的旧WebSocket连接")
-        except Exception as e:
-            logger.error(f"关闭旧WebSocket连接失败: {e}", exc_info=True)
-    
+
     # 接受WebSocket连接
     await websocket.accept()
-    
-    # 将连接存储到会话中（每个会话只保持一个连接）
-    websocket_connections[session_id_str] = websocket
-    connection_status[session_id_str] = {
-        "connected_at": datetime.now().isoformat(),
-        "client": websocket.client,
-        "state": "connected"
-    }
-    logger.info(f"任务WebSocket连接已建立: session_id={session_id_str}")
-    
+
+    # 登记连接：所有发往该连接的消息都经过它的有界发送队列；
+    # 会话在本进程内的第一个连接会订阅会话消息总线，其他 worker 发往该会话的消息也能送达
+    connection = await session_connections.connect(session_id_str, websocket)
+    logger.info(
+        f"任务WebSocket连接已建立: session_id={session_id_str}, connection={connection.id}, "
+        f"当前连接数={len(session_connections.connections(session_id_str))}"
+    )
+
     try:
         # 发送初始连接确认消息
-        await websocket.send_text(json.dumps({
-            "type": "connected", 
-            "session_id": session_id_str
-        }))
-        
+        connection.send_json({
+            "type": "connected",
+            "session_id": session_id_str,
+            "connection_id": connection.id
+        })
+
         # 保持连接并监听客户端消息
-        while True:
+        while not connection.closed:
             # 等待接收消息，设置60秒超时
             data = await asyncio.wait_for(websocket.receive_text(), timeout=60.0)
             try:
@@ -90,34 +119,26 @@ async def websocket_tasks(websocket: WebSocket, session_id: UUID):
                 # 处理心跳消息
                 if message.get("type") == "heartbeat":
                     # 回复心跳
-                    await websocket.send_text(json.dumps({
+                    connection.send_json({
                         "type": "heartbeat_ack"
-                    }))
+                    })
                 # 处理用户确认响应
                 elif message.get("type") == "user_confirmation_response":
-                    confirmation_id = message.get("confirmation_id")
-                    if confirmation_id:
-                        # 延迟导入以避免循环导入
-                        from app.agent.tools.custom_tools import resolve_user_confirmation
-                        
-                        # 解决用户确认请求
-                        resolve_user_confirmation(confirmation_id, message)
-                        logger.info(f"已处理用户确认响应: confirmation_id={confirmation_id}")
+                    await route_confirmation_response(session_id_str, message)
                 # 可以在这里处理其他类型的消息
             except json.JSONDecodeError:
                 logger.warning(f"收到无效的JSON消息: {data}")
     except WebSocketDisconnect:
-        logger.info(f"任务WebSocket连接断开: session_id={session_id_str}")
+        logger.info(f"任务WebSocket连接断开: session_id={session_id_str}, connection={connection.id}")
     except Exception as e:
-        logger.error(f"任务WebSocket连接异常: session_id={session_id_str}, error={e}")
+        logger.error(f"任务WebSocket连接异常: session_id={session_id_str}, connection={connection.id}, error={e}")
     finally:
-        # 清理连接
-        if session_id_str in websocket_connections and websocket_connections[session_id_str] == websocket:
-            del websocket_connections[session_id_str]
-            if session_id_str in connection_status:
-                connection_status[session_id_str]["state"] = "disconnected"
-                connection_status[session_id_str]["disconnected_at"] = datetime.now().isoformat()
-            logger.info(f"WebSocket连接已关闭: session_id={session_id_str}")
+        # 清理连接，会话没有其他连接时取消总线订阅
+        try:
+            await session_connections.disconnect(connection)
+        except Exception as e:
+            logger.error(f"取消会话消息订阅失败: {e}")
+        logger.info(f"WebSocket连接已关闭: session_id={session_id_str}, connection={connection.id}")
 
 # 导出通知函数供其他模块使用
-__all__ = ["router", "notify_task_update"]
\ No newline at end of file
+__all__ = ["router", "notify_task_update", "route_confirmation_response"]
@@ -0,0 +1,59 @@
+"""
+数据库连接池
+工具等高频短事务复用异步连接，避免每次调用都重新建立 TCP 连接和认证，也不占用线程池线程
+"""
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+import psycopg
+from psycopg_pool import AsyncConnectionPool
+
+from app.core.config import settings
+from app.core.logger import logger
+
+_async_pool: Optional[AsyncConnectionPool] = None
+_async_pool_lock = asyncio.Lock()
+
+
+async def get_async_pool() -> AsyncConnectionPool:
+    """获取（必要时创建并打开）进程级异步连接池"""
+    global _async_pool
+    if _async_pool is None:
+        async with _async_pool_lock:
+            if _async_pool is None:
+                pool = AsyncConnectionPool(
+                    settings.database_url,
+                    min_size=settings.db_pool_min_size,
+                    max_size=settings.db_pool_max_size,
+                    timeout=settings.db_pool_timeout,
+                    open=False,
+                )
+                await pool.open()
+                _async_pool = pool
+                logger.info(
+                    f"数据库连接池已创建: min={settings.db_pool_min_size}, max={settings.db_pool_max_size}"
+                )
+    return _async_pool
+
+
+@asynccontextmanager
+async def pooled_connection() -> AsyncIterator[psycopg.AsyncConnection]:
+    """
+    从连接池借出连接，代码块内的操作在同一个事务中
+
+    正常退出时提交，出现异常时回滚；连接池耗尽时最多等待 DB_POOL_TIMEOUT 秒。
+    """
+    pool = await get_async_pool()
+    async with pool.connection() as conn:
+        yield conn
+
+
+async def close_async_pool() -> None:
+    """关闭连接池中的所有连接"""
+    global _async_pool
+    async with _async_pool_lock:
+        if _async_pool is not None:
+            await _async_pool.close()
+            _async_pool = None
+            logger.info("数据库连接池已关闭")
@@ -0,0 +1,227 @@
+"""
+Postgres LISTEN/NOTIFY 订阅中心
+使用一条专用的异步连接监听多个频道，并把通知分发给进程内的回调
+"""
+import asyncio
+import inspect
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional, Set
+
+import psycopg
+import psycopg2
+from psycopg import sql
+
+from app.core.config import settings
+from app.core.logger import logger
+
+# 回调签名: callback(payload)。payload 为 None 表示监听连接刚刚（重新）建立，
+# 期间可能丢失了通知，订阅方应按"数据已变化"处理。
+NotifyCallback = Callable[[Optional[str]], Any]
+
+# Postgres NOTIFY 负载的最大字节数
+MAX_PAYLOAD_BYTES = 7999
+
+
+class PgNotifyHub:
+    """Postgres LISTEN/NOTIFY 订阅中心"""
+
+    def __init__(self, dsn: str, poll_interval: float = 0.2):
+        """
+        Args:
+            dsn: 数据库连接串
+            poll_interval: 监听循环检查新订阅的间隔（秒），不影响通知本身的投递延迟
+        """
+        self.dsn = dsn
+        self.poll_interval = poll_interval
+        self._callbacks: Dict[str, List[NotifyCallback]] = defaultdict(list)
+        self._listening: Set[str] = set()
+        # 等待监听循环执行的 LISTEN/UNLISTEN 命令
+        self._pending: Dict[str, bool] = {}
+        self._pending_waiters: Dict[str, List[asyncio.Future]] = defaultdict(list)
+        self._listen_conn: Optional[psycopg.AsyncConnection] = None
+        self._publish_conn: Optional[psycopg.AsyncConnection] = None
+        self._publish_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._stopped = True
+
+    @property
+    def running(self) -> bool:
+        """监听循环是否在运行"""
+        return self._task is not None and not self._task.done()
+
+    def is_listening(self, channel: str) -> bool:
+        """指定频道当前是否处于有效监听状态"""
+        return self._listen_conn is not None and channel in self._listening
+
+    async def start(self) -> None:
+        """启动监听循环"""
+        if self.running:
+            return
+        self._stopped = False
+        self._task = asyncio.create_task(self._run())
+        logger.info("Postgres通知监听已启动")
+
+    async def stop(self) -> None:
+        """停止监听循环并关闭连接"""
+        self._stopped = True
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
+        for conn in (self._listen_conn, self._publish_conn):
+            if conn is not None:
+                try:
+                    await conn.close()
+                except Exception:
+                    pass
+        self._listen_conn = None
+        self._publish_conn = None
+        self._listening.clear()
+        logger.info("Postgres通知监听已停止")
+
+    async def subscribe(self, channel: str, callback: NotifyCallback) -> None:
+        """
+        订阅频道
+
+        监听循环运行时会等待 LISTEN 生效后再返回；循环未运行时只登记回调，
+        启动后自动监听。
+        """
+        self._callbacks[channel].append(callback)
+        if channel not in self._listening or channel in self._pending:
+            await self._request(channel, listen=True)
+
+    async def unsubscribe(self, channel: str, callback: NotifyCallback) -> None:
+        """取消订阅，频道上没有回调时停止监听"""
+        callbacks = self._callbacks.get(channel)
+        if not callbacks:
+            return
+        if callback in callbacks:
+            callbacks.remove(callback)
+        if not callbacks:
+            del self._callbacks[channel]
+            await self._request(channel, listen=False)
+
+    async def publish(self, channel: str, payload: str = "") -> None:
+        """通过常驻发布连接发送通知"""
+        if len(payload.encode("utf-8")) > MAX_PAYLOAD_BYTES:
+            raise ValueError(f"通知负载超过 {MAX_PAYLOAD_BYTES} 字节限制")
+
+        async with self._publish_lock:
+            for attempt in range(2):
+                try:
+                    if self._publish_conn is None or self._publish_conn.closed:
+                        self._publish_conn = await psycopg.AsyncConnection.connect(self.dsn, autocommit=True)
+                    await self._publish_conn.execute("SELECT pg_notify(%s, %s)", (channel, payload))
+                    return
+                except psycopg.OperationalError:
+                    # 连接失效时重建一次
+                    self._publish_conn = None
+                    if attempt == 1:
+                        raise
+
+    async def _request(self, channel: str, listen: bool) -> None:
+        """把 LISTEN/UNLISTEN 交给监听循环执行"""
+        if not self.running:
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._pending[channel] = listen
+        self._pending_waiters[channel].append(future)
+        try:
+            await asyncio.wait_for(future, timeout=5.0)
+        except asyncio.TimeoutError:
+            logger.warning(f"等待频道 {channel} 的 {'LISTEN' if listen else 'UNLISTEN'} 生效超时")
+
+    async def _apply_pending(self) -> None:
+        """在监听连接上执行待处理的 LISTEN/UNLISTEN"""
+        while self._pending:
+            channel, listen = self._pending.popitem()
+            statement = "LISTEN {}" if listen else "UNLISTEN {}"
+            await self._listen_conn.execute(sql.SQL(statement).format(sql.Identifier(channel)))
+            if listen:
+                self._listening.add(channel)
+            else:
+                self._listening.discard(channel)
+            for future in self._pending_waiters.pop(channel, []):
+                if not future.done():
+                    future.set_result(True)
+
+    async def _run(self) -> None:
+        """监听主循环，连接断开后按指数退避重连"""
+        backoff = 1.0
+        while not self._stopped:
+            try:
+                self._listen_conn = await psycopg.AsyncConnection.connect(self.dsn, autocommit=True)
+                self._listening.clear()
+                for channel in list(self._callbacks):
+                    self._pending.setdefault(channel, True)
+                await self._apply_pending()
+                backoff = 1.0
+
+                # 连接（重新）建立后通知订阅方，弥补断线期间可能丢失的通知
+                for channel in list(self._listening):
+                    await self._dispatch(channel, None)
+
+                while not self._stopped:
+                    async for notify in self._listen_conn.notifies(timeout=self.poll_interval):
+                        await self._dispatch(notify.channel, notify.payload)
+                        if self._pending:
+                            break
+                    await self._apply_pending()
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Postgres通知监听连接异常，{backoff:.0f}秒后重连: {e}")
+            finally:
+                self._listening.clear()
+                if self._listen_conn is not None:
+                    try:
+                        await self._listen_conn.close()
+                    except Exception:
+                        pass
+                    self._listen_conn = None
+
+            if not self._stopped:
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30.0)
+
+    async def _dispatch(self, channel: str, payload: Optional[str]) -> None:
+        """把通知分发给频道上的所有回调，单个回调出错不影响其他回调"""
+        for callback in list(self._callbacks.get(channel, [])):
+            try:
+                result = callback(payload)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                logger.error(f"处理频道 {channel} 的通知失败: {e}", exc_info=True)
+
+
+def publish_sync(channel: str, payload: str = "", cursor=None) -> None:
+    """
+    同步发送通知（供 psycopg2 代码路径使用）
+
+    传入 cursor 时通知随该事务提交后才会投递；否则使用一次性连接立即发送。
+    """
+    if cursor is not None:
+        cursor.execute("SELECT pg_notify(%s, %s)", (channel, payload))
+        return
+
+    conn = psycopg2.connect(settings.database_url)
+    try:
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_notify(%s, %s)", (channel, payload))
+    finally:
+        conn.close()
+
+
+# 全局订阅中心实例
+pg_notify_hub = PgNotifyHub(settings.database_url)
+
+
+def get_pg_notify_hub() -> PgNotifyHub:
+    """获取全局Postgres通知订阅中心"""
+    return pg_notify_hub
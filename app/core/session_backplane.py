@@ -0,0 +1,160 @@
+"""
+会话消息总线
+WebSocket 连接和 Agent 运行可能落在不同的 worker 进程上，发往会话的消息统一经总线广播，
+由持有该会话连接的 worker 转发给前端
+"""
+import hashlib
+import inspect
+import json
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional
+from uuid import UUID
+
+from app.core.config import settings
+from app.core.logger import logger
+
+# 处理函数签名: handler(message)。message 为 None 表示总线连接刚刚（重新）建立，
+# 期间可能丢失了消息，订阅方应按"需要重新同步"处理。
+SessionHandler = Callable[[Optional[Dict[str, Any]]], Any]
+
+# 会话频道名前缀（Postgres 标识符最长 63 字节）
+CHANNEL_PREFIX = "opsagent_ws_"
+
+
+def session_channel(session_id: str) -> str:
+    """会话对应的通知频道名"""
+    try:
+        key = UUID(str(session_id)).hex
+    except ValueError:
+        key = hashlib.md5(str(session_id).encode("utf-8")).hexdigest()
+    return f"{CHANNEL_PREFIX}{key}"
+
+
+class SessionBackplane:
+    """会话消息总线基类：按会话登记处理函数，并在进程内分发消息"""
+
+    def __init__(self):
+        self._handlers: Dict[str, List[SessionHandler]] = defaultdict(list)
+
+    def has_subscribers(self, session_id: str) -> bool:
+        """本进程内是否有该会话的订阅方"""
+        return bool(self._handlers.get(str(session_id)))
+
+    async def subscribe(self, session_id: str, handler: SessionHandler) -> None:
+        """订阅会话消息"""
+        self._handlers[str(session_id)].append(handler)
+
+    async def unsubscribe(self, session_id: str, handler: SessionHandler) -> None:
+        """取消订阅"""
+        session_id = str(session_id)
+        handlers = self._handlers.get(session_id)
+        if not handlers:
+            return
+        if handler in handlers:
+            handlers.remove(handler)
+        if not handlers:
+            del self._handlers[session_id]
+
+    async def publish(self, session_id: str, message: Dict[str, Any]) -> None:
+        """向会话的所有订阅方（可能在其他 worker 上）广播消息"""
+        raise NotImplementedError
+
+    async def _deliver(self, session_id: str, message: Optional[Dict[str, Any]]) -> None:
+        """把消息分发给本进程内的订阅方，单个处理函数出错不影响其他订阅方"""
+        for handler in list(self._handlers.get(str(session_id), [])):
+            try:
+                result = handler(message)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                logger.error(f"处理会话 {session_id} 的消息失败: {e}", exc_info=True)
+
+
+class InMemorySessionBackplane(SessionBackplane):
+    """进程内总线，只能在单 worker 部署或测试中使用"""
+
+    async def publish(self, session_id: str, message: Dict[str, Any]) -> None:
+        await self._deliver(session_id, message)
+
+
+class PgSessionBackplane(SessionBackplane):
+    """
+    基于 Postgres LISTEN/NOTIFY 的会话消息总线
+
+    每个 worker 只监听本进程内有订阅方的会话频道（连接建立时 LISTEN，最后一个订阅方离开时 UNLISTEN）；
+    消息以 JSON 作为 NOTIFY 负载发送，发送方所在的 worker 同样通过通知收到消息，投递路径只有一条。
+    监听循环未运行时退化为进程内投递。
+    """
+
+    def __init__(self, hub):
+        super().__init__()
+        self.hub = hub
+        # session_id -> 注册到订阅中心的回调
+        self._callbacks: Dict[str, Callable[[Optional[str]], Any]] = {}
+
+    async def subscribe(self, session_id: str, handler: SessionHandler) -> None:
+        session_id = str(session_id)
+        first = not self.has_subscribers(session_id)
+        await super().subscribe(session_id, handler)
+        if first and session_id not in self._callbacks:
+            callback = self._make_callback(session_id)
+            self._callbacks[session_id] = callback
+            await self.hub.subscribe(session_channel(session_id), callback)
+
+    async def unsubscribe(self, session_id: str, handler: SessionHandler) -> None:
+        session_id = str(session_id)
+        await super().unsubscribe(session_id, handler)
+        if not self.has_subscribers(session_id):
+            callback = self._callbacks.pop(session_id, None)
+            if callback is not None:
+                await self.hub.unsubscribe(session_channel(session_id), callback)
+
+    async def publish(self, session_id: str, message: Dict[str, Any]) -> None:
+        """
+        发送消息
+
+        Raises:
+            ValueError: 序列化后的消息超过 NOTIFY 负载上限
+        """
+        session_id = str(session_id)
+        if not self.hub.running:
+            await self._deliver(session_id, message)
+            return
+        payload = json.dumps(message, ensure_ascii=False, default=str)
+        await self.hub.publish(session_channel(session_id), payload)
+
+    def _make_callback(self, session_id: str):
+        async def _on_notify(payload: Optional[str]) -> None:
+            if payload is None:
+                await self._deliver(session_id, None)
+                return
+            try:
+                message = json.loads(payload)
+            except json.JSONDecodeError:
+                logger.warning(f"会话 {session_id} 收到无法解析的消息: {payload[:200]}")
+                return
+            await self._deliver(session_id, message)
+
+        return _on_notify
+
+
+_backplane: Optional[SessionBackplane] = None
+
+
+def get_session_backplane() -> SessionBackplane:
+    """获取全局会话消息总线（WS_BACKPLANE=memory 时使用进程内实现）"""
+    global _backplane
+    if _backplane is None:
+        if settings.ws_backplane == "memory":
+            _backplane = InMemorySessionBackplane()
+        else:
+            from app.core.pg_notify import get_pg_notify_hub
+            _backplane = PgSessionBackplane(get_pg_notify_hub())
+        logger.info(f"会话消息总线: {type(_backplane).__name__}")
+    return _backplane
+
+
+def set_session_backplane(backplane: SessionBackplane) -> None:
+    """替换全局会话消息总线（测试中注入进程内实现）"""
+    global _backplane
+    _backplane = backplane
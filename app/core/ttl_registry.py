@@ -0,0 +1,191 @@
+"""
+带过期时间和容量上限的进程内状态表
+按会话保存的进程内状态（中断请求、待审批项等）统一放在这里：超过 ttl 秒未访问的条目过期，
+超过 max_size 时淘汰最久未访问的条目；后台协程定期清扫过期条目，避免长期运行的 worker 内存随历史会话数增长
+"""
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Generic, Iterator, List, Optional, Tuple, TypeVar
+
+from app.core.config import settings
+from app.core.logger import logger
+
+V = TypeVar("V")
+
+# 条目被过期或容量淘汰时的回调：on_evict(key, value)
+EvictCallback = Callable[[str, Any], None]
+
+
+class TTLRegistry(Generic[V]):
+    """
+    键值状态表
+
+    读写都会刷新条目的过期时间并移到最近使用的位置；过期条目在访问和定期清扫时删除。
+    同步路由在线程池中访问，所有操作持有同一把锁。
+    """
+
+    def __init__(
+        self,
+        name: str,
+        ttl: float,
+        max_size: Optional[int] = None,
+        on_evict: Optional[EvictCallback] = None,
+    ):
+        self.name = name
+        self.ttl = ttl
+        self.max_size = max_size if max_size is not None else settings.registry_max_size
+        self.on_evict = on_evict
+        # key -> (value, 过期时刻)，按最近使用排序
+        self._data: "OrderedDict[str, Tuple[V, float]]" = OrderedDict()
+        self._lock = threading.RLock()
+        self.expired = 0
+        self.overflowed = 0
+        _registries.append(self)
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return self._get_entry(key) is not None
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: str, default: Optional[V] = None) -> Optional[V]:
+        """获取条目并刷新过期时间，不存在或已过期时返回 default"""
+        with self._lock:
+            entry = self._get_entry(key)
+            if entry is None:
+                return default
+            self._touch(key, entry[0])
+            return entry[0]
+
+    def set(self, key: str, value: V) -> None:
+        """写入条目，超出容量时淘汰最久未访问的条目"""
+        with self._lock:
+            self._touch(key, value)
+            while len(self._data) > self.max_size:
+                old_key, (old_value, _) = self._data.popitem(last=False)
+                self.overflowed += 1
+                self._evicted(old_key, old_value)
+
+    def setdefault(self, key: str, factory: Callable[[], V]) -> V:
+        """获取条目，不存在时用 factory() 创建"""
+        with self._lock:
+            entry = self._get_entry(key)
+            if entry is not None:
+                self._touch(key, entry[0])
+                return entry[0]
+            value = factory()
+            self.set(key, value)
+            return value
+
+    def pop(self, key: str, default: Optional[V] = None) -> Optional[V]:
+        """删除条目并返回其值（主动删除不触发 on_evict）"""
+        with self._lock:
+            entry = self._data.pop(key, None)
+        if entry is None or entry[1] <= time.monotonic():
+            return default
+        return entry[0]
+
+    def values(self) -> List[V]:
+        """未过期的条目值（按最近使用排序，不刷新过期时间）"""
+        return [value for _, value in self.items()]
+
+    def items(self) -> Iterator[Tuple[str, V]]:
+        now = time.monotonic()
+        with self._lock:
+            return iter([(key, value) for key, (value, expires_at) in self._data.items() if expires_at > now])
+
+    def sweep(self) -> int:
+        """删除全部过期条目，返回删除数"""
+        now = time.monotonic()
+        with self._lock:
+            expired_keys = [key for key, (_, expires_at) in self._data.items() if expires_at <= now]
+            for key in expired_keys:
+                value, _ = self._data.pop(key)
+                self.expired += 1
+                self._evicted(key, value)
+        return len(expired_keys)
+
+    def stats(self) -> Dict[str, Any]:
+        """大小与淘汰计数（用于监控）"""
+        return {
+            "name": self.name,
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "expired": self.expired,
+            "overflowed": self.overflowed,
+        }
+
+    def _get_entry(self, key: str) -> Optional[Tuple[V, float]]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[1] <= time.monotonic():
+            del self._data[key]
+            self.expired += 1
+            self._evicted(key, entry[0])
+            return None
+        return entry
+
+    def _touch(self, key: str, value: V) -> None:
+        self._data[key] = (value, time.monotonic() + self.ttl)
+        self._data.move_to_end(key)
+
+    def _evicted(self, key: str, value: V) -> None:
+        if self.on_evict is None:
+            return
+        try:
+            self.on_evict(key, value)
+        except Exception as e:
+            logger.error(f"状态表 {self.name} 淘汰回调失败: key={key}, error={e}")
+
+
+# 进程内创建的全部状态表（由清扫协程统一清扫）
+_registries: List[TTLRegistry] = []
+_sweeper_task: Optional[asyncio.Task] = None
+
+
+def registry_stats() -> List[Dict[str, Any]]:
+    """全部状态表的大小与淘汰计数"""
+    return [registry.stats() for registry in _registries]
+
+
+def sweep_registries() -> int:
+    """清扫全部状态表，返回删除的过期条目数"""
+    removed = 0
+    for registry in _registries:
+        removed += registry.sweep()
+    return removed
+
+
+async def _sweep_loop() -> None:
+    while True:
+        await asyncio.sleep(settings.registry_sweep_interval)
+        removed = sweep_registries()
+        if removed:
+            logger.info(f"已清扫过期状态 {removed} 条: " + ", ".join(
+                f"{stats['name']}={stats['size']}" for stats in registry_stats()
+            ))
+
+
+def start_registry_sweeper() -> None:
+    """启动定期清扫协程（应用启动时调用）"""
+    global _sweeper_task
+    if _sweeper_task is None or _sweeper_task.done():
+        _sweeper_task = asyncio.create_task(_sweep_loop())
+        logger.info(f"状态表清扫已启动，间隔 {settings.registry_sweep_interval} 秒")
+
+
+async def stop_registry_sweeper() -> None:
+    """停止定期清扫协程"""
+    global _sweeper_task
+    if _sweeper_task is not None and not _sweeper_task.done():
+        _sweeper_task.cancel()
+        try:
+            await _sweeper_task
+        except asyncio.CancelledError:
+            pass
+    _sweeper_task = None
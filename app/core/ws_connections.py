@@ -0,0 +1,249 @@
+"""
+会话 WebSocket 连接管理
+同一会话可以有多个连接（多个标签页/屏幕），每个连接有独立的有界发送队列和发送协程，
+慢连接只会被踢掉，不会阻塞同一会话的其他连接。
+会话在本进程内有连接时订阅会话消息总线，由总线把其他 worker 发来的消息广播给这些连接
+"""
+import asyncio
+import json
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from uuid import uuid4
+
+from fastapi import WebSocket
+
+from app.core.config import settings
+from app.core.logger import logger
+from app.core.session_backplane import get_session_backplane
+
+# 发送队列积压时的关闭码（1013: Try Again Later），前端重连后整体刷新即可恢复
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+
+class ConnectionClosedError(Exception):
+    """连接已关闭（客户端断开或被判定为慢连接），无法继续发送"""
+
+
+class SessionConnection:
+    """单个 WebSocket 连接：所有发送都经过队列，由专属协程串行写出"""
+
+    def __init__(self, session_id: str, websocket: WebSocket):
+        self.id = uuid4().hex[:8]
+        self.session_id = session_id
+        self.websocket = websocket
+        self.connected_at = datetime.now().isoformat()
+        self.last_activity: Optional[str] = None
+        self.sent = 0
+        self.closed = False
+        self.close_reason: Optional[str] = None
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=settings.ws_send_queue_size)
+        self._sender: Optional[asyncio.Task] = None
+        # 流量控制：已发送的序号帧与客户端确认到的序号
+        self.sent_seq = 0
+        self.acked_seq = 0
+        self._credit = asyncio.Event()
+
+    def start(self) -> None:
+        """启动发送协程"""
+        self._sender = asyncio.create_task(self._send_loop())
+
+    def offer(self, text: str) -> bool:
+        """
+        把消息放入发送队列（不等待）
+
+        队列已满说明客户端读取跟不上，关闭该连接并返回 False。
+        """
+        if self.closed:
+            return False
+        try:
+            self._queue.put_nowait(text)
+            return True
+        except asyncio.QueueFull:
+            self._evict(f"发送队列积压超过 {settings.ws_send_queue_size} 条")
+            return False
+
+    def send_json(self, message: Dict[str, Any]) -> bool:
+        """序列化后放入发送队列"""
+        return self.offer(json.dumps(message))
+
+    async def send_flow(self, message: Dict[str, Any]) -> int:
+        """
+        带流量控制的发送（用于不能丢弃的对话流帧）
+
+        消息带上递增的 seq；未确认的帧达到 WS_FLOW_WINDOW 时等待客户端 ack，
+        WS_ACK_TIMEOUT 秒内没有确认视为慢连接。等待期间上游（图的流式执行）随之暂停。
+
+        Returns:
+            本帧的 seq
+
+        Raises:
+            ConnectionClosedError: 连接已关闭或等待确认超时
+        """
+        while self.sent_seq - self.acked_seq >= settings.ws_flow_window:
+            if self.closed:
+                raise ConnectionClosedError(self.close_reason or "连接已关闭")
+            self._credit.clear()
+            try:
+                await asyncio.wait_for(self._credit.wait(), timeout=settings.ws_ack_timeout)
+            except asyncio.TimeoutError:
+                self._evict(f"{settings.ws_ack_timeout:.0f} 秒内没有确认已收到的消息")
+        if self.closed:
+            raise ConnectionClosedError(self.close_reason or "连接已关闭")
+
+        self.sent_seq += 1
+        seq = self.sent_seq
+        try:
+            await asyncio.wait_for(self._queue.put(json.dumps({**message, "seq": seq})), timeout=settings.ws_ack_timeout)
+        except asyncio.TimeoutError:
+            self._evict("发送队列长时间没有空位")
+            raise ConnectionClosedError(self.close_reason)
+        return seq
+
+    def ack(self, seq: int) -> None:
+        """客户端确认已处理到 seq（累计确认）"""
+        if seq > self.acked_seq:
+            self.acked_seq = min(seq, self.sent_seq)
+            self._credit.set()
+
+    async def _send_loop(self) -> None:
+        try:
+            while True:
+                text = await self._queue.get()
+                try:
+                    await asyncio.wait_for(self.websocket.send_text(text), timeout=settings.ws_send_timeout)
+                except asyncio.TimeoutError:
+                    self._evict(f"单条消息发送超过 {settings.ws_send_timeout:.0f} 秒")
+                    return
+                except Exception as e:
+                    self._evict(f"发送失败: {e}")
+                    return
+                self.sent += 1
+                self.last_activity = datetime.now().isoformat()
+        except asyncio.CancelledError:
+            pass
+
+    def _evict(self, reason: str) -> None:
+        """标记连接关闭并异步关闭底层 WebSocket，接收循环随之退出"""
+        if self.closed:
+            return
+        self.closed = True
+        self.close_reason = reason
+        # 唤醒等待确认的发送方
+        self._credit.set()
+        logger.warning(f"关闭慢速WebSocket连接: session_id={self.session_id}, connection={self.id}, 原因={reason}")
+        asyncio.create_task(self._close_socket())
+
+    async def _close_socket(self) -> None:
+        try:
+            await self.websocket.close(code=SLOW_CONSUMER_CLOSE_CODE)
+        except Exception:
+            pass
+
+    async def close(self) -> None:
+        """停止发送协程（连接已断开或正常关闭时调用）"""
+        self.closed = True
+        self._credit.set()
+        if self._sender is not None and not self._sender.done():
+            self._sender.cancel()
+            try:
+                await self._sender
+            except asyncio.CancelledError:
+                pass
+
+    def snapshot(self) -> Dict[str, Any]:
+        """连接状态（用于监控接口）"""
+        return {
+            "connection_id": self.id,
+            "client": str(self.websocket.client) if self.websocket.client else None,
+            "connected_at": self.connected_at,
+            "last_activity": self.last_activity,
+            "sent": self.sent,
+            "queued": self._queue.qsize(),
+            "unacked": self.sent_seq - self.acked_seq,
+            "closed": self.closed,
+            "close_reason": self.close_reason,
+        }
+
+
+class SessionConnectionRegistry:
+    """按会话维护 WebSocket 连接集合，并向会话的全部连接广播"""
+
+    def __init__(self):
+        self._sessions: Dict[str, Dict[str, SessionConnection]] = {}
+        # 会话 -> 本进程订阅会话消息总线的处理函数
+        self._forwarders: Dict[str, Any] = {}
+
+    async def connect(self, session_id: str, websocket: WebSocket) -> SessionConnection:
+        """登记连接；会话在本进程内的第一个连接建立时订阅会话消息总线"""
+        connection = self.add(session_id, websocket)
+        if connection.session_id not in self._forwarders:
+            forwarder = self._make_forwarder(connection.session_id)
+            self._forwarders[connection.session_id] = forwarder
+            await get_session_backplane().subscribe(connection.session_id, forwarder)
+        return connection
+
+    async def disconnect(self, connection: SessionConnection) -> None:
+        """移除连接；会话在本进程内的最后一个连接关闭后取消订阅"""
+        if await self.remove(connection):
+            forwarder = self._forwarders.pop(connection.session_id, None)
+            if forwarder is not None:
+                await get_session_backplane().unsubscribe(connection.session_id, forwarder)
+
+    def _make_forwarder(self, session_id: str):
+        """创建把总线消息广播到本进程内该会话全部连接的处理函数"""
+        async def _forward(message: Optional[Dict[str, Any]]):
+            if message is None:
+                # 总线重连期间可能丢失了消息，让前端整体刷新任务列表
+                message = {"type": "task_update", "session_id": session_id, "refetch": True}
+            self.broadcast(session_id, message)
+        return _forward
+
+    def add(self, session_id: str, websocket: WebSocket) -> SessionConnection:
+        """登记连接并启动其发送协程"""
+        connection = SessionConnection(str(session_id), websocket)
+        self._sessions.setdefault(connection.session_id, {})[connection.id] = connection
+        connection.start()
+        return connection
+
+    async def remove(self, connection: SessionConnection) -> bool:
+        """
+        移除连接
+
+        Returns:
+            会话是否已没有任何连接
+        """
+        await connection.close()
+        connections = self._sessions.get(connection.session_id)
+        if connections is not None:
+            connections.pop(connection.id, None)
+            if not connections:
+                del self._sessions[connection.session_id]
+        return connection.session_id not in self._sessions
+
+    def connections(self, session_id: str) -> List[SessionConnection]:
+        """会话当前的连接"""
+        return list(self._sessions.get(str(session_id), {}).values())
+
+    def has_connections(self, session_id: str) -> bool:
+        return bool(self._sessions.get(str(session_id)))
+
+    def broadcast(self, session_id: str, message: Dict[str, Any]) -> int:
+        """
+        向会话的全部连接广播消息（只入队，不等待发送完成）
+
+        Returns:
+            成功入队的连接数
+        """
+        text = json.dumps(message)
+        return sum(1 for connection in self.connections(session_id) if connection.offer(text))
+
+    def snapshot(self) -> Dict[str, List[Dict[str, Any]]]:
+        """所有会话的连接状态"""
+        return {
+            session_id: [connection.snapshot() for connection in connections.values()]
+            for session_id, connections in self._sessions.items()
+        }
+
+
+# 全局连接注册表
+session_connections = SessionConnectionRegistry()
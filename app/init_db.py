@@ -110,6 +110,33 @@ def create_tables():
                 updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
             )
         """)
+        # 会话任务按创建时间分页，树形查询按父任务递归
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_tasks_session_created
+            ON tasks(session_id, created_at)
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_tasks_parent
+            ON tasks(parent_task_id)
+        """)
+
+        # 创建待确认问题表（ask_user 暂停对话后等待用户回答）
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS pending_confirmations (
+                confirmation_id VARCHAR(64) PRIMARY KEY,
+                session_id UUID NOT NULL,
+                user_id UUID,
+                request JSONB NOT NULL,
+                status VARCHAR(20) NOT NULL DEFAULT 'pending',
+                response JSONB,
+                created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                answered_at TIMESTAMP
+            )
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_pending_confirmations_session
+            ON pending_confirmations(session_id, status, created_at)
+        """)
 
         # 创建 Dify Agent 配置表
         cursor.execute("""
@@ -155,6 +182,119 @@ def create_tables():
             ON dify_agents USING GIN(keywords)
         """)
 
+        # 创建工具结果旁路存储表（超出 token 预算的完整结果）
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS tool_results (
+                id VARCHAR(12) PRIMARY KEY,
+                session_id VARCHAR(64),
+                tool_name VARCHAR(255) NOT NULL,
+                content TEXT NOT NULL,
+                total_chars INTEGER NOT NULL,
+                created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_tool_results_created_at
+            ON tool_results(created_at)
+        """)
+
+        # 创建 Dify 会话映射表（会话内复用 Dify conversation_id）
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS dify_conversations (
+                session_id VARCHAR(64) NOT NULL,
+                agent_id VARCHAR(64) NOT NULL,
+                conversation_id VARCHAR(255) NOT NULL,
+                created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                last_used_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (session_id, agent_id)
+            )
+        """)
+
+        # 创建 Dify 工作流后台运行表（状态、节点进度与结果）
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS dify_workflow_runs (
+                id VARCHAR(12) PRIMARY KEY,
+                agent_id VARCHAR(64),
+                agent_name VARCHAR(255) NOT NULL,
+                session_id VARCHAR(64),
+                status VARCHAR(20) NOT NULL,
+                workflow_run_id VARCHAR(64),
+                progress JSONB NOT NULL DEFAULT '[]',
+                result TEXT,
+                error TEXT,
+                created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                finished_at TIMESTAMP
+            )
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_dify_workflow_runs_session
+            ON dify_workflow_runs(session_id, created_at DESC)
+        """)
+
+        # 创建 Dify 基准测试历史表（每次测试一行，另按 Agent 记录指标）
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS dify_benchmark_runs (
+                id VARCHAR(12) PRIMARY KEY,
+                agent_count INTEGER NOT NULL,
+                probes_per_agent INTEGER NOT NULL,
+                concurrency INTEGER NOT NULL,
+                duration_ms DOUBLE PRECISION NOT NULL,
+                total_probes INTEGER NOT NULL,
+                error_rate DOUBLE PRECISION NOT NULL,
+                throughput_rps DOUBLE PRECISION,
+                created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS dify_benchmark_results (
+                id SERIAL PRIMARY KEY,
+                run_id VARCHAR(12) NOT NULL REFERENCES dify_benchmark_runs(id) ON DELETE CASCADE,
+                agent_id VARCHAR(64) NOT NULL,
+                agent_name VARCHAR(255) NOT NULL,
+                probes INTEGER NOT NULL,
+                errors INTEGER NOT NULL,
+                error_rate DOUBLE PRECISION NOT NULL,
+                p50_ms DOUBLE PRECISION,
+                p95_ms DOUBLE PRECISION,
+                p99_ms DOUBLE PRECISION,
+                ttfb_p50_ms DOUBLE PRECISION,
+                ttfb_p95_ms DOUBLE PRECISION,
+                throughput_rps DOUBLE PRECISION,
+                sample_errors JSONB NOT NULL DEFAULT '[]'
+            )
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_dify_benchmark_results_agent
+            ON dify_benchmark_results(agent_id, run_id)
+        """)
+
+        # 表变更通知：语句级触发器通过 pg_notify 通知监听进程刷新内存快照
+        cursor.execute("""
+            CREATE OR REPLACE FUNCTION notify_table_changed() RETURNS trigger AS $$
+            BEGIN
+                PERFORM pg_notify(TG_ARGV[0], TG_OP);
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+        """)
+        cursor.execute("""
+            DROP TRIGGER IF EXISTS trg_mcp_server_configs_changed ON mcp_server_configs
+        """)
+        cursor.execute("""
+            CREATE TRIGGER trg_mcp_server_configs_changed
+            AFTER INSERT OR UPDATE OR DELETE ON mcp_server_configs
+            FOR EACH STATEMENT EXECUTE FUNCTION notify_table_changed('mcp_server_configs_changed')
+        """)
+        cursor.execute("""
+            DROP TRIGGER IF EXISTS trg_dify_agents_changed ON dify_agents
+        """)
+        cursor.execute("""
+            CREATE TRIGGER trg_dify_agents_changed
+            AFTER INSERT OR UPDATE OR DELETE ON dify_agents
+            FOR EACH STATEMENT EXECUTE FUNCTION notify_table_changed('dify_agents_changed')
+        """)
+
         # 提交事务
         conn.commit()
         logger.info("数据库表创建成功")
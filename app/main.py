@@ -32,6 +32,10 @@ from app.core.instances import set_llm_instance
 async def lifespan(app: FastAPI):
     
     # 启动时执行
+    # 定期清扫进程内状态表中的过期条目
+    from app.core.ttl_registry import start_registry_sweeper
+    start_registry_sweeper()
+
     try:
         logger.info("正在初始化模型...")
         llm_instance, embedding_instance = get_llm()
@@ -47,11 +51,73 @@ async def lifespan(app: FastAPI):
     except Exception as e:
         logger.error(f"初始化过程中发生未知错误: {e}")
         logger.error(traceback.format_exc())
-    
+
+    # 以下监听各自启动，与模型初始化和彼此的成败无关
+    # 启动Postgres变更通知监听，MCP配置和Dify Agent配置变化时自动刷新缓存
+    try:
+        from app.core.pg_notify import pg_notify_hub
+        await pg_notify_hub.start()
+    except Exception as e:
+        logger.error(f"启动Postgres通知监听失败，配置变更将回退为定期探测: {e}")
+    try:
+        from app.services.mcp.config_service import mcp_config_service
+        await mcp_config_service.start_change_listener()
+    except Exception as e:
+        logger.error(f"启动MCP配置变更监听失败，将回退为定期探测: {e}")
+    try:
+        from app.services.dify.manager import get_dify_manager
+        from app.agent.tools import dify_tool_manager
+        dify_manager = get_dify_manager()
+        dify_manager.add_change_listener(dify_tool_manager.clear_cache)
+        await dify_manager.start_change_listener()
+    except Exception as e:
+        logger.error(f"启动Dify Agent配置变更监听失败，将回退为定期探测: {e}")
+    try:
+        # 监听跨 worker 的中断请求
+        from app.services.agent.interrupt_service import get_interrupt_service
+        await get_interrupt_service().start()
+    except Exception as e:
+        logger.error(f"启动中断请求监听失败，中断仅在本进程内生效: {e}")
+
     yield
     
     # 关闭时执行
     logger.info("应用正在关闭...")
+    try:
+        from app.agent.tools.mcp_tools import mcp_tool_manager
+        await mcp_tool_manager.close()
+    except Exception as e:
+        logger.error(f"关闭MCP客户端失败: {e}")
+    try:
+        from app.services.tasks.notifier import task_update_notifier
+        await task_update_notifier.shutdown()
+    except Exception as e:
+        logger.error(f"发送剩余任务更新通知失败: {e}")
+    try:
+        from app.services.dify.workflow_runs import dify_workflow_runs
+        await dify_workflow_runs.shutdown()
+    except Exception as e:
+        logger.error(f"中断后台Dify工作流失败: {e}")
+    try:
+        from app.services.dify.client import dify_http_clients
+        await dify_http_clients.close()
+    except Exception as e:
+        logger.error(f"关闭Dify HTTP客户端失败: {e}")
+    try:
+        from app.core.db_pool import close_async_pool
+        await close_async_pool()
+    except Exception as e:
+        logger.error(f"关闭数据库连接池失败: {e}")
+    try:
+        from app.core.ttl_registry import stop_registry_sweeper
+        await stop_registry_sweeper()
+    except Exception as e:
+        logger.error(f"停止状态表清扫失败: {e}")
+    try:
+        from app.core.pg_notify import pg_notify_hub
+        await pg_notify_hub.stop()
+    except Exception as e:
+        logger.error(f"停止Postgres通知监听失败: {e}")
     # 注意：PostgresSaver可能没有显式的关闭方法，这里只是示例
     # 在实际应用中，可能需要根据具体实现来处理资源清理
 
@@ -83,6 +149,16 @@ async def health_check():
     from app.core.instances import llm_instance
     return {"status": "healthy", "llm_initialized": llm_instance is not None}
 
+@app.get("/health/registries")
+async def registries_health():
+    """进程内状态表的大小与淘汰计数（用于观察内存是否随会话数增长）"""
+    from app.core.ttl_registry import registry_stats
+    from app.core.ws_connections import session_connections
+    return {
+        "registries": registry_stats(),
+        "ws_sessions": len(session_connections.snapshot()),
+    }
+
 if __name__ == "__main__":
     import uvicorn
 
@@ -0,0 +1,15 @@
+-- 表变更通知触发器
+-- 语句级触发器在事务提交后通过 pg_notify 通知监听进程，负载为操作类型（INSERT/UPDATE/DELETE）
+
+CREATE OR REPLACE FUNCTION notify_table_changed() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify(TG_ARGV[0], TG_OP);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- MCP 服务器配置变更
+DROP TRIGGER IF EXISTS trg_mcp_server_configs_changed ON mcp_server_configs;
+CREATE TRIGGER trg_mcp_server_configs_changed
+AFTER INSERT OR UPDATE OR DELETE ON mcp_server_configs
+FOR EACH STATEMENT EXECUTE FUNCTION notify_table_changed('mcp_server_configs_changed');
@@ -0,0 +1,15 @@
+-- Dify Agent 配置变更通知触发器
+-- 依赖 add_change_notify_triggers.sql 中的 notify_table_changed() 函数；
+-- dify_agents 表变更提交后通知各工作进程刷新 Agent 缓存和 Dify 工具缓存
+
+CREATE OR REPLACE FUNCTION notify_table_changed() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify(TG_ARGV[0], TG_OP);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_dify_agents_changed ON dify_agents;
+CREATE TRIGGER trg_dify_agents_changed
+AFTER INSERT OR UPDATE OR DELETE ON dify_agents
+FOR EACH STATEMENT EXECUTE FUNCTION notify_table_changed('dify_agents_changed');
@@ -0,0 +1,35 @@
+-- Dify Agent 基准测试历史
+-- 每次批量测试记录一行总体指标，另按 Agent 记录延迟分位数、首字节时间、错误率和吞吐量，用于趋势对比
+CREATE TABLE IF NOT EXISTS dify_benchmark_runs (
+    id VARCHAR(12) PRIMARY KEY,
+    agent_count INTEGER NOT NULL,
+    probes_per_agent INTEGER NOT NULL,
+    concurrency INTEGER NOT NULL,
+    duration_ms DOUBLE PRECISION NOT NULL,
+    total_probes INTEGER NOT NULL,
+    error_rate DOUBLE PRECISION NOT NULL,
+    throughput_rps DOUBLE PRECISION,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS dify_benchmark_results (
+    id SERIAL PRIMARY KEY,
+    run_id VARCHAR(12) NOT NULL REFERENCES dify_benchmark_runs(id) ON DELETE CASCADE,
+    agent_id VARCHAR(64) NOT NULL, -- dify_agents.id
+    agent_name VARCHAR(255) NOT NULL,
+    probes INTEGER NOT NULL,
+    errors INTEGER NOT NULL,
+    error_rate DOUBLE PRECISION NOT NULL,
+    p50_ms DOUBLE PRECISION, -- 成功探测的总耗时分位数
+    p95_ms DOUBLE PRECISION,
+    p99_ms DOUBLE PRECISION,
+    ttfb_p50_ms DOUBLE PRECISION, -- 流式首个事件到达耗时
+    ttfb_p95_ms DOUBLE PRECISION,
+    throughput_rps DOUBLE PRECISION,
+    sample_errors JSONB NOT NULL DEFAULT '[]'
+);
+
+CREATE INDEX IF NOT EXISTS idx_dify_benchmark_results_agent ON dify_benchmark_results(agent_id, run_id);
+
+COMMENT ON TABLE dify_benchmark_runs IS 'Dify Agent 批量基准测试记录';
+COMMENT ON TABLE dify_benchmark_results IS 'Dify Agent 基准测试的按 Agent 指标';
@@ -0,0 +1,12 @@
+-- Dify 会话映射表
+-- 同一会话内再次调用同一个 Dify Agent 时复用 Dify 侧的 conversation_id，避免每次重新描述上下文
+CREATE TABLE IF NOT EXISTS dify_conversations (
+    session_id VARCHAR(64) NOT NULL, -- 本系统的会话 ID
+    agent_id VARCHAR(64) NOT NULL, -- dify_agents.id
+    conversation_id VARCHAR(255) NOT NULL, -- Dify 返回的 conversation_id
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    last_used_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP, -- 超过 DIFY_CONVERSATION_TTL_HOURS 未使用视为过期
+    PRIMARY KEY (session_id, agent_id)
+);
+
+COMMENT ON TABLE dify_conversations IS '会话与 Dify conversation_id 的映射，Dify 提示会话不存在时自动重置';
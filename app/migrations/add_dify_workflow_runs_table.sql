@@ -0,0 +1,20 @@
+-- Dify 工作流后台运行表
+-- async_mode 的工作流在后台以流式模式运行，节点进度和最终结果写入该表，客户端重连后仍可查询
+CREATE TABLE IF NOT EXISTS dify_workflow_runs (
+    id VARCHAR(12) PRIMARY KEY, -- 运行句柄 run_id
+    agent_id VARCHAR(64), -- dify_agents.id
+    agent_name VARCHAR(255) NOT NULL,
+    session_id VARCHAR(64), -- 发起运行的会话 ID
+    status VARCHAR(20) NOT NULL, -- running / succeeded / failed
+    workflow_run_id VARCHAR(64), -- Dify 返回的 workflow_run_id
+    progress JSONB NOT NULL DEFAULT '[]', -- 节点进度 [{node_id, title, node_type, status, elapsed_time}]
+    result TEXT,
+    error TEXT,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP, -- 超过 DIFY_WORKFLOW_RUN_RETENTION_HOURS 的记录被清理
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    finished_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_dify_workflow_runs_session ON dify_workflow_runs(session_id, created_at DESC);
+
+COMMENT ON TABLE dify_workflow_runs IS 'Dify 工作流后台运行的状态、节点进度与结果';
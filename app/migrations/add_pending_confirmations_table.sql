@@ -0,0 +1,17 @@
+-- 待确认问题表
+-- ask_user 通过 LangGraph interrupt 暂停对话，问题保存在这里；用户回答后从检查点恢复线程
+CREATE TABLE IF NOT EXISTS pending_confirmations (
+    confirmation_id VARCHAR(64) PRIMARY KEY, -- 确认请求ID（前端回答时回传）
+    session_id UUID NOT NULL, -- 会话ID，即 LangGraph 线程ID
+    user_id UUID,
+    request JSONB NOT NULL, -- 发给前端的确认请求（问题、选项等）
+    status VARCHAR(20) NOT NULL DEFAULT 'pending', -- pending / answered / superseded
+    response JSONB, -- 用户的回答
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    answered_at TIMESTAMP
+);
+
+-- 按会话查询待回答的问题
+CREATE INDEX IF NOT EXISTS idx_pending_confirmations_session ON pending_confirmations(session_id, status, created_at);
+
+COMMENT ON TABLE pending_confirmations IS 'ask_user 发起的确认请求，超过 USER_CONFIRMATION_EXPIRE_HOURS 后不能再回答';
@@ -0,0 +1,4 @@
+-- 任务表索引
+-- 会话任务列表按 (session_id, created_at) 过滤和分页；树形查询沿 parent_task_id 递归取子任务
+CREATE INDEX IF NOT EXISTS idx_tasks_session_created ON tasks(session_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_tasks_parent ON tasks(parent_task_id);
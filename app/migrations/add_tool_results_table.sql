@@ -0,0 +1,15 @@
+-- 工具结果旁路存储表
+-- MCP工具结果超过 token 预算时，消息历史中只保留截断内容，完整结果存放在这里供 read_tool_result 分页读取
+CREATE TABLE IF NOT EXISTS tool_results (
+    id VARCHAR(12) PRIMARY KEY, -- 结果句柄
+    session_id VARCHAR(64), -- 产生结果的会话，读取时校验
+    tool_name VARCHAR(255) NOT NULL,
+    content TEXT NOT NULL, -- 展平后的完整结果
+    total_chars INTEGER NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- 过期清理按创建时间扫描
+CREATE INDEX IF NOT EXISTS idx_tool_results_created_at ON tool_results(created_at);
+
+COMMENT ON TABLE tool_results IS '超出 token 预算的工具完整结果，按 MCP_RESULT_RETENTION_HOURS 过期清理';
@@ -65,6 +65,16 @@ class DifyAgentTestResponse(BaseModel):
     latency_ms: Optional[float] = None
 
 
+class DifyBenchmarkRequest(BaseModel):
+    """Dify Agent 批量基准测试请求模型"""
+    agent_ids: Optional[List[str]] = Field(default=None, description="待测 Agent ID，不传时测试所有已启用的 Agent")
+    probes_per_agent: int = Field(default=5, ge=1, le=100, description="每个 Agent 的探测次数")
+    concurrency: Optional[int] = Field(default=None, ge=1, le=100, description="全局并发上限，默认使用 DIFY_BENCHMARK_CONCURRENCY")
+    queries: Optional[List[str]] = Field(default=None, description="探测查询，按轮次循环使用")
+    timeout: Optional[float] = Field(default=None, gt=0, description="单次探测超时（秒），默认使用 DIFY_BENCHMARK_TIMEOUT")
+    user_id: str = Field(default="benchmark", description="发送给 Dify 的用户 ID")
+
+
 # 用户相关模型
 class UserCreate(BaseModel):
     username: str = Field(..., min_length=3, max_length=50)
@@ -125,6 +135,16 @@ class AgentChatRequest(BaseModel):
     config: Optional[Dict[str, Any]] = None
 
 
+class ConfirmationAnswerRequest(BaseModel):
+    """用户确认请求的回答"""
+    status: str = Field(default="confirmed", description="confirmed为确认，cancelled为取消")
+    value: Optional[Any] = None  # 选择的选项或输入内容：字符串、列表，或包含 selected/input 的字典
+    response_mode: str = Field(
+        default="blocking",
+        description="恢复对话的响应模式：blocking为阻塞模式，streaming为流式模式"
+    )
+
+
 class ChatCompletionResponse(BaseModel):
     """阻塞模式的响应模型"""
     session_id: str
@@ -133,6 +153,7 @@ class ChatCompletionResponse(BaseModel):
     created_at: float
     model: str
     usage: Optional[Dict[str, Any]] = None
+    confirmation: Optional[Dict[str, Any]] = None  # status 为 waiting_confirmation 时的确认请求
 
 
 class ChunkChatCompletionResponse(BaseModel):
@@ -143,10 +164,12 @@ class ChunkChatCompletionResponse(BaseModel):
     created_at: float
     model: str
     is_final: bool = False
-    message_type: Optional[str] = "assistant"  # 消息类型：assistant, tool_call, tool_result
+    message_type: Optional[str] = "assistant"  # 消息类型：assistant, tool_call, tool_progress, tool_result
     tool_calls: Optional[List[Dict[str, Any]]] = None  # 工具调用信息
-    tool_name: Optional[str] = None  # 工具名称（用于tool_result类型）
-    tool_call_id: Optional[str] = None  # 工具调用ID（用于tool_result类型）
+    tool_name: Optional[str] = None  # 工具名称（用于tool_progress/tool_result类型）
+    tool_call_id: Optional[str] = None  # 工具调用ID（用于tool_progress/tool_result类型）
+    progress: Optional[Dict[str, Any]] = None  # 工具进度信息（用于tool_progress类型）：progress、total
+    confirmation: Optional[Dict[str, Any]] = None  # 等待用户确认时结束块携带的确认请求
 
 # MCP服务器配置相关模型
 class MCPServerConfigCreate(BaseModel):
@@ -0,0 +1,225 @@
+"""
+用户确认（ask_user）的挂起与恢复
+ask_user 通过 LangGraph interrupt 暂停图执行，本次运行随即结束；待确认的问题持久化在 pending_confirmations 表，
+用户回答后以 Command(resume=...) 从检查点恢复同一线程。等待期间不占用协程、数据库连接或请求，进程重启后仍可继续
+"""
+import json
+from typing import Any, Dict, List, Optional
+
+from langgraph.types import Command
+
+from app.core.config import settings
+from app.core.db_pool import pooled_connection
+from app.core.logger import logger
+from app.core.session_backplane import get_session_backplane
+
+# ask_user 中断负载与前端消息的类型
+CONFIRMATION_REQUEST_TYPE = "user_confirmation_request"
+
+# 待确认问题的状态：等待回答 / 已回答 / 用户发送了新消息，问题作废
+STATUS_PENDING = "pending"
+STATUS_ANSWERED = "answered"
+STATUS_SUPERSEDED = "superseded"
+
+# 运行因等待用户确认而结束时，最后一个响应块 / 阻塞响应的状态
+WAITING_CONFIRMATION_STATUS = "waiting_confirmation"
+
+
+def format_confirmation_answer(response: Any) -> str:
+    """把用户的确认响应整理为 ask_user 的工具结果"""
+    if not isinstance(response, dict) or response.get("status") != "confirmed":
+        return "用户取消操作"
+
+    value = response.get("value")
+    # 处理多选选项和用户输入
+    if isinstance(value, dict):
+        # 新格式：包含selected和input
+        selected_options = value.get("selected", [])
+        user_input = value.get("input", "")
+
+        result_parts = []
+        if selected_options:
+            result_parts.append(f"选择的选项: {', '.join(selected_options)}")
+        if user_input:
+            result_parts.append(f"用户输入: {user_input}")
+
+        if result_parts:
+            return "\n\n".join(result_parts)
+        return "用户确认但未选择任何选项或输入内容"
+    if isinstance(value, list):
+        # 旧格式：只有多选选项
+        if value:
+            return f"选择的选项: {', '.join(value)}"
+        return "用户确认但未选择任何选项"
+    if value:
+        # 单个选项或纯文本输入
+        return str(value)
+    return "用户确认但未提供任何信息"
+
+
+def extract_confirmation_requests(snapshot) -> List[Dict[str, Any]]:
+    """从图状态快照中取出 ask_user 发起的确认请求（用户中断对话等其他中断不在此列）"""
+    requests = []
+    for task in getattr(snapshot, "tasks", None) or ():
+        for item in getattr(task, "interrupts", None) or ():
+            value = getattr(item, "value", None)
+            if isinstance(value, dict) and value.get("type") == CONFIRMATION_REQUEST_TYPE:
+                requests.append(value)
+    return requests
+
+
+async def suspend_for_confirmation(graph, session_id: str, config: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    运行结束后检查线程是否停在 ask_user 的中断上；是则保存待确认问题并通知前端
+
+    Returns:
+        本次运行发起的确认请求（没有时为空列表）
+    """
+    snapshot = await graph.aget_state(config)
+    requests = extract_confirmation_requests(snapshot)
+    for request in requests:
+        await save_confirmation_request(session_id, request)
+        await publish_confirmation_request(session_id, request)
+    return requests
+
+
+async def save_confirmation_request(session_id: str, request: Dict[str, Any]) -> None:
+    """持久化待确认问题（同一请求重复保存时忽略）"""
+    async with pooled_connection() as conn:
+        await conn.execute(
+            """
+            INSERT INTO pending_confirmations (confirmation_id, session_id, user_id, request)
+            VALUES (%s, %s, %s, %s::jsonb)
+            ON CONFLICT (confirmation_id) DO NOTHING
+            """,
+            (
+                request["confirmation_id"],
+                str(session_id),
+                request.get("user_id"),
+                json.dumps(request, ensure_ascii=False, default=str),
+            ),
+        )
+    logger.info(f"已保存待确认问题: session_id={session_id}, confirmation_id={request['confirmation_id']}")
+
+
+async def publish_confirmation_request(session_id: str, request: Dict[str, Any]) -> None:
+    """经会话消息总线把确认请求推给前端；前端不在线时问题仍然保留，连接后通过列表接口取回"""
+    session_id = str(session_id)
+    backplane = get_session_backplane()
+    try:
+        await backplane.publish(session_id, request)
+    except ValueError:
+        # 问题内容超过通知负载上限时只通知前端拉取待确认列表
+        await backplane.publish(session_id, {
+            "type": CONFIRMATION_REQUEST_TYPE,
+            "session_id": session_id,
+            "confirmation_id": request["confirmation_id"],
+            "refetch": True,
+        })
+
+
+async def list_pending_confirmations(session_id: str) -> List[Dict[str, Any]]:
+    """会话中尚未回答且未过期的确认请求，按发起时间排序"""
+    async with pooled_connection() as conn:
+        cursor = await conn.execute(
+            """
+            SELECT request FROM pending_confirmations
+            WHERE session_id = %s AND status = %s
+              AND created_at > CURRENT_TIMESTAMP - make_interval(hours => %s)
+            ORDER BY created_at
+            """,
+            (str(session_id), STATUS_PENDING, settings.user_confirmation_expire_hours),
+        )
+        rows = await cursor.fetchall()
+    return [row[0] for row in rows]
+
+
+async def answer_confirmation(session_id: str, response: Dict[str, Any]) -> Optional[str]:
+    """
+    记录用户对确认请求的回答
+
+    只有第一个回答生效：多个标签页或 worker 同时提交时，以数据库中的状态更新为准。
+
+    Returns:
+        会话所属用户ID；请求不存在、已回答、已作废或已过期时返回 None
+    """
+    confirmation_id = response.get("confirmation_id")
+    if not confirmation_id:
+        return None
+    async with pooled_connection() as conn:
+        cursor = await conn.execute(
+            """
+            UPDATE pending_confirmations
+            SET status = %s, response = %s::jsonb, answered_at = CURRENT_TIMESTAMP
+            WHERE confirmation_id = %s AND session_id = %s AND status = %s
+              AND created_at > CURRENT_TIMESTAMP - make_interval(hours => %s)
+            RETURNING user_id
+            """,
+            (
+                STATUS_ANSWERED,
+                json.dumps(response, ensure_ascii=False, default=str),
+                str(confirmation_id),
+                str(session_id),
+                STATUS_PENDING,
+                settings.user_confirmation_expire_hours,
+            ),
+        )
+        row = await cursor.fetchone()
+    if row is None:
+        logger.info(f"确认请求不在等待状态，忽略回答: session_id={session_id}, confirmation_id={confirmation_id}")
+        return None
+    logger.info(f"已记录用户确认响应: session_id={session_id}, confirmation_id={confirmation_id}")
+    return str(row[0]) if row[0] else None
+
+
+async def reopen_confirmation(session_id: str, inputs: Any) -> None:
+    """
+    从检查点恢复失败时把回答退回等待状态，用户可以重新提交
+
+    inputs 不是恢复命令（新消息）时不做处理。
+    """
+    response = inputs.resume if isinstance(inputs, Command) else None
+    confirmation_id = response.get("confirmation_id") if isinstance(response, dict) else None
+    if not confirmation_id:
+        return
+    try:
+        async with pooled_connection() as conn:
+            cursor = await conn.execute(
+                """
+                UPDATE pending_confirmations
+                SET status = %s, response = NULL, answered_at = NULL
+                WHERE confirmation_id = %s AND session_id = %s AND status = %s
+                """,
+                (STATUS_PENDING, str(confirmation_id), str(session_id), STATUS_ANSWERED),
+            )
+            reopened = cursor.rowcount
+    except Exception as e:
+        logger.error(f"退回确认请求失败: session_id={session_id}, confirmation_id={confirmation_id}, error={e}")
+        return
+    if reopened:
+        logger.info(f"恢复对话失败，确认请求退回等待状态: session_id={session_id}, confirmation_id={confirmation_id}")
+
+
+async def supersede_pending_confirmations(session_id: str) -> None:
+    """用户没有回答而是发送了新消息：线程从新输入继续，之前的确认请求作废"""
+    async with pooled_connection() as conn:
+        cursor = await conn.execute(
+            "UPDATE pending_confirmations SET status = %s WHERE session_id = %s AND status = %s",
+            (STATUS_SUPERSEDED, str(session_id), STATUS_PENDING),
+        )
+        if cursor.rowcount:
+            logger.info(f"会话 {session_id} 收到新消息，作废 {cursor.rowcount} 个待确认问题")
+
+
+def build_resume_command(response: Dict[str, Any]) -> Command:
+    """用户回答后恢复线程的输入：ask_user 中的 interrupt() 返回该响应"""
+    return Command(resume=response)
+
+
+async def prepare_run(session_id: str, inputs: Any) -> None:
+    """运行开始前的处理：新消息（而非恢复）会作废会话中尚未回答的确认请求"""
+    if not isinstance(inputs, Command):
+        try:
+            await supersede_pending_confirmations(session_id)
+        except Exception as e:
+            logger.warning(f"作废待确认问题失败: session_id={session_id}, error={e}")
@@ -1,7 +1,7 @@
 """
 Agent服务的核心业务逻辑处理
 """
-from typing import Dict, Any
+from typing import AsyncIterator, Dict, Any, Optional
 from uuid import UUID
 import time
 import uuid
@@ -15,23 +15,59 @@ from app.core.logger import logger
 from app.core.config import settings
 from app.agent.graph import create_graph_async
 from app.models.schemas import ChatCompletionResponse, ChunkChatCompletionResponse
+from app.services.agent.confirmations import (
+    WAITING_CONFIRMATION_STATUS,
+    prepare_run,
+    reopen_confirmation,
+    suspend_for_confirmation,
+)
+from app.services.agent.interrupt_service import get_interrupt_service
 from app.services.agent.utils import build_agent_inputs, create_agent_config
 
 
+def _match_pending_tool_call(pending_tool_calls: Dict[str, Dict[str, Any]], tool_name: Optional[str]) -> Optional[str]:
+    """
+    根据工具名称找到进度通知对应的工具调用ID
+
+    MCP进度回调只携带工具名称，同名工具并发调用时归属到最早发起且未完成的那一次。
+    """
+    if not tool_name:
+        return None
+    for tool_call_id, tool_call_info in pending_tool_calls.items():
+        if tool_call_info.get("name") == tool_name:
+            return tool_call_id
+    return None
+
+
 async def execute_agent_task(session_id: UUID, message: str, tools=None, config=None) -> Dict[str, Any]:
     """执行Agent任务的核心业务逻辑"""
+    # 从运行准备阶段起接收中断请求：获取连接、租用MCP工具和构建图期间点击停止同样生效
+    with get_interrupt_service().track_run(str(session_id)):
+        return await _execute_agent_task(session_id, message)
+
+
+async def _execute_agent_task(session_id: UUID, message: str) -> Dict[str, Any]:
+    # 延迟导入以避免循环导入
+    from app.agent.tools import mcp_manager
+
     # 构造输入
     inputs = build_agent_inputs(message, session_id)
 
     # 使用异步上下文管理器
-    async with AsyncPostgresSaver.from_conn_string(settings.database_url) as checkpointer:
+    async with (
+        AsyncPostgresSaver.from_conn_string(settings.database_url) as checkpointer,
+        mcp_manager.lease_tools() as mcp_tools,
+    ):
         # 确保检查点表已创建
         await checkpointer.setup()
-        # 创建新的agent graph实例（异步加载MCP工具）
-        agent_graph = await create_graph_async(checkpointer=checkpointer)
+        # 创建新的agent graph实例（使用本次运行租用的MCP工具集）
+        agent_graph = await create_graph_async(checkpointer=checkpointer, mcp_tools=mcp_tools)
         # 执行Agent图，并传入检查点配置
         config = create_agent_config(session_id)
+        await prepare_run(str(session_id), inputs)
         result = await agent_graph.ainvoke(inputs, config)
+        # 停在 ask_user 上时保存待确认问题，运行到此结束
+        confirmation_requests = await suspend_for_confirmation(agent_graph, str(session_id), config)
     
     # 提取响应消息 - 只获取最后的AIMessage
     messages = result.get("messages", [])
@@ -43,6 +79,14 @@ async def execute_agent_task(session_id: UUID, message: str, tools=None, config=
             response_content = message.content
             break
 
+    if confirmation_requests:
+        return {
+            "session_id": session_id,
+            "response": confirmation_requests[-1]["message"],
+            "status": WAITING_CONFIRMATION_STATUS,
+            "confirmation": confirmation_requests[-1]
+        }
+
     return {
         "session_id": session_id,
         "response": response_content,
@@ -50,21 +94,38 @@ async def execute_agent_task(session_id: UUID, message: str, tools=None, config=
     }
 
 
-async def handle_blocking_chat(session_id: UUID, inputs: Dict[str, Any], config: Dict[str, Any]) -> ChatCompletionResponse:
-    """处理阻塞模式的聊天 - 使用LangGraph标准流程"""
+async def handle_blocking_chat(session_id: UUID, inputs: Any, config: Dict[str, Any]) -> ChatCompletionResponse:
+    """
+    处理阻塞模式的聊天 - 使用LangGraph标准流程
+
+    inputs 为新消息构造的输入，或用户回答确认请求后恢复线程的 Command。
+    """
+    # 从运行准备阶段起接收中断请求：获取连接、租用MCP工具和构建图期间点击停止同样生效
+    with get_interrupt_service().track_run(str(session_id)):
+        return await _invoke_blocking_chat(session_id, inputs, config)
+
+
+async def _invoke_blocking_chat(session_id: UUID, inputs: Any, config: Dict[str, Any]) -> ChatCompletionResponse:
+    # 延迟导入以避免循环导入
+    from app.agent.tools import mcp_manager
+
     # 使用异步上下文管理器
     async with (
         AsyncPostgresStore.from_conn_string(settings.database_url) as store,
         AsyncPostgresSaver.from_conn_string(settings.database_url) as checkpointer,
+        mcp_manager.lease_tools() as mcp_tools,
     ):
         # 确保检查点表已创建
         await checkpointer.setup()
 
-        # 创建graph实例（异步加载MCP工具）
-        graph = await create_graph_async(checkpointer=checkpointer, store=store)
+        # 创建graph实例（使用本次运行租用的MCP工具集）
+        graph = await create_graph_async(checkpointer=checkpointer, store=store, mcp_tools=mcp_tools)
 
         # 执行graph（异步）
+        await prepare_run(str(session_id), inputs)
         result = await graph.ainvoke(inputs, config)
+        # 停在 ask_user 上时保存待确认问题，运行到此结束
+        confirmation_requests = await suspend_for_confirmation(graph, str(session_id), config)
 
         # 获取执行过程中的所有新消息
         messages = result.get("messages", [])
@@ -109,6 +170,17 @@ async def handle_blocking_chat(session_id: UUID, inputs: Dict[str, Any], config:
             # 如果不是字典，直接转换为字符串
             response_content = str(response_message)
 
+        # 等待用户确认时，用问题内容作为本次回复
+        if confirmation_requests:
+            return ChatCompletionResponse(
+                session_id=str(session_id),
+                response=confirmation_requests[-1]["message"],
+                status=WAITING_CONFIRMATION_STATUS,
+                created_at=time.time(),
+                model="tongyi",
+                confirmation=confirmation_requests[-1]
+            )
+
         return ChatCompletionResponse(
             session_id=str(session_id),
             response=response_content,  # 返回字符串格式的响应
@@ -118,171 +190,273 @@ async def handle_blocking_chat(session_id: UUID, inputs: Dict[str, Any], config:
         )
 
 
-async def handle_streaming_chat(session_id: UUID, inputs: Dict[str, Any], config: Dict[str, Any]):
-    """处理流式模式的聊天 - 使用LangGraph标准流程进行流式输出"""
+async def stream_chat_chunks(
+    session_id: UUID, inputs: Any, config: Dict[str, Any]
+) -> AsyncIterator[ChunkChatCompletionResponse]:
+    """
+    执行一次流式对话，逐个产出响应块（助手增量、工具调用、工具进度、工具结果、结束/错误）
+
+    SSE 接口和实时 WebSocket 通道共用这一套事件，只是封装格式不同。
+    inputs 为新消息构造的输入，或用户回答确认请求后恢复线程的 Command；
+    运行停在 ask_user 上时，结束块的状态为 waiting_confirmation 并携带确认请求。
+    恢复失败（出错结束或抛出异常）时确认请求退回等待状态，用户可以重新回答。
+    """
+    try:
+        # 从运行准备阶段起接收中断请求：获取连接、租用MCP工具和构建图期间点击停止同样生效
+        with get_interrupt_service().track_run(str(session_id)):
+            async for chunk in _stream_chat_chunks(session_id, inputs, config):
+                if chunk.is_final and chunk.status == "error":
+                    await reopen_confirmation(str(session_id), inputs)
+                yield chunk
+    except Exception:
+        await reopen_confirmation(str(session_id), inputs)
+        raise
+
+
+async def _stream_chat_chunks(
+    session_id: UUID, inputs: Any, config: Dict[str, Any]
+) -> AsyncIterator[ChunkChatCompletionResponse]:
+    # 延迟导入以避免循环导入
+    from app.agent.tools import mcp_manager
 
-    async def generate_stream():
-        """生成SSE流式数据（异步生成器）"""
+    async with (
+        AsyncPostgresStore.from_conn_string(settings.database_url) as store,
+        AsyncPostgresSaver.from_conn_string(settings.database_url) as checkpointer,
+        mcp_manager.lease_tools() as mcp_tools,
+    ):
 
-        async with (
-            AsyncPostgresStore.from_conn_string(settings.database_url) as store,
-            AsyncPostgresSaver.from_conn_string(settings.database_url) as checkpointer,
-        ):
-
-            # 创建graph实例（异步加载MCP工具）
-            graph = await create_graph_async(checkpointer=checkpointer, store=store)
-
-            # 回到messages模式，但改进工具调用处理逻辑
-            # 重要：不要中途break，让LangGraph完整执行以确保状态正确保存
-            try:
-                stream_finished = False
-                pending_tool_calls = {}  # 存储待完成的工具调用
-                message_count = 0
-
-                async for chunk, _ in graph.astream(inputs, config, stream_mode="messages"):
-                    message_count += 1
-
-                    # 处理AIMessage - 包括普通回复和工具调用
-                    if isinstance(chunk, AIMessage):
-                        # 检查是否包含工具调用
-                        tool_calls = getattr(chunk, 'tool_calls', [])
-                        ai_content = getattr(chunk, 'content', '')
-
-                        # 先发送AI的文本内容（如果有）
-                        if ai_content and ai_content.strip():
-                            chunk_response = ChunkChatCompletionResponse(
-                                session_id=str(session_id),
-                                chunk=ai_content,
-                                status="streaming",
-                                created_at=time.time(),
-                                model="tongyi",
-                                is_final=False,
-                                message_type="assistant"
-                            )
-                            yield f"data: {chunk_response.model_dump_json()}\n\n"
-
-                        # 如果有工具调用，立即发送工具调用信息（不等待结果）
-                        if tool_calls:
-                            for tool_call in tool_calls:
-                                # 尝试多种方式获取工具调用信息
-                                tool_name = ''
-                                tool_id = ''
-                                tool_args = {}
-
-                                # 方式1：直接属性访问
-                                if hasattr(tool_call, 'name'):
-                                    tool_name = getattr(tool_call, 'name', '') or ''
-                                if hasattr(tool_call, 'id'):
-                                    tool_id = getattr(tool_call, 'id', '') or ''
-                                if hasattr(tool_call, 'args'):
-                                    tool_args = getattr(tool_call, 'args', {}) or {}
-
-                                # 方式2：字典访问（如果tool_call是字典）
-                                if isinstance(tool_call, dict):
-                                    tool_name = tool_call.get('name', '') or tool_name
-                                    tool_id = tool_call.get('id', '') or tool_id
-                                    tool_args = tool_call.get('args', {}) or tool_args
-
-                                # 方式3：检查function属性（某些LLM返回格式）
-                                if hasattr(tool_call, 'function'):
-                                    func = getattr(tool_call, 'function', {})
-                                    if hasattr(func, 'name'):
-                                        tool_name = getattr(func, 'name', '') or tool_name
-                                    if hasattr(func, 'arguments'):
-                                        import json
-                                        try:
-                                            tool_args = json.loads(getattr(func, 'arguments', '{}')) or tool_args
-                                        except:
-                                            pass
-
-                                if tool_name.strip() and tool_id.strip():
-                                    # 立即发送工具调用信息（状态为calling）
-                                    tool_call_info = {
-                                        "id": tool_id,
-                                        "name": tool_name,
-                                        "args": tool_args,
-                                        "type": "tool_call",
-                                        "result": None,
-                                        "status": "calling"
-                                    }
-
-                                    chunk_response = ChunkChatCompletionResponse(
-                                        session_id=str(session_id),
-                                        chunk="",
-                                        status="streaming",
-                                        created_at=time.time(),
-                                        model="tongyi",
-                                        is_final=False,
-                                        message_type="tool_call",
-                                        tool_calls=[tool_call_info]
-                                    )
-                                    yield f"data: {chunk_response.model_dump_json()}\n\n"
-
-                                    # 存储工具调用，等待结果更新
-                                    pending_tool_calls[tool_id] = tool_call_info
-
-                    # 处理ToolMessage - 工具执行结果
-                    elif isinstance(chunk, ToolMessage):
-                        tool_call_id = getattr(chunk, 'tool_call_id', '')
-                        tool_result = getattr(chunk, 'content', '')
-
-                        # 如果找到对应的工具调用，发送更新后的工具调用信息
-                        if tool_call_id in pending_tool_calls:
-                            tool_call_info = pending_tool_calls[tool_call_id]
-                            tool_call_info["result"] = tool_result
-                            tool_call_info["status"] = "completed"
-
-                            # 发送更新后的工具调用信息
-                            chunk_response = ChunkChatCompletionResponse(
-                                session_id=str(session_id),
-                                chunk="",
-                                status="streaming",
-                                created_at=time.time(),
-                                model="tongyi",
-                                is_final=False,
-                                message_type="tool_result",
-                                tool_call_id=tool_call_id,
-                                tool_name=tool_call_info["name"],
-                                tool_calls=None
-                            )
-                            chunk_response.chunk = tool_result  # 设置结果内容
-                            yield f"data: {chunk_response.model_dump_json()}\n\n"
-
-                            # 移除已完成的工具调用
-                            del pending_tool_calls[tool_call_id]
-
-                logger.info(f"消息处理完成，总共处理了 {message_count} 条消息")
-
-                # 图执行完毕后，如果还没有发送结束信号，则发送
-                if not stream_finished:
-                    final_response = ChunkChatCompletionResponse(
+        # 创建graph实例（使用本次运行租用的MCP工具集，重载不会影响本次流式输出）
+        graph = await create_graph_async(checkpointer=checkpointer, store=store, mcp_tools=mcp_tools)
+
+        # 回到messages模式，但改进工具调用处理逻辑
+        # 重要：不要中途break，让LangGraph完整执行以确保状态正确保存
+        try:
+            stream_finished = False
+            pending_tool_calls = {}  # 存储待完成的工具调用
+            streamed_message_ids = set()  # 已通过自定义流输出内容的消息ID
+            message_count = 0
+
+            await prepare_run(str(session_id), inputs)
+            async for stream_mode, payload in graph.astream(inputs, config, stream_mode=["messages", "custom"]):
+                # 自定义流：只转发工具进度和Dify增量回答，模型节点写入的消息块已经通过messages流输出
+                if stream_mode == "custom":
+                    if not isinstance(payload, dict):
+                        continue
+                    payload_type = payload.get("type")
+
+                    # Dify节点的增量回答直接作为助手内容输出
+                    if payload_type == "dify_delta" and payload.get("target") == "assistant":
+                        streamed_message_ids.add(payload.get("message_id"))
+                        chunk_response = ChunkChatCompletionResponse(
+                            session_id=str(session_id),
+                            chunk=payload.get("delta") or "",
+                            status="streaming",
+                            created_at=time.time(),
+                            model="tongyi",
+                            is_final=False,
+                            message_type="assistant"
+                        )
+                        yield chunk_response
+                        continue
+
+                    if payload_type not in ("tool_progress", "dify_delta"):
+                        continue
+
+                    tool_call_id = _match_pending_tool_call(pending_tool_calls, payload.get("tool_name"))
+                    if not tool_call_id:
+                        continue
+
+                    tool_call_info = pending_tool_calls[tool_call_id]
+                    tool_call_info["status"] = "running"
+                    if payload_type == "dify_delta":
+                        # Dify工具的增量回答按原样追加
+                        progress_info = None
+                        progress_text = payload.get("delta") or ""
+                    else:
+                        # MCP进度消息按行追加
+                        progress_info = {
+                            "progress": payload.get("progress"),
+                            "total": payload.get("total"),
+                        }
+                        tool_call_info["progress"] = progress_info
+                        progress_text = f"{payload['message']}\n" if payload.get("message") else ""
+
+                    chunk_response = ChunkChatCompletionResponse(
                         session_id=str(session_id),
-                        chunk="",
-                        status="completed",
+                        chunk=progress_text,
+                        status="streaming",
                         created_at=time.time(),
                         model="tongyi",
-                        is_final=True,
-                        message_type="assistant"
+                        is_final=False,
+                        message_type="tool_progress",
+                        tool_call_id=tool_call_id,
+                        tool_name=tool_call_info["name"],
+                        progress=progress_info
                     )
-                    yield f"data: {final_response.model_dump_json()}\n\n"
-
-            except Exception as e:
-                # 如果流处理过程中出现错误，发送错误信息
-                logger.error(f"流式处理过程中出现错误: {str(e)}")
-                error_response = ChunkChatCompletionResponse(
+                    yield chunk_response
+                    continue
+
+                chunk, _ = payload
+                message_count += 1
+
+                # 已通过自定义流逐段输出过的消息（如Dify节点的回答）不再重复输出
+                if getattr(chunk, "id", None) in streamed_message_ids:
+                    continue
+
+                # 处理AIMessage - 包括普通回复和工具调用
+                if isinstance(chunk, AIMessage):
+                    # 检查是否包含工具调用
+                    tool_calls = getattr(chunk, 'tool_calls', [])
+                    ai_content = getattr(chunk, 'content', '')
+
+                    # 先发送AI的文本内容（如果有）
+                    if ai_content and ai_content.strip():
+                        chunk_response = ChunkChatCompletionResponse(
+                            session_id=str(session_id),
+                            chunk=ai_content,
+                            status="streaming",
+                            created_at=time.time(),
+                            model="tongyi",
+                            is_final=False,
+                            message_type="assistant"
+                        )
+                        yield chunk_response
+
+                    # 如果有工具调用，立即发送工具调用信息（不等待结果）
+                    if tool_calls:
+                        for tool_call in tool_calls:
+                            # 尝试多种方式获取工具调用信息
+                            tool_name = ''
+                            tool_id = ''
+                            tool_args = {}
+
+                            # 方式1：直接属性访问
+                            if hasattr(tool_call, 'name'):
+                                tool_name = getattr(tool_call, 'name', '') or ''
+                            if hasattr(tool_call, 'id'):
+                                tool_id = getattr(tool_call, 'id', '') or ''
+                            if hasattr(tool_call, 'args'):
+                                tool_args = getattr(tool_call, 'args', {}) or {}
+
+                            # 方式2：字典访问（如果tool_call是字典）
+                            if isinstance(tool_call, dict):
+                                tool_name = tool_call.get('name', '') or tool_name
+                                tool_id = tool_call.get('id', '') or tool_id
+                                tool_args = tool_call.get('args', {}) or tool_args
+
+                            # 方式3：检查function属性（某些LLM返回格式）
+                            if hasattr(tool_call, 'function'):
+                                func = getattr(tool_call, 'function', {})
+                                if hasattr(func, 'name'):
+                                    tool_name = getattr(func, 'name', '') or tool_name
+                                if hasattr(func, 'arguments'):
+                                    import json
+                                    try:
+                                        tool_args = json.loads(getattr(func, 'arguments', '{}')) or tool_args
+                                    except:
+                                        pass
+
+                            if tool_name.strip() and tool_id.strip():
+                                # 立即发送工具调用信息（状态为calling）
+                                tool_call_info = {
+                                    "id": tool_id,
+                                    "name": tool_name,
+                                    "args": tool_args,
+                                    "type": "tool_call",
+                                    "result": None,
+                                    "status": "calling"
+                                }
+
+                                chunk_response = ChunkChatCompletionResponse(
+                                    session_id=str(session_id),
+                                    chunk="",
+                                    status="streaming",
+                                    created_at=time.time(),
+                                    model="tongyi",
+                                    is_final=False,
+                                    message_type="tool_call",
+                                    tool_calls=[tool_call_info]
+                                )
+                                yield chunk_response
+
+                                # 存储工具调用，等待结果更新
+                                pending_tool_calls[tool_id] = tool_call_info
+
+                # 处理ToolMessage - 工具执行结果
+                elif isinstance(chunk, ToolMessage):
+                    tool_call_id = getattr(chunk, 'tool_call_id', '')
+                    tool_result = getattr(chunk, 'content', '')
+
+                    # 如果找到对应的工具调用，发送更新后的工具调用信息
+                    if tool_call_id in pending_tool_calls:
+                        tool_call_info = pending_tool_calls[tool_call_id]
+                        tool_call_info["result"] = tool_result
+                        tool_call_info["status"] = "completed"
+
+                        # 发送更新后的工具调用信息
+                        chunk_response = ChunkChatCompletionResponse(
+                            session_id=str(session_id),
+                            chunk="",
+                            status="streaming",
+                            created_at=time.time(),
+                            model="tongyi",
+                            is_final=False,
+                            message_type="tool_result",
+                            tool_call_id=tool_call_id,
+                            tool_name=tool_call_info["name"],
+                            tool_calls=None
+                        )
+                        chunk_response.chunk = tool_result  # 设置结果内容
+                        yield chunk_response
+
+                        # 移除已完成的工具调用
+                        del pending_tool_calls[tool_call_id]
+
+            logger.info(f"消息处理完成，总共处理了 {message_count} 条消息")
+
+            # 停在 ask_user 上时保存待确认问题并通知前端，运行到此结束
+            confirmation_requests = await suspend_for_confirmation(graph, str(session_id), config)
+
+            # 图执行完毕后，如果还没有发送结束信号，则发送
+            if not stream_finished:
+                final_response = ChunkChatCompletionResponse(
                     session_id=str(session_id),
-                    chunk=f"处理过程中出现错误: {str(e)}",
-                    status="error",
+                    chunk="",
+                    status=WAITING_CONFIRMATION_STATUS if confirmation_requests else "completed",
                     created_at=time.time(),
                     model="tongyi",
                     is_final=True,
-                    message_type="assistant"
+                    message_type="assistant",
+                    confirmation=confirmation_requests[-1] if confirmation_requests else None
                 )
-                yield f"data: {error_response.model_dump_json()}\n\n"
+                yield final_response
+
+        except Exception as e:
+            # 如果流处理过程中出现错误，发送错误信息
+            logger.error(f"流式处理过程中出现错误: {str(e)}")
+            error_response = ChunkChatCompletionResponse(
+                session_id=str(session_id),
+                chunk=f"处理过程中出现错误: {str(e)}",
+                status="error",
+                created_at=time.time(),
+                model="tongyi",
+                is_final=True,
+                message_type="assistant"
+            )
+            yield error_response
+
+
+async def handle_streaming_chat(session_id: UUID, inputs: Any, config: Dict[str, Any]):
+    """处理流式模式的聊天 - 使用LangGraph标准流程进行流式输出"""
 
-            finally:
-                # 确保发送流结束标记
-                yield "data: [DONE]\n\n"
+    async def generate_stream():
+        """生成SSE流式数据（异步生成器）"""
+        try:
+            async for chunk_response in stream_chat_chunks(session_id, inputs, config):
+                yield f"data: {chunk_response.model_dump_json()}\n\n"
+        finally:
+            # 确保发送流结束标记
+            yield "data: [DONE]\n\n"
 
     # 返回StreamingResponse，设置正确的SSE headers
     return StreamingResponse(
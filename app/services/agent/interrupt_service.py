@@ -1,21 +1,45 @@
 """
 中断服务模块，用于处理用户主动中断对话的请求
+中断请求可能落在与运行中的对话不同的 worker 上：postgres 实现经 LISTEN/NOTIFY 广播，
+由正在运行该会话的 worker 登记；memory 实现只在进程内生效（单 worker 部署或测试）
 """
 import asyncio
-import uuid
-from typing import Dict, Any, Optional
+import json
+from contextlib import contextmanager
+from typing import Dict, Any, Iterator, Optional
+from app.core.config import settings
 from app.core.logger import logger
+from app.core.ttl_registry import TTLRegistry
+
+# 中断请求广播频道（所有 worker 共同监听）
+INTERRUPT_CHANNEL = "opsagent_interrupts"
+
+# 广播负载中中断原因的最大长度（NOTIFY 负载上限为 7999 字节）
+MAX_REASON_LENGTH = 1000
 
 class InterruptService:
-    """中断服务类"""
+    """中断服务类（进程内实现）"""
     
     def __init__(self):
         # 存储会话的中断事件，键为session_id，值为asyncio.Event
-        self._interrupt_events: Dict[str, asyncio.Event] = {}
+        # 没有运行在消费的中断请求（例如对话已结束后才点击停止）在 INTERRUPT_STATE_TTL 秒后过期
+        self._interrupt_events: TTLRegistry[asyncio.Event] = TTLRegistry(
+            "interrupt_events", ttl=settings.interrupt_state_ttl
+        )
         # 存储会话的中断状态，键为session_id，值为中断原因
-        self._interrupt_status: Dict[str, str] = {}
-    
-    def request_interrupt(self, session_id: str, reason: str = "User requested interrupt") -> None:
+        self._interrupt_status: TTLRegistry[str] = TTLRegistry(
+            "interrupt_status", ttl=settings.interrupt_state_ttl
+        )
+        # 本进程内进行中的运行：session_id -> 运行数
+        self._active_runs: Dict[str, int] = {}
+
+    async def start(self) -> None:
+        """启动中断请求的接收（进程内实现无需启动）"""
+
+    async def stop(self) -> None:
+        """停止中断请求的接收"""
+
+    async def request_interrupt(self, session_id: str, reason: str = "User requested interrupt") -> None:
         """
         请求中断指定会话的对话
         
@@ -24,16 +48,54 @@ class InterruptService:
             reason: 中断原因
         """
         logger.info(f"收到中断请求: session_id={session_id}, reason={reason}")
-        
+        self._apply_interrupt(session_id, reason)
+
+    @contextmanager
+    def track_run(self, session_id: str) -> Iterator[None]:
+        """
+        标记会话在本进程内有进行中的运行
+
+        只有运行期间收到的中断请求会被登记；运行结束时清除未被消费的中断状态，
+        避免残留的请求打断之后的对话。
+        """
+        session_id = str(session_id)
+        self._active_runs[session_id] = self._active_runs.get(session_id, 0) + 1
+        try:
+            yield
+        finally:
+            remaining = self._active_runs.get(session_id, 1) - 1
+            if remaining > 0:
+                self._active_runs[session_id] = remaining
+            else:
+                self._active_runs.pop(session_id, None)
+                self._interrupt_status.pop(session_id)
+
+    def is_running(self, session_id: str) -> bool:
+        """会话是否在本进程内有进行中的运行"""
+        return str(session_id) in self._active_runs
+
+    def _apply_interrupt(self, session_id: str, reason: str) -> bool:
+        """
+        在本进程内登记中断
+
+        Returns:
+            会话是否在本进程内运行（不在时忽略该请求）
+        """
+        if not self.is_running(session_id):
+            logger.debug(f"会话不在本进程内运行，忽略中断请求: session_id={session_id}")
+            return False
+
         # 设置中断状态
-        self._interrupt_status[session_id] = reason
+        self._interrupt_status.set(session_id, reason)
+        logger.info(f"已登记中断请求: session_id={session_id}, reason={reason}")
         
         # 如果存在中断事件，则触发它
-        if session_id in self._interrupt_events:
-            event = self._interrupt_events[session_id]
+        event = self._interrupt_events.get(session_id)
+        if event is not None:
             if not event.is_set():
                 event.set()
                 logger.info(f"已触发中断事件: session_id={session_id}")
+        return True
     
     def register_interrupt_event(self, session_id: str) -> asyncio.Event:
         """
@@ -46,13 +108,12 @@ class InterruptService:
             asyncio.Event: 中断事件
         """
         # 创建或获取中断事件
-        if session_id not in self._interrupt_events:
-            self._interrupt_events[session_id] = asyncio.Event()
+        event = self._interrupt_events.setdefault(session_id, asyncio.Event)
         
         # 重置事件状态
-        self._interrupt_events[session_id].clear()
+        event.clear()
         logger.info(f"已注册中断事件: session_id={session_id}")
-        return self._interrupt_events[session_id]
+        return event
     
     def check_interrupt_requested(self, session_id: str) -> bool:
         """
@@ -85,11 +146,11 @@ class InterruptService:
         Args:
             session_id: 会话ID
         """
-        if session_id in self._interrupt_status:
-            del self._interrupt_status[session_id]
+        self._interrupt_status.pop(session_id)
         
-        if session_id in self._interrupt_events:
-            self._interrupt_events[session_id].clear()
+        event = self._interrupt_events.get(session_id)
+        if event is not None:
+            event.clear()
         
         logger.info(f"已清除中断状态: session_id={session_id}")
     
@@ -118,9 +179,71 @@ class InterruptService:
         except asyncio.TimeoutError:
             return False
 
-# 全局中断服务实例
-interrupt_service = InterruptService()
+
+class PgInterruptService(InterruptService):
+    """
+    基于 Postgres LISTEN/NOTIFY 的中断服务
+
+    每个 worker 启动时监听同一个中断频道；中断请求以 JSON 负载广播，正在运行该会话的 worker
+    收到后登记中断（发起请求的 worker 同样经通知收到，投递路径只有一条）。
+    监听循环未运行或发送失败时退化为进程内登记。
+    """
+
+    def __init__(self, hub):
+        super().__init__()
+        self.hub = hub
+        self._subscribed = False
+
+    async def start(self) -> None:
+        if not self._subscribed:
+            await self.hub.subscribe(INTERRUPT_CHANNEL, self._on_notify)
+            self._subscribed = True
+            logger.info(f"中断服务已监听频道 {INTERRUPT_CHANNEL}")
+
+    async def stop(self) -> None:
+        if self._subscribed:
+            await self.hub.unsubscribe(INTERRUPT_CHANNEL, self._on_notify)
+            self._subscribed = False
+
+    async def request_interrupt(self, session_id: str, reason: str = "User requested interrupt") -> None:
+        logger.info(f"收到中断请求: session_id={session_id}, reason={reason}")
+        if not (self._subscribed and self.hub.running):
+            self._apply_interrupt(session_id, reason)
+            return
+        payload = json.dumps(
+            {"session_id": str(session_id), "reason": reason[:MAX_REASON_LENGTH]},
+            ensure_ascii=False,
+        )
+        try:
+            await self.hub.publish(INTERRUPT_CHANNEL, payload)
+        except Exception as e:
+            logger.error(f"广播中断请求失败，仅在本进程内登记: session_id={session_id}, error={e}")
+            self._apply_interrupt(session_id, reason)
+
+    def _on_notify(self, payload: Optional[str]) -> None:
+        # 中断请求只对进行中的运行有意义，监听重连后无需补发
+        if payload is None:
+            return
+        try:
+            message = json.loads(payload)
+        except json.JSONDecodeError:
+            logger.warning(f"中断频道收到无法解析的消息: {payload[:200]}")
+            return
+        session_id = message.get("session_id")
+        if session_id:
+            self._apply_interrupt(str(session_id), message.get("reason") or "User requested interrupt")
+
+
+_interrupt_service: Optional[InterruptService] = None
 
 def get_interrupt_service() -> InterruptService:
-    """获取全局中断服务实例"""
-    return interrupt_service
\ No newline at end of file
+    """获取全局中断服务实例（INTERRUPT_BACKEND=memory 时使用进程内实现）"""
+    global _interrupt_service
+    if _interrupt_service is None:
+        if settings.interrupt_backend == "memory":
+            _interrupt_service = InterruptService()
+        else:
+            from app.core.pg_notify import get_pg_notify_hub
+            _interrupt_service = PgInterruptService(get_pg_notify_hub())
+        logger.info(f"中断服务: {type(_interrupt_service).__name__}")
+    return _interrupt_service
\ No newline at end of file
@@ -1,4 +1,5 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, AsyncIterator
+from contextlib import asynccontextmanager
 from langchain_core.tools import BaseTool
 from app.agent.tools.custom_tools import get_custom_tools
 from app.agent.tools.mcp_tools import mcp_tool_manager
@@ -57,31 +58,39 @@ class MCPManager:
             logger.error(f"加载MCP工具失败: {e}")
             return []
 
+    @asynccontextmanager
+    async def lease_tools(self) -> AsyncIterator[List[BaseTool]]:
+        """
+        租用当前MCP工具集用于一次图运行
+
+        运行期间即使发生重载，本次运行也会一直使用租用时的工具集，
+        旧工具集在所有租用结束后才会被关闭。
+        """
+        async with self.mcp_tool_manager.lease() as snapshot:
+            yield list(snapshot.tools) if snapshot else []
+
     async def reload_mcp_tools(self) -> Dict[str, Any]:
-        """重新加载MCP工具"""
+        """重新加载MCP工具（构建新快照后原子替换，不影响正在运行的会话）"""
         try:
             logger.info("开始重新加载MCP工具...")
 
-            # 重新加载MCP配置
-            self.mcp_tool_manager.mcp_servers_config = self.mcp_tool_manager._load_mcp_servers_config()
-            self.mcp_tool_manager.mcp_client = None  # 重置客户端
-            self.mcp_tool_manager.tools.clear()  # 清空缓存
-
-            # 加载新工具
-            tools = await self.get_mcp_tools()
+            snapshot = await self.mcp_tool_manager.reload_snapshot()
 
             return {
                 "success": True,
                 "message": "MCP工具重新加载成功",
-                "mcp_tools_count": len(tools),
-                "mcp_tools": [tool.name for tool in tools]
+                "version": snapshot.version,
+                "mcp_tools_count": len(snapshot.tools),
+                "mcp_tools": [tool.name for tool in snapshot.tools]
             }
 
         except Exception as e:
             logger.error(f"重新加载MCP工具失败: {e}")
+            current_version = self.mcp_tool_manager.snapshot_version
             return {
                 "success": False,
-                "message": f"重新加载MCP工具失败: {str(e)}",
+                "message": f"重新加载MCP工具失败: {str(e)}，继续使用当前工具集（版本 {current_version}）",
+                "version": current_version,
                 "error": str(e)
             }
 
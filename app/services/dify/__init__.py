@@ -1,10 +1,11 @@
 """Dify Agent 集成服务"""
 
-from app.services.dify.client import DifyClient
+from app.services.dify.client import DifyClient, dify_http_clients
 from app.services.dify.manager import DifyAgentManager, get_dify_manager
 
 __all__ = [
     "DifyClient",
+    "dify_http_clients",
     "DifyAgentManager",
     "get_dify_manager",
 ]
@@ -0,0 +1,262 @@
+"""Dify Agent 批量基准测试 - 并发探测所有 Agent 的延迟、首字节时间和错误率"""
+
+import asyncio
+import math
+import time
+from typing import Any, Dict, List, Optional, Sequence
+from uuid import uuid4
+
+import psycopg2
+from psycopg2.extras import Json, RealDictCursor
+
+from app.core.config import settings
+from app.core.logger import logger
+from app.services.dify.client import DifyClient
+from app.services.dify.streaming import _error_message, stream_dify_response
+
+# 未指定探测查询时使用的默认查询
+DEFAULT_PROBE_QUERY = "你好"
+
+
+def percentile(values: Sequence[float], p: float) -> Optional[float]:
+    """最近秩法计算百分位数，没有样本时返回 None"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(math.ceil(p / 100 * len(ordered)) - 1, 0)]
+
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return round(value, 1) if value is not None else None
+
+
+async def probe_agent(agent, query: str, user_id: str, timeout: float) -> Dict[str, Any]:
+    """
+    以流式模式调用一次 Agent
+
+    Returns:
+        {"ok", "latency_ms", "ttfb_ms", "error"}；ttfb_ms 为收到第一个事件的耗时
+    """
+    client = DifyClient(base_url=agent.base_url, api_key=agent.api_key, timeout=timeout)
+    start = time.monotonic()
+    first_byte: List[float] = []
+
+    def _mark_first(*_):
+        if not first_byte:
+            first_byte.append(time.monotonic())
+
+    try:
+        await asyncio.wait_for(
+            stream_dify_response(
+                client,
+                agent_type=agent.agent_type,
+                query=query,
+                user_id=user_id,
+                inputs=dict(agent.config.get("inputs") or {}),
+                on_delta=_mark_first,
+                on_event=_mark_first,
+            ),
+            timeout=timeout,
+        )
+        error = None
+    except asyncio.TimeoutError:
+        error = f"超时（{timeout:.0f} 秒）"
+    except Exception as e:
+        error = _error_message(e)
+    finally:
+        await client.close()
+
+    end = time.monotonic()
+    return {
+        "ok": error is None,
+        "latency_ms": (end - start) * 1000,
+        "ttfb_ms": (first_byte[0] - start) * 1000 if first_byte else None,
+        "error": error,
+    }
+
+
+def summarize_probes(agent, probes: List[Dict[str, Any]], elapsed: float) -> Dict[str, Any]:
+    """汇总单个 Agent 的探测结果"""
+    latencies = [probe["latency_ms"] for probe in probes if probe["ok"]]
+    ttfbs = [probe["ttfb_ms"] for probe in probes if probe["ok"] and probe["ttfb_ms"] is not None]
+    errors = [probe["error"] for probe in probes if not probe["ok"]]
+    return {
+        "agent_id": agent.id,
+        "agent_name": agent.name,
+        "agent_type": agent.agent_type,
+        "probes": len(probes),
+        "errors": len(errors),
+        "error_rate": round(len(errors) / len(probes), 3) if probes else 0.0,
+        "p50_ms": _round(percentile(latencies, 50)),
+        "p95_ms": _round(percentile(latencies, 95)),
+        "p99_ms": _round(percentile(latencies, 99)),
+        "ttfb_p50_ms": _round(percentile(ttfbs, 50)),
+        "ttfb_p95_ms": _round(percentile(ttfbs, 95)),
+        # 成功调用数 / 该 Agent 全部探测的墙钟时间
+        "throughput_rps": round(len(latencies) / elapsed, 3) if elapsed > 0 else None,
+        "sample_errors": sorted(set(errors))[:3],
+    }
+
+
+class DifyBenchmarkService:
+    """
+    Dify Agent 批量基准测试
+
+    对每个 Agent 发送 N 次探测查询，所有探测共用一个信号量限制总并发；
+    结果按 Agent 汇总为 p50/p95/p99 延迟、首字节时间、错误率和吞吐量，并写入历史表用于趋势对比。
+    探测直接调用 Dify，不经过熔断器，也不计入熔断统计。
+    """
+
+    def __init__(self):
+        self.db_url = settings.database_url
+
+    async def run(
+        self,
+        agents: Sequence,
+        probes_per_agent: int,
+        concurrency: int,
+        queries: Optional[List[str]] = None,
+        timeout: Optional[float] = None,
+        user_id: str = "benchmark",
+    ) -> Dict[str, Any]:
+        """
+        执行一次基准测试
+
+        Args:
+            agents: 待测 Agent 列表
+            probes_per_agent: 每个 Agent 的探测次数
+            concurrency: 全局并发上限
+            queries: 探测查询，按轮次循环使用；不传时使用 Agent 配置的 benchmark_query 或默认查询
+            timeout: 单次探测超时（秒）
+            user_id: 发送给 Dify 的用户 ID
+
+        Returns:
+            本次测试的汇总结果
+        """
+        timeout = timeout or settings.dify_benchmark_timeout
+        semaphore = asyncio.Semaphore(max(concurrency, 1))
+        started_at = time.monotonic()
+
+        async def _probe(agent, index: int) -> Dict[str, Any]:
+            if queries:
+                query = queries[index % len(queries)]
+            else:
+                query = agent.config.get("benchmark_query") or DEFAULT_PROBE_QUERY
+            async with semaphore:
+                return await probe_agent(agent, query, user_id, timeout)
+
+        async def _bench_agent(agent) -> Dict[str, Any]:
+            agent_start = time.monotonic()
+            probes = await asyncio.gather(*(_probe(agent, i) for i in range(probes_per_agent)))
+            return summarize_probes(agent, list(probes), time.monotonic() - agent_start)
+
+        results = await asyncio.gather(*(_bench_agent(agent) for agent in agents))
+        duration = time.monotonic() - started_at
+
+        total_probes = sum(result["probes"] for result in results)
+        total_errors = sum(result["errors"] for result in results)
+        report = {
+            "run_id": uuid4().hex[:12],
+            "agent_count": len(results),
+            "probes_per_agent": probes_per_agent,
+            "concurrency": concurrency,
+            "duration_ms": round(duration * 1000, 1),
+            "total_probes": total_probes,
+            "error_rate": round(total_errors / total_probes, 3) if total_probes else 0.0,
+            "throughput_rps": round((total_probes - total_errors) / duration, 3) if duration > 0 else None,
+            "agents": results,
+        }
+        logger.info(
+            f"Dify 基准测试完成: run_id={report['run_id']}, Agent 数={len(results)}, "
+            f"探测数={total_probes}, 错误率={report['error_rate']:.1%}, 耗时={report['duration_ms']:.0f}ms"
+        )
+
+        try:
+            await asyncio.to_thread(self._save, report)
+        except Exception as e:
+            logger.error(f"保存 Dify 基准测试结果失败: {e}")
+        return report
+
+    def _save(self, report: Dict[str, Any]) -> None:
+        conn = psycopg2.connect(self.db_url)
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    """
+                    INSERT INTO dify_benchmark_runs
+                        (id, agent_count, probes_per_agent, concurrency, duration_ms,
+                         total_probes, error_rate, throughput_rps)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                    """,
+                    (
+                        report["run_id"], report["agent_count"], report["probes_per_agent"],
+                        report["concurrency"], report["duration_ms"], report["total_probes"],
+                        report["error_rate"], report["throughput_rps"],
+                    ),
+                )
+                for result in report["agents"]:
+                    cursor.execute(
+                        """
+                        INSERT INTO dify_benchmark_results
+                            (run_id, agent_id, agent_name, probes, errors, error_rate,
+                             p50_ms, p95_ms, p99_ms, ttfb_p50_ms, ttfb_p95_ms,
+                             throughput_rps, sample_errors)
+                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                        """,
+                        (
+                            report["run_id"], result["agent_id"], result["agent_name"],
+                            result["probes"], result["errors"], result["error_rate"],
+                            result["p50_ms"], result["p95_ms"], result["p99_ms"],
+                            result["ttfb_p50_ms"], result["ttfb_p95_ms"],
+                            result["throughput_rps"], Json(result["sample_errors"]),
+                        ),
+                    )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _history(self, agent_id: Optional[str], limit: int) -> List[Dict[str, Any]]:
+        conn = psycopg2.connect(self.db_url)
+        try:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                if agent_id:
+                    cursor.execute(
+                        """
+                        SELECT r.*, b.created_at
+                        FROM dify_benchmark_results r
+                        JOIN dify_benchmark_runs b ON b.id = r.run_id
+                        WHERE r.agent_id = %s
+                        ORDER BY b.created_at DESC
+                        LIMIT %s
+                        """,
+                        (agent_id, limit),
+                    )
+                else:
+                    cursor.execute(
+                        "SELECT * FROM dify_benchmark_runs ORDER BY created_at DESC LIMIT %s",
+                        (limit,),
+                    )
+                rows = cursor.fetchall()
+        finally:
+            conn.close()
+
+        history = []
+        for row in rows:
+            item = dict(row)
+            item["created_at"] = item["created_at"].isoformat() if item.get("created_at") else None
+            history.append(item)
+        return history
+
+    async def history(self, agent_id: Optional[str] = None, limit: int = 20) -> List[Dict[str, Any]]:
+        """
+        查询历史结果（按时间倒序）
+
+        Args:
+            agent_id: 指定时返回该 Agent 每次测试的指标，否则返回每次测试的总体指标
+            limit: 返回条数
+        """
+        return await asyncio.to_thread(self._history, agent_id, limit)
+
+
+# 全局基准测试服务实例
+dify_benchmark_service = DifyBenchmarkService()
@@ -0,0 +1,265 @@
+"""Dify 调用熔断与自适应超时 - 每个 Agent 独立统计失败率和耗时"""
+
+import asyncio
+import math
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+
+import httpx
+
+from app.core.config import settings
+from app.core.logger import logger
+
+T = TypeVar("T")
+
+# 熔断器状态
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+
+class DifyCircuitOpenError(Exception):
+    """熔断器打开，调用被直接拒绝"""
+
+    def __init__(self, agent_name: str, retry_after: float, reason: str):
+        super().__init__(f"Dify Agent '{agent_name}' 已熔断: {reason}")
+        self.agent_name = agent_name
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class DifyCallTimeoutError(Exception):
+    """调用超过自适应超时时间"""
+
+    def __init__(self, agent_name: str, timeout: float):
+        super().__init__(f"Dify Agent '{agent_name}' 调用超时（{timeout:.0f} 秒）")
+        self.agent_name = agent_name
+        self.timeout = timeout
+
+
+def is_breaker_failure(error: BaseException) -> bool:
+    """
+    判断异常是否计入熔断失败
+
+    网络错误、超时、5xx 和 429 说明 Dify 侧不健康；其余 4xx 通常是请求参数问题，不计入。
+    """
+    if isinstance(error, (DifyCallTimeoutError, httpx.TransportError, asyncio.TimeoutError)):
+        return True
+    status = None
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+    elif hasattr(error, "status"):
+        status = getattr(error, "status")
+    if status is None:
+        return True
+    return status >= 500 or status == 429
+
+
+def format_unavailable_message(error: Exception) -> str:
+    """生成给模型看的错误说明，提示它换用其他途径"""
+    if isinstance(error, DifyCircuitOpenError):
+        return (
+            f"Dify Agent '{error.agent_name}' 暂时不可用（{error.reason}），"
+            f"约 {math.ceil(error.retry_after)} 秒内不会再调用。"
+            f"请不要重试该工具，改用其他工具或根据已有信息直接回答用户。"
+        )
+    if isinstance(error, DifyCallTimeoutError):
+        return (
+            f"Dify Agent '{error.agent_name}' 在 {error.timeout:.0f} 秒内没有完成，已放弃本次调用。"
+            f"请改用其他工具或根据已有信息直接回答用户。"
+        )
+    return str(error)
+
+
+class DifyCircuitBreaker:
+    """
+    单个 Dify Agent 的熔断器
+
+    在最近 N 次调用的滑动窗口内统计失败率和慢调用率，超过阈值后打开熔断，
+    冷却期内直接拒绝调用；冷却结束后放行一次探测调用（半开），成功则恢复，失败则继续熔断。
+    超时时间取最近成功调用耗时的 p99 乘以放大系数，限制在 [最小超时, Agent 配置的超时] 之间。
+    """
+
+    def __init__(self, agent_id: str, agent_name: str):
+        self.agent_id = agent_id
+        self.agent_name = agent_name
+        self.state = STATE_CLOSED
+        # 最近调用结果: (是否失败, 是否慢调用)
+        self._outcomes: deque = deque(maxlen=settings.dify_breaker_window)
+        # 最近成功调用的耗时（秒），用于计算 p99
+        self._latencies: deque = deque(maxlen=settings.dify_latency_window)
+        self._opened_at: Optional[float] = None
+        self._open_reason: str = ""
+        self._probe_in_flight = False
+
+    def _retry_after(self) -> float:
+        if self._opened_at is None:
+            return 0.0
+        return max(settings.dify_breaker_open_seconds - (time.monotonic() - self._opened_at), 0.0)
+
+    def p99_latency(self) -> Optional[float]:
+        """最近成功调用耗时的 p99，样本不足时返回 None"""
+        if len(self._latencies) < settings.dify_adaptive_timeout_min_samples:
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[max(math.ceil(0.99 * len(ordered)) - 1, 0)]
+
+    def current_timeout(self, max_timeout: float) -> float:
+        """本次调用的超时时间"""
+        p99 = self.p99_latency()
+        if p99 is None or not settings.dify_adaptive_timeout:
+            return max_timeout
+        adaptive = max(p99 * settings.dify_timeout_p99_multiplier, settings.dify_min_timeout)
+        return min(adaptive, max_timeout)
+
+    def is_available(self) -> bool:
+        """是否可以发起调用（不改变状态）"""
+        if not settings.dify_breaker_enabled:
+            return True
+        if self.state == STATE_OPEN:
+            return self._retry_after() <= 0
+        return not (self.state == STATE_HALF_OPEN and self._probe_in_flight)
+
+    def ensure_available(self) -> None:
+        """熔断打开时抛出 DifyCircuitOpenError（不改变状态）"""
+        if not self.is_available():
+            retry_after = self._retry_after() if self.state == STATE_OPEN else 1.0
+            raise DifyCircuitOpenError(self.agent_name, retry_after, self._open_reason or "正在进行恢复探测")
+
+    def _acquire(self) -> bool:
+        """检查是否允许调用，返回本次是否为半开探测"""
+        if self.state == STATE_OPEN:
+            if self._retry_after() > 0:
+                raise DifyCircuitOpenError(self.agent_name, self._retry_after(), self._open_reason)
+            self.state = STATE_HALF_OPEN
+            logger.info(f"Dify Agent '{self.agent_name}' 熔断冷却结束，进入半开状态")
+
+        if self.state == STATE_HALF_OPEN:
+            if self._probe_in_flight:
+                raise DifyCircuitOpenError(self.agent_name, 1.0, "正在进行恢复探测")
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def _trip(self, reason: str) -> None:
+        self.state = STATE_OPEN
+        self._opened_at = time.monotonic()
+        self._open_reason = reason
+        logger.warning(
+            f"Dify Agent '{self.agent_name}' 熔断打开: {reason}，"
+            f"{settings.dify_breaker_open_seconds:.0f} 秒内的调用将直接失败"
+        )
+
+    def _record(self, failed: bool, slow: bool, probe: bool) -> None:
+        if probe:
+            self._probe_in_flight = False
+            if failed:
+                self._trip("恢复探测失败")
+                return
+            self.state = STATE_CLOSED
+            self._outcomes.clear()
+            logger.info(f"Dify Agent '{self.agent_name}' 恢复探测成功，熔断关闭")
+
+        self._outcomes.append((failed, slow))
+        if self.state != STATE_CLOSED or len(self._outcomes) < settings.dify_breaker_min_calls:
+            return
+
+        total = len(self._outcomes)
+        error_rate = sum(1 for f, _ in self._outcomes if f) / total
+        slow_rate = sum(1 for _, s in self._outcomes if s) / total
+        if error_rate >= settings.dify_breaker_error_rate:
+            self._trip(f"最近 {total} 次调用失败率 {error_rate:.0%}")
+        elif slow_rate >= settings.dify_breaker_slow_call_rate:
+            self._trip(f"最近 {total} 次调用中 {slow_rate:.0%} 超过 {settings.dify_breaker_slow_call_seconds:.0f} 秒")
+
+    def _is_slow(self, latency: float) -> bool:
+        return latency >= settings.dify_breaker_slow_call_seconds
+
+    async def call(self, func: Callable[[], Awaitable[T]], max_timeout: float, adaptive: bool = True) -> T:
+        """
+        在熔断器保护下执行调用
+
+        Args:
+            func: 返回协程的可调用对象
+            max_timeout: 超时上限（秒），通常为 Agent 配置的超时时间
+            adaptive: 是否参与耗时统计。后台工作流本来就要跑很久，传 False 时超时固定为 max_timeout，
+                耗时不计入 p99 和慢调用，只有失败计入熔断
+
+        Raises:
+            DifyCircuitOpenError: 熔断打开，未发起调用
+            DifyCallTimeoutError: 超过本次超时时间
+        """
+        if not settings.dify_breaker_enabled:
+            return await func()
+
+        probe = self._acquire()
+        timeout = self.current_timeout(max_timeout) if adaptive else max_timeout
+        start = time.monotonic()
+        try:
+            result = await asyncio.wait_for(func(), timeout=timeout)
+        except asyncio.TimeoutError:
+            # 超时按耗时等于超时时间记一个样本，真实耗时整体变长时超时随之放宽
+            if adaptive:
+                self._latencies.append(timeout)
+            self._record(True, adaptive and self._is_slow(timeout), probe)
+            raise DifyCallTimeoutError(self.agent_name, timeout)
+        except asyncio.CancelledError:
+            if probe:
+                self._probe_in_flight = False
+            raise
+        except Exception as e:
+            self._record(is_breaker_failure(e), adaptive and self._is_slow(time.monotonic() - start), probe)
+            raise
+
+        latency = time.monotonic() - start
+        if adaptive:
+            self._latencies.append(latency)
+        self._record(False, adaptive and self._is_slow(latency), probe)
+        return result
+
+    def snapshot(self) -> Dict[str, Any]:
+        """当前状态（用于监控接口）"""
+        total = len(self._outcomes)
+        p99 = self.p99_latency()
+        return {
+            "agent_id": self.agent_id,
+            "agent_name": self.agent_name,
+            "state": self.state,
+            "retry_after": round(self._retry_after(), 1) if self.state == STATE_OPEN else 0,
+            "open_reason": self._open_reason if self.state != STATE_CLOSED else None,
+            "window_calls": total,
+            "error_rate": round(sum(1 for f, _ in self._outcomes if f) / total, 3) if total else 0.0,
+            "p99_latency": round(p99, 3) if p99 is not None else None,
+        }
+
+
+class DifyCircuitBreakerRegistry:
+    """按 Agent 维护熔断器"""
+
+    def __init__(self):
+        self._breakers: Dict[str, DifyCircuitBreaker] = {}
+
+    def get(self, agent_id: Optional[str], agent_name: str) -> DifyCircuitBreaker:
+        """获取（必要时创建）Agent 的熔断器"""
+        key = agent_id or agent_name
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            breaker = DifyCircuitBreaker(key, agent_name)
+            self._breakers[key] = breaker
+        else:
+            breaker.agent_name = agent_name
+        return breaker
+
+    def is_available(self, agent_id: Optional[str]) -> bool:
+        """Agent 当前是否可以调用（熔断打开且仍在冷却期时为 False）"""
+        breaker = self._breakers.get(agent_id) if agent_id else None
+        return breaker is None or breaker.is_available()
+
+    def snapshot(self) -> list:
+        """所有熔断器的状态"""
+        return [breaker.snapshot() for breaker in self._breakers.values()]
+
+
+# 全局熔断器注册表
+dify_breakers = DifyCircuitBreakerRegistry()
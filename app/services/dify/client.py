@@ -1,9 +1,79 @@
 """Dify API 客户端"""
 
+import asyncio
+import json
 import httpx
-from typing import Dict, Any, Optional, AsyncIterator
+from typing import Dict, Any, Optional, AsyncIterator, Tuple
+from app.core.config import settings
 from app.core.logger import logger
 
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+class DifyHTTPClientRegistry:
+    """
+    进程级 Dify HTTP 客户端注册表
+
+    按 (base_url, api_key) 复用 httpx.AsyncClient，连接在调用之间保持，
+    避免每次调用都重新进行 DNS 解析、TCP 和 TLS 握手。应用关闭时统一关闭。
+    """
+
+    def __init__(self):
+        self._clients: Dict[Tuple[str, str], httpx.AsyncClient] = {}
+        self._lock = asyncio.Lock()
+
+    async def get(self, base_url: str, api_key: str) -> httpx.AsyncClient:
+        """获取（必要时创建）共享客户端"""
+        key = (base_url, api_key)
+        client = self._clients.get(key)
+        if client is not None and not client.is_closed:
+            return client
+
+        async with self._lock:
+            client = self._clients.get(key)
+            if client is None or client.is_closed:
+                client = self._create_client(api_key)
+                self._clients[key] = client
+                logger.info(f"创建 Dify 共享 HTTP 客户端: {base_url}, http2={settings.dify_http2 and HTTP2_AVAILABLE}")
+        return client
+
+    @staticmethod
+    def _create_client(api_key: str) -> httpx.AsyncClient:
+        """创建带连接池配置的客户端，超时由每次请求单独指定"""
+        return httpx.AsyncClient(
+            http2=settings.dify_http2 and HTTP2_AVAILABLE,
+            limits=httpx.Limits(
+                max_connections=settings.dify_max_connections,
+                max_keepalive_connections=settings.dify_max_keepalive_connections,
+                keepalive_expiry=settings.dify_keepalive_expiry,
+            ),
+            headers={
+                "Authorization": f"Bearer {api_key}",
+                "Content-Type": "application/json",
+            },
+        )
+
+    async def close(self):
+        """关闭所有共享客户端"""
+        async with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+        for client in clients:
+            try:
+                await client.aclose()
+            except Exception as e:
+                logger.warning(f"关闭 Dify HTTP 客户端失败: {e}")
+        if clients:
+            logger.info(f"已关闭 {len(clients)} 个 Dify 共享 HTTP 客户端")
+
+
+# 全局 Dify HTTP 客户端注册表
+dify_http_clients = DifyHTTPClientRegistry()
+
 
 class DifyClient:
     """Dify API 客户端,支持 Chat 和 Workflow 调用"""
@@ -13,6 +83,7 @@ class DifyClient:
         base_url: str,
         api_key: str,
         timeout: int = 60,
+        shared: bool = True,
     ):
         """
         初始化 Dify 客户端
@@ -21,6 +92,7 @@ class DifyClient:
             base_url: Dify API 基础 URL (完全按照 Dify 官方文档提供的 URL，例如: https://api.dify.ai/v1 或 https://oms-dify.300624.cn//v1)
             api_key: Dify API Key
             timeout: 请求超时时间(秒)
+            shared: 是否使用进程级共享的 HTTP 客户端（连接复用）；为 False 时创建独立客户端
         """
         # 完全不修改 base_url，按照 Dify 官方文档使用
         # 只去掉尾部斜杠（如果有）
@@ -28,10 +100,13 @@ class DifyClient:
         logger.debug(f"Dify base_url: {self.base_url}")
         self.api_key = api_key
         self.timeout = timeout
+        self.shared = shared
         self._client: Optional[httpx.AsyncClient] = None
 
     async def _get_client(self) -> httpx.AsyncClient:
         """获取或创建 HTTP 客户端"""
+        if self.shared:
+            return await dify_http_clients.get(self.base_url, self.api_key)
         if self._client is None or self._client.is_closed:
             self._client = httpx.AsyncClient(
                 timeout=self.timeout,
@@ -43,7 +118,7 @@ class DifyClient:
         return self._client
 
     async def close(self):
-        """关闭客户端连接"""
+        """关闭客户端连接（共享客户端由注册表统一管理，这里不关闭）"""
         if self._client and not self._client.is_closed:
             await self._client.aclose()
 
@@ -88,7 +163,7 @@ class DifyClient:
 
         try:
             logger.info(f"调用 Dify Chat API: {url}, user={user_id}")
-            response = await client.post(url, json=payload)
+            response = await client.post(url, json=payload, timeout=self.timeout)
             response.raise_for_status()
             result = response.json()
             logger.info(f"Dify Chat API 调用成功")
@@ -138,15 +213,27 @@ class DifyClient:
         if files:
             payload["files"] = files
 
+        logger.info(f"调用 Dify Chat API (流式): {url}, user={user_id}")
+        async for event in self._stream_events(client, url, payload):
+            yield event
+
+    async def _stream_events(
+        self,
+        client: httpx.AsyncClient,
+        url: str,
+        payload: Dict[str, Any],
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """发送流式请求并逐条解析 SSE 事件"""
         try:
-            logger.info(f"调用 Dify Chat API (流式): {url}, user={user_id}")
-            async with client.stream("POST", url, json=payload) as response:
+            async with client.stream("POST", url, json=payload, timeout=self.timeout) as response:
+                if response.is_error:
+                    # 流式响应需要先读取正文，调用方才能从异常中拿到错误信息
+                    await response.aread()
                 response.raise_for_status()
                 async for line in response.aiter_lines():
                     if line.startswith("data: "):
                         data = line[6:]  # 移除 "data: " 前缀
                         if data.strip():
-                            import json
                             try:
                                 yield json.loads(data)
                             except json.JSONDecodeError:
@@ -154,7 +241,7 @@ class DifyClient:
                                 continue
 
         except httpx.HTTPStatusError as e:
-            logger.error(f"Dify API HTTP 错误: {e.response.status_code}")
+            logger.error(f"Dify API HTTP 错误: {e.response.status_code} - {e.response.text}")
             raise
         except Exception as e:
             logger.error(f"Dify API 流式调用失败: {e}", exc_info=True)
@@ -193,7 +280,7 @@ class DifyClient:
 
         try:
             logger.info(f"调用 Dify Workflow API: {url}, user={user_id}")
-            response = await client.post(url, json=payload)
+            response = await client.post(url, json=payload, timeout=self.timeout)
             response.raise_for_status()
             result = response.json()
             logger.info(f"Dify Workflow API 调用成功")
@@ -206,6 +293,39 @@ class DifyClient:
             logger.error(f"Dify Workflow API 调用失败: {e}", exc_info=True)
             raise
 
+    async def run_workflow_stream(
+        self,
+        inputs: Dict[str, Any],
+        user_id: str,
+        files: Optional[list] = None,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        调用 Dify Workflow API (流式模式)
+
+        Args:
+            inputs: 工作流输入参数
+            user_id: 用户 ID
+            files: 文件列表 (可选)
+
+        Yields:
+            工作流事件 (workflow_started、node_started、text_chunk、workflow_finished 等)
+        """
+        client = await self._get_client()
+        url = f"{self.base_url}/workflows/run"
+
+        payload = {
+            "inputs": inputs,
+            "user": user_id,
+            "response_mode": "streaming",
+        }
+
+        if files:
+            payload["files"] = files
+
+        logger.info(f"调用 Dify Workflow API (流式): {url}, user={user_id}")
+        async for event in self._stream_events(client, url, payload):
+            yield event
+
     async def get_conversation_messages(
         self,
         conversation_id: str,
@@ -234,7 +354,7 @@ class DifyClient:
 
         try:
             logger.info(f"获取 Dify 会话消息: conversation_id={conversation_id}")
-            response = await client.get(url, params=params)
+            response = await client.get(url, params=params, timeout=self.timeout)
             response.raise_for_status()
             return response.json()
 
@@ -267,7 +387,7 @@ class DifyClient:
 
         try:
             logger.info(f"停止 Dify 消息生成: task_id={task_id}")
-            response = await client.post(url, json=payload)
+            response = await client.post(url, json=payload, timeout=self.timeout)
             response.raise_for_status()
             return response.json()
 
@@ -0,0 +1,121 @@
+"""Dify 会话映射 - 在同一个会话内复用 Dify conversation_id"""
+
+import asyncio
+from typing import Optional
+
+import psycopg2
+from app.core.config import settings
+from app.core.logger import logger
+
+
+def is_conversation_missing(status_code: Optional[int], message: str) -> bool:
+    """判断 Dify 错误是否表示会话已不存在（被删除或过期）"""
+    return status_code == 404 and "conversation" in (message or "").lower()
+
+
+class DifyConversationStore:
+    """
+    持久化 (session_id, agent_id) -> Dify conversation_id 的映射
+
+    同一会话内再次调用同一个 Dify Agent 时自动带上之前的 conversation_id，
+    Dify 侧保留上下文，查询内容不必重复描述背景。超过
+    DIFY_CONVERSATION_TTL_HOURS 未使用的映射视为过期。
+    """
+
+    def __init__(self):
+        self.db_url = settings.database_url
+
+    def _get(self, session_id: str, agent_id: str) -> Optional[str]:
+        conn = psycopg2.connect(self.db_url)
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    """
+                    SELECT conversation_id FROM dify_conversations
+                    WHERE session_id = %s AND agent_id = %s
+                      AND last_used_at > NOW() - make_interval(hours => %s)
+                    """,
+                    (session_id, agent_id, settings.dify_conversation_ttl_hours),
+                )
+                row = cursor.fetchone()
+                return row[0] if row else None
+        finally:
+            conn.close()
+
+    def _save(self, session_id: str, agent_id: str, conversation_id: str) -> None:
+        conn = psycopg2.connect(self.db_url)
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    """
+                    INSERT INTO dify_conversations (session_id, agent_id, conversation_id)
+                    VALUES (%s, %s, %s)
+                    ON CONFLICT (session_id, agent_id) DO UPDATE
+                    SET conversation_id = EXCLUDED.conversation_id,
+                        last_used_at = CURRENT_TIMESTAMP
+                    """,
+                    (session_id, agent_id, conversation_id),
+                )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _reset(self, session_id: str, agent_id: Optional[str] = None) -> int:
+        conn = psycopg2.connect(self.db_url)
+        try:
+            with conn.cursor() as cursor:
+                if agent_id:
+                    cursor.execute(
+                        "DELETE FROM dify_conversations WHERE session_id = %s AND agent_id = %s",
+                        (session_id, agent_id),
+                    )
+                else:
+                    cursor.execute(
+                        "DELETE FROM dify_conversations WHERE session_id = %s",
+                        (session_id,),
+                    )
+                count = cursor.rowcount
+            conn.commit()
+            return count
+        finally:
+            conn.close()
+
+    async def get(self, session_id: Optional[str], agent_id: Optional[str]) -> Optional[str]:
+        """获取可复用的 conversation_id，查询失败时按新会话处理"""
+        if not session_id or not agent_id:
+            return None
+        try:
+            return await asyncio.to_thread(self._get, str(session_id), str(agent_id))
+        except Exception as e:
+            logger.warning(f"查询 Dify 会话映射失败，使用新会话: {e}")
+            return None
+
+    async def save(self, session_id: Optional[str], agent_id: Optional[str], conversation_id: Optional[str]) -> None:
+        """记录（或刷新）会话映射"""
+        if not session_id or not agent_id or not conversation_id:
+            return
+        try:
+            await asyncio.to_thread(self._save, str(session_id), str(agent_id), conversation_id)
+        except Exception as e:
+            logger.warning(f"保存 Dify 会话映射失败: {e}")
+
+    async def reset(self, session_id: Optional[str], agent_id: Optional[str] = None) -> None:
+        """
+        清除会话映射
+
+        Args:
+            session_id: 会话ID
+            agent_id: Dify Agent ID，不传时清除该会话下的全部映射
+        """
+        if not session_id:
+            return
+        try:
+            count = await asyncio.to_thread(self._reset, str(session_id), str(agent_id) if agent_id else None)
+            if count:
+                logger.info(f"已重置 Dify 会话映射: session_id={session_id}, agent_id={agent_id or '全部'}")
+        except Exception as e:
+            logger.warning(f"重置 Dify 会话映射失败: {e}")
+
+
+# 全局会话映射实例
+dify_conversation_store = DifyConversationStore()
@@ -0,0 +1,125 @@
+"""Dify Agent 关键词路由索引 - 基于 Aho-Corasick 自动机的一次扫描多模式匹配"""
+
+from collections import deque
+from typing import Dict, List, Sequence, Tuple
+
+# 各类匹配项的权重
+KEYWORD_WEIGHT = 10
+CAPABILITY_WEIGHT = 5
+NAME_WEIGHT = 20
+DESCRIPTION_WEIGHT = 3
+
+
+class KeywordIndex:
+    """
+    Dify Agent 关键词索引
+
+    在 Agent 缓存加载时构建一次：关键词、能力、名称和描述（小写）作为模式串建立
+    Aho-Corasick 自动机，每个模式串预先记录它对应的 (Agent 下标, 权重)。
+    匹配时对查询只扫描一遍即可得到所有 Agent 的得分，与 Agent 和关键词数量无关。
+    同一模式串在查询中出现多次只计一次分。
+    """
+
+    def __init__(self, agents: Sequence):
+        self.agents = list(agents)
+        # 模式串 -> 模式ID
+        self._pattern_ids: Dict[str, int] = {}
+        # 模式ID -> [(Agent 下标, 权重)]
+        self._pattern_targets: List[List[Tuple[int, int]]] = []
+        # 自动机：状态转移、失败指针、每个状态可输出的模式ID
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[int]] = [[]]
+
+        for index, agent in enumerate(self.agents):
+            for keyword in agent.keywords or []:
+                self._add_pattern(keyword, index, KEYWORD_WEIGHT)
+            for capability in agent.capabilities or []:
+                self._add_pattern(capability, index, CAPABILITY_WEIGHT)
+            self._add_pattern(agent.name, index, NAME_WEIGHT)
+            if agent.description:
+                self._add_pattern(agent.description, index, DESCRIPTION_WEIGHT)
+
+        self._build_fail_links()
+
+    @property
+    def pattern_count(self) -> int:
+        """索引中的模式串数量"""
+        return len(self._pattern_targets)
+
+    def _add_pattern(self, text: str, agent_index: int, weight: int) -> None:
+        pattern = (text or "").lower()
+        if not pattern:
+            return
+
+        pattern_id = self._pattern_ids.get(pattern)
+        if pattern_id is None:
+            pattern_id = len(self._pattern_targets)
+            self._pattern_ids[pattern] = pattern_id
+            self._pattern_targets.append([])
+
+            state = 0
+            for ch in pattern:
+                next_state = self._goto[state].get(ch)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                    self._goto[state][ch] = next_state
+                state = next_state
+            self._output[state].append(pattern_id)
+
+        self._pattern_targets[pattern_id].append((agent_index, weight))
+
+    def _build_fail_links(self) -> None:
+        """按层序计算失败指针，并把失败链上的输出合并到当前状态"""
+        queue = deque()
+        for state in self._goto[0].values():
+            self._fail[state] = 0
+            queue.append(state)
+
+        while queue:
+            state = queue.popleft()
+            for ch, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(ch, 0)
+                self._output[next_state].extend(self._output[self._fail[next_state]])
+
+    def scores(self, query: str) -> Dict[int, int]:
+        """
+        计算查询对各 Agent 的关键词得分
+
+        Returns:
+            Agent 下标 -> 得分，只包含得分大于 0 的 Agent
+        """
+        matched = set()
+        state = 0
+        for ch in query.lower():
+            while state and ch not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(ch, 0)
+            if self._output[state]:
+                matched.update(self._output[state])
+
+        agent_scores: Dict[int, int] = {}
+        for pattern_id in matched:
+            for agent_index, weight in self._pattern_targets[pattern_id]:
+                agent_scores[agent_index] = agent_scores.get(agent_index, 0) + weight
+        return agent_scores
+
+    def match(self, query: str, top_k: int = 1) -> List[Tuple[object, int]]:
+        """
+        返回得分最高的 top_k 个 (Agent, 得分)，按得分、优先级降序
+
+        得分和优先级都相同时保持 Agent 的加载顺序。
+        """
+        agent_scores = self.scores(query)
+        ranked = sorted(
+            agent_scores.items(),
+            key=lambda item: (-item[1], -self.agents[item[0]].priority, item[0]),
+        )
+        return [(self.agents[index], score) for index, score in ranked[:top_k]]
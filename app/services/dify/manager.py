@@ -1,13 +1,26 @@
 """Dify Agent 管理器 - 负责加载、缓存和匹配 Dify Agent"""
 
 import asyncio
-from typing import List, Optional, Dict, Any
+from typing import Any, Callable, List, Optional, Dict
 from datetime import datetime, timedelta
 from dataclasses import dataclass
+import psycopg
 import psycopg2
 import psycopg2.extras
+from psycopg.rows import dict_row
 from app.core.logger import logger
 from app.core.config import settings
+from app.services.dify.keyword_index import KeywordIndex
+from app.services.dify.semantic_router import get_semantic_router
+
+# 关键词得分达到该值时视为完全匹配（例如名称命中 20 + 一个关键词 10）
+KEYWORD_SCORE_SATURATION = 30
+# 综合排序中优先级的最大加成
+PRIORITY_BONUS = 0.05
+# dify_agents 表变更通知频道（由表上的触发器发送）
+DIFY_AGENTS_CHANNEL = "dify_agents_changed"
+# 后台刷新失败后的重试间隔（秒）
+REFRESH_RETRY_SECONDS = 30
 
 
 @dataclass
@@ -30,6 +43,15 @@ class DifyAgentConfig:
     updated_at: datetime
 
 
+@dataclass
+class AgentMatch:
+    """Agent 匹配结果"""
+    agent: DifyAgentConfig
+    score: float  # 综合得分（0~1 左右，越大越匹配）
+    keyword_score: int  # 关键词原始得分
+    semantic_score: Optional[float] = None  # 与查询的余弦相似度，未启用语义路由时为空
+
+
 class DifyAgentManager:
     """Dify Agent 管理器"""
 
@@ -44,7 +66,15 @@ class DifyAgentManager:
         self.db_url = settings.database_url
         self._agents_cache: Optional[List[DifyAgentConfig]] = None
         self._cache_time: Optional[datetime] = None
-        self._lock = asyncio.Lock()
+        # 关键词路由索引，随 Agent 缓存一起重建
+        self._keyword_index: Optional[KeywordIndex] = None
+        self._keyword_index_source: Optional[List[DifyAgentConfig]] = None
+        # 缓存失效代数：变更通知或强制刷新时递增，缓存记录读取时的代数
+        self._generation = 0
+        self._cache_generation = -1
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._retry_at: Optional[datetime] = None
+        self._change_listeners: List[Callable[[], Any]] = []
         logger.info(f"Dify Agent Manager 初始化,缓存 TTL: {cache_ttl}秒")
 
     def _get_connection(self):
@@ -55,84 +85,157 @@ class DifyAgentManager:
 
     async def load_agents(self, force_reload: bool = False) -> List[DifyAgentConfig]:
         """
-        从数据库加载 Dify Agent 配置
+        获取 Dify Agent 配置（stale-while-revalidate）
+
+        缓存有效时直接返回；缓存过期或被变更通知标记失效时仍立即返回旧列表，
+        同时在后台刷新（同一时刻最多一个刷新任务）。只有首次加载或强制刷新时才等待数据库。
 
         Args:
-            force_reload: 是否强制重新加载
+            force_reload: 是否强制重新加载（等待读取到最新数据）
 
         Returns:
             Dify Agent 配置列表
         """
-        async with self._lock:
-            # 检查缓存是否有效
-            if not force_reload and self._is_cache_valid():
+        if not force_reload and self._agents_cache is not None:
+            if self._is_cache_valid():
                 logger.debug(f"使用缓存的 Dify Agent 配置,共 {len(self._agents_cache)} 个")
-                return self._agents_cache
-
-            # 从数据库加载
+            else:
+                self._schedule_refresh()
+            return self._agents_cache
+
+        if force_reload:
+            # 保证返回的是本次调用之后读取的数据，而不是正在进行中的旧刷新结果
+            self._generation += 1
+        return await asyncio.shield(self._ensure_refresh_task())
+
+    def _ensure_refresh_task(self) -> "asyncio.Task":
+        """获取正在进行的刷新任务，没有时创建一个"""
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._reload())
+        return self._refresh_task
+
+    def _schedule_refresh(self) -> None:
+        """在后台刷新缓存（已有刷新任务或处于失败退避期时跳过）"""
+        if self._refresh_task is not None and not self._refresh_task.done():
+            return
+        if self._retry_at and datetime.now() < self._retry_at:
+            return
+        logger.debug("Dify Agent 配置缓存已过期，后台刷新")
+        self._ensure_refresh_task()
+
+    async def _reload(self) -> List[DifyAgentConfig]:
+        """从数据库重新加载；加载期间缓存再次失效时继续加载，直到读到最新数据"""
+        while True:
+            generation = self._generation
             try:
-                conn = self._get_connection()
-                try:
-                    cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-                    cursor.execute("""
-                        SELECT
-                            id, name, description, agent_type, dify_app_id,
-                            api_key, base_url, capabilities, keywords, config,
-                            input_schema, enabled, priority, created_at, updated_at
-                        FROM dify_agents
-                        WHERE enabled = true
-                        ORDER BY priority DESC, created_at ASC
-                    """)
-
-                    rows = cursor.fetchall()
-                    agents = []
-                    for row in rows:
-                        agent = DifyAgentConfig(
-                            id=str(row["id"]),
-                            name=row["name"],
-                            description=row["description"],
-                            agent_type=row["agent_type"],
-                            dify_app_id=row["dify_app_id"],
-                            api_key=row["api_key"],
-                            base_url=row["base_url"],
-                            capabilities=row["capabilities"] or [],
-                            keywords=row["keywords"] or [],
-                            config=row["config"] or {},
-                            input_schema=row["input_schema"],
-                            enabled=row["enabled"],
-                            priority=row["priority"],
-                            created_at=row["created_at"],
-                            updated_at=row["updated_at"],
-                        )
-                        agents.append(agent)
-
-                    # 更新缓存
-                    self._agents_cache = agents
-                    self._cache_time = datetime.now()
-
-                    logger.info(f"从数据库加载了 {len(agents)} 个 Dify Agent 配置")
-                    return agents
-
-                finally:
-                    cursor.close()
-                    conn.close()
-
+                agents = await self._fetch_agents()
             except Exception as e:
                 logger.error(f"加载 Dify Agent 配置失败: {e}", exc_info=True)
+                self._retry_at = datetime.now() + timedelta(seconds=min(self.cache_ttl, REFRESH_RETRY_SECONDS))
                 # 如果有缓存,返回缓存
-                if self._agents_cache:
+                if self._agents_cache is not None:
                     logger.warning("使用过期的缓存数据")
                     return self._agents_cache
                 return []
 
+            self._set_cache(agents, generation)
+            if generation == self._generation:
+                return agents
+
+    async def _fetch_agents(self) -> List[DifyAgentConfig]:
+        """通过异步连接读取已启用的 Agent，不阻塞事件循环"""
+        async with await psycopg.AsyncConnection.connect(self.db_url) as conn:
+            async with conn.cursor(row_factory=dict_row) as cursor:
+                await cursor.execute("""
+                    SELECT
+                        id, name, description, agent_type, dify_app_id,
+                        api_key, base_url, capabilities, keywords, config,
+                        input_schema, enabled, priority, created_at, updated_at
+                    FROM dify_agents
+                    WHERE enabled = true
+                    ORDER BY priority DESC, created_at ASC
+                """)
+                rows = await cursor.fetchall()
+
+        return [
+            DifyAgentConfig(
+                id=str(row["id"]),
+                name=row["name"],
+                description=row["description"],
+                agent_type=row["agent_type"],
+                dify_app_id=row["dify_app_id"],
+                api_key=row["api_key"],
+                base_url=row["base_url"],
+                capabilities=row["capabilities"] or [],
+                keywords=row["keywords"] or [],
+                config=row["config"] or {},
+                input_schema=row["input_schema"],
+                enabled=row["enabled"],
+                priority=row["priority"],
+                created_at=row["created_at"],
+                updated_at=row["updated_at"],
+            )
+            for row in rows
+        ]
+
+    def _set_cache(self, agents: List[DifyAgentConfig], generation: int) -> None:
+        """更新缓存并重建关键词索引"""
+        self._agents_cache = agents
+        self._cache_time = datetime.now()
+        self._cache_generation = generation
+        self._retry_at = None
+        self._keyword_index = KeywordIndex(agents)
+        self._keyword_index_source = agents
+        logger.debug(f"Dify Agent 关键词索引已重建，共 {self._keyword_index.pattern_count} 个模式串")
+
+        # 启用语义路由时在后台为变化的 Agent 计算嵌入
+        if settings.dify_semantic_routing:
+            router = get_semantic_router()
+            if router is not None:
+                router.schedule_index(agents)
+
+        logger.info(f"从数据库加载了 {len(agents)} 个 Dify Agent 配置")
+
     def _is_cache_valid(self) -> bool:
         """检查缓存是否有效"""
         if self._agents_cache is None or self._cache_time is None:
             return False
+        if self._cache_generation != self._generation:
+            return False
 
         elapsed = (datetime.now() - self._cache_time).total_seconds()
         return elapsed < self.cache_ttl
 
+    def invalidate(self) -> None:
+        """标记缓存失效并在后台刷新，刷新完成前继续返回旧列表"""
+        self._generation += 1
+        self._retry_at = None
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._schedule_refresh()
+
+    def add_change_listener(self, listener: Callable[[], Any]) -> None:
+        """注册 Agent 配置变更监听器（在事件循环中被调用）"""
+        self._change_listeners.append(listener)
+
+    async def start_change_listener(self) -> None:
+        """订阅 dify_agents 表的变更通知"""
+        from app.core.pg_notify import get_pg_notify_hub
+        await get_pg_notify_hub().subscribe(DIFY_AGENTS_CHANNEL, self._on_agents_changed)
+        logger.info(f"已订阅 Dify Agent 配置变更通知: {DIFY_AGENTS_CHANNEL}")
+
+    async def _on_agents_changed(self, payload: Optional[str]) -> None:
+        """收到变更通知：使缓存失效并通知监听器"""
+        logger.info(f"收到 Dify Agent 配置变更通知: {payload}")
+        self.invalidate()
+        for listener in list(self._change_listeners):
+            try:
+                listener()
+            except Exception as e:
+                logger.error(f"Dify Agent 配置变更监听器执行失败: {e}", exc_info=True)
+
     async def get_agent_by_name(self, name: str) -> Optional[DifyAgentConfig]:
         """
         根据名称获取 Agent 配置
@@ -176,48 +279,88 @@ class DifyAgentManager:
         Returns:
             匹配的 Agent 列表,按优先级排序
         """
-        agents = await self.load_agents()
-        if not agents:
-            return []
+        matched = [match.agent for match in await self.rank_agents(query, top_k)]
 
-        # 简单的关键词匹配算法
-        scored_agents = []
-        query_lower = query.lower()
-
-        for agent in agents:
-            score = 0
-
-            # 关键词匹配
-            for keyword in agent.keywords:
-                if keyword.lower() in query_lower:
-                    score += 10
-
-            # 能力匹配
-            for capability in agent.capabilities:
-                if capability.lower() in query_lower:
-                    score += 5
+        if matched:
+            logger.info(f"为查询 '{query[:50]}...' 匹配到 {len(matched)} 个 Dify Agent")
+        
+        return matched
 
-            # 名称匹配
-            if agent.name.lower() in query_lower:
-                score += 20
+    async def rank_agents(self, query: str, top_k: int = 1) -> List[AgentMatch]:
+        """
+        对查询打分并返回前 k 个匹配结果
 
-            # 描述匹配
-            if agent.description and agent.description.lower() in query_lower:
-                score += 3
+        关键词得分来自预构建的索引；启用语义路由时再结合嵌入相似度，
+        综合得分 = 语义权重 × 相似度 + (1 - 语义权重) × 关键词得分（归一化）+ 优先级加成。
+        未启用语义路由时按关键词得分、优先级排序，与原有行为一致。
 
-            if score > 0:
-                scored_agents.append((agent, score))
+        Args:
+            query: 用户查询
+            top_k: 返回前 k 个匹配
 
-        # 按分数和优先级排序
-        scored_agents.sort(key=lambda x: (x[1], x[0].priority), reverse=True)
+        Returns:
+            按综合得分降序的匹配结果
+        """
+        agents = await self.load_agents()
+        if not agents:
+            return []
 
-        # 返回前 k 个
-        matched = [agent for agent, score in scored_agents[:top_k]]
-        
-        if matched:
-            logger.info(f"为查询 '{query[:50]}...' 匹配到 {len(matched)} 个 Dify Agent")
-        
-        return matched
+        keyword_scores = self._get_keyword_index(agents).scores(query)
+        similarities = await self._semantic_similarities(query, agents)
+
+        if similarities is None:
+            ranked = sorted(
+                keyword_scores.items(),
+                key=lambda item: (-item[1], -agents[item[0]].priority, item[0]),
+            )
+            return [
+                AgentMatch(
+                    agent=agents[index],
+                    score=min(score / KEYWORD_SCORE_SATURATION, 1.0),
+                    keyword_score=score,
+                )
+                for index, score in ranked[:top_k]
+            ]
+
+        weight = settings.dify_semantic_weight
+        max_priority = max((agent.priority for agent in agents), default=0)
+        matches = []
+        for index, agent in enumerate(agents):
+            keyword_score = keyword_scores.get(index, 0)
+            similarity = similarities[index]
+            if keyword_score <= 0 and similarity < settings.dify_semantic_min_similarity:
+                continue
+
+            score = weight * max(similarity, 0.0) + (1 - weight) * min(keyword_score / KEYWORD_SCORE_SATURATION, 1.0)
+            if max_priority > 0:
+                score += PRIORITY_BONUS * max(agent.priority, 0) / max_priority
+            matches.append(AgentMatch(agent, score, keyword_score, similarity))
+
+        matches.sort(key=lambda match: (match.score, match.agent.priority), reverse=True)
+        return matches[:top_k]
+
+    async def _semantic_similarities(self, query: str, agents: List[DifyAgentConfig]) -> Optional[List[float]]:
+        """获取语义相似度，未启用、不可用或超时时返回 None（只用关键词路由）"""
+        if not settings.dify_semantic_routing:
+            return None
+        router = get_semantic_router()
+        if router is None:
+            return None
+        try:
+            return await asyncio.wait_for(
+                router.similarities(query, agents),
+                timeout=settings.dify_semantic_timeout,
+            )
+        except Exception as e:
+            logger.warning(f"Dify 语义路由不可用，本次只使用关键词匹配: {e!r}")
+            return None
+
+    def _get_keyword_index(self, agents: List[DifyAgentConfig]) -> KeywordIndex:
+        """获取与当前 Agent 列表对应的关键词索引（索引缺失或已过时才重建）"""
+        if self._keyword_index is None or self._keyword_index_source is not agents:
+            self._keyword_index = KeywordIndex(agents)
+            self._keyword_index_source = agents
+        return self._keyword_index
 
     async def refresh_cache(self):
         """手动刷新缓存"""
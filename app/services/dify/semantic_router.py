@@ -0,0 +1,160 @@
+"""Dify Agent 语义路由 - 基于嵌入向量的余弦相似度匹配"""
+
+import asyncio
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from app.core.logger import logger
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+# 查询向量缓存条数
+QUERY_CACHE_SIZE = 256
+
+
+def build_agent_text(agent) -> str:
+    """拼接用于嵌入的 Agent 描述文本"""
+    parts = [agent.name]
+    if agent.description:
+        parts.append(agent.description)
+    if agent.capabilities:
+        parts.append("能力: " + ", ".join(agent.capabilities))
+    if agent.keywords:
+        parts.append("关键词: " + ", ".join(agent.keywords))
+    return "\n".join(parts)
+
+
+class SemanticRouter:
+    """
+    Dify Agent 语义路由器
+
+    每个 Agent 的名称、描述、能力和关键词只嵌入一次，向量按行归一化后保存在内存矩阵中；
+    查询时嵌入查询文本（带 LRU 缓存），一次矩阵乘法得到与所有 Agent 的余弦相似度。
+    Agent 列表刷新时只对文本发生变化的 Agent 重新嵌入。
+    """
+
+    def __init__(self, embedding: Any):
+        """
+        Args:
+            embedding: LangChain Embeddings 实例（使用系统配置的嵌入模型）
+        """
+        self.embedding = embedding
+        self._agents_source: Optional[Sequence] = None
+        self._matrix = None
+        # Agent ID -> (嵌入文本, 归一化向量)
+        self._vector_cache: Dict[str, Tuple[str, Any]] = {}
+        self._query_cache: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = asyncio.Lock()
+        self._index_task: Optional[asyncio.Task] = None
+
+    def is_ready(self, agents: Sequence) -> bool:
+        """向量矩阵是否已对应当前 Agent 列表"""
+        return self._agents_source is agents
+
+    def schedule_index(self, agents: Sequence) -> None:
+        """在后台构建向量矩阵，构建完成前调用方只使用关键词路由"""
+        if self._index_task and not self._index_task.done():
+            return
+
+        async def _build():
+            try:
+                await self.ensure_index(agents)
+            except Exception as e:
+                logger.error(f"构建 Dify 语义路由索引失败: {e}")
+
+        self._index_task = asyncio.create_task(_build())
+
+    @staticmethod
+    def _normalize(vectors):
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    async def ensure_index(self, agents: Sequence) -> None:
+        """确保向量矩阵与当前 Agent 列表一致（列表对象变化时才重建）"""
+        if self._agents_source is agents:
+            return
+
+        async with self._lock:
+            if self._agents_source is agents:
+                return
+
+            texts = [build_agent_text(agent) for agent in agents]
+            missing = [
+                (agent.id, text) for agent, text in zip(agents, texts)
+                if self._vector_cache.get(agent.id, (None,))[0] != text
+            ]
+            if missing:
+                vectors = await self.embedding.aembed_documents([text for _, text in missing])
+                normalized = self._normalize(np.asarray(vectors, dtype=np.float32))
+                for (agent_id, text), vector in zip(missing, normalized):
+                    self._vector_cache[agent_id] = (text, vector)
+                logger.info(f"Dify 语义路由嵌入了 {len(missing)} 个 Agent")
+
+            # 清理已不存在的 Agent
+            current_ids = {agent.id for agent in agents}
+            for agent_id in list(self._vector_cache):
+                if agent_id not in current_ids:
+                    del self._vector_cache[agent_id]
+
+            if agents:
+                self._matrix = np.stack([self._vector_cache[agent.id][1] for agent in agents])
+            else:
+                self._matrix = None
+            self._agents_source = agents
+
+    async def _embed_query(self, query: str):
+        vector = self._query_cache.get(query)
+        if vector is not None:
+            self._query_cache.move_to_end(query)
+            return vector
+
+        raw = await self.embedding.aembed_query(query)
+        vector = self._normalize(np.asarray(raw, dtype=np.float32))
+        self._query_cache[query] = vector
+        if len(self._query_cache) > QUERY_CACHE_SIZE:
+            self._query_cache.popitem(last=False)
+        return vector
+
+    async def similarities(self, query: str, agents: Sequence) -> Optional[List[float]]:
+        """
+        计算查询与各 Agent 的余弦相似度
+
+        向量矩阵尚未对应当前 Agent 列表时在后台构建，本次返回 None。
+
+        Returns:
+            与 agents 顺序一致的相似度列表
+        """
+        if not self.is_ready(agents):
+            self.schedule_index(agents)
+            return None
+        # 等待查询向量期间索引可能随 Agent 列表刷新而重建，使用与 agents 对应的矩阵快照
+        matrix = self._matrix
+        if matrix is None:
+            return []
+        query_vector = await self._embed_query(query)
+        return (matrix @ query_vector).tolist()
+
+
+_semantic_router: Optional[SemanticRouter] = None
+
+
+def get_semantic_router() -> Optional[SemanticRouter]:
+    """获取语义路由器；未安装 numpy 或未配置嵌入模型时返回 None"""
+    global _semantic_router
+    if _semantic_router is not None:
+        return _semantic_router
+    if not NUMPY_AVAILABLE:
+        return None
+
+    from app.core.instances import get_llm_instance
+    _, embedding = get_llm_instance()
+    if embedding is None:
+        return None
+
+    _semantic_router = SemanticRouter(embedding)
+    return _semantic_router
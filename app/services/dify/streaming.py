@@ -0,0 +1,195 @@
+"""Dify 流式调用 - 逐段转发回答并拼装最终文本"""
+
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional
+
+import httpx
+
+from app.core.logger import logger
+from app.services.dify.client import DifyClient
+from app.services.dify.conversations import dify_conversation_store, is_conversation_missing
+
+# 增量回调签名: on_delta(text)
+DeltaCallback = Callable[[str], None]
+# 工作流事件回调签名: on_event(event)，用于记录节点进度
+EventCallback = Callable[[Dict[str, Any]], None]
+
+
+class DifyStreamError(Exception):
+    """Dify 流中返回的错误事件"""
+
+    def __init__(self, message: str, code: Optional[str] = None, status: Optional[int] = None):
+        super().__init__(message)
+        self.message = message
+        self.code = code
+        self.status = status
+
+
+@dataclass
+class DifyStreamResult:
+    """一次流式调用的最终结果"""
+    text: str
+    conversation_id: Optional[str] = None
+    message_id: Optional[str] = None
+    outputs: Optional[Dict[str, Any]] = None
+
+
+def extract_workflow_text(outputs: Any) -> str:
+    """从工作流输出中提取文本"""
+    if isinstance(outputs, dict):
+        return outputs.get("text") or outputs.get("result") or str(outputs)
+    return str(outputs)
+
+
+def _raise_error_event(event: Dict[str, Any]) -> None:
+    raise DifyStreamError(
+        event.get("message") or "Dify 返回错误",
+        code=event.get("code"),
+        status=event.get("status"),
+    )
+
+
+async def stream_dify_response(
+    client: DifyClient,
+    agent_type: str,
+    query: str,
+    user_id: str,
+    inputs: Optional[Dict[str, Any]] = None,
+    conversation_id: Optional[str] = None,
+    on_delta: Optional[DeltaCallback] = None,
+    on_event: Optional[EventCallback] = None,
+) -> DifyStreamResult:
+    """
+    以流式模式调用 Dify，并把增量文本交给 on_delta
+
+    Args:
+        client: Dify 客户端
+        agent_type: Agent 类型 (chatbot、agent、workflow)
+        query: 用户查询
+        user_id: 用户 ID
+        inputs: Dify App 变量
+        conversation_id: Dify 会话 ID (仅对话类型)
+        on_delta: 增量文本回调
+        on_event: 工作流事件回调（仅工作流类型，收到每个事件时调用）
+
+    Returns:
+        拼装好的最终结果
+    """
+    parts = []
+
+    def _emit(delta: str):
+        if not delta:
+            return
+        parts.append(delta)
+        if on_delta:
+            on_delta(delta)
+
+    if agent_type == "workflow":
+        workflow_inputs = dict(inputs or {})
+        workflow_inputs["query"] = query
+        outputs = None
+
+        async for event in client.run_workflow_stream(inputs=workflow_inputs, user_id=user_id):
+            if on_event:
+                on_event(event)
+            event_name = event.get("event")
+            data = event.get("data") or {}
+            if event_name == "text_chunk":
+                _emit(data.get("text", ""))
+            elif event_name == "workflow_finished":
+                if data.get("status") not in (None, "succeeded"):
+                    raise DifyStreamError(data.get("error") or f"工作流执行失败: {data.get('status')}")
+                outputs = data.get("outputs")
+            elif event_name == "error":
+                _raise_error_event(event)
+
+        # 工作流最终输出优先，没有输出时使用流式拼接的文本
+        text = extract_workflow_text(outputs) if outputs else "".join(parts)
+        return DifyStreamResult(text=text, outputs=outputs)
+
+    result = DifyStreamResult(text="", conversation_id=conversation_id)
+    async for event in client.chat_stream(
+        query=query,
+        user_id=user_id,
+        conversation_id=conversation_id,
+        inputs=inputs,
+    ):
+        event_name = event.get("event")
+        if event_name in ("message", "agent_message"):
+            _emit(event.get("answer", ""))
+        elif event_name == "message_replace":
+            # 内容审查替换：以替换后的完整回答为准
+            parts = [event.get("answer", "")]
+        elif event_name == "message_end":
+            result.message_id = event.get("message_id") or event.get("id")
+        elif event_name == "error":
+            _raise_error_event(event)
+
+        if event.get("conversation_id"):
+            result.conversation_id = event["conversation_id"]
+
+    result.text = "".join(parts)
+    logger.debug(f"Dify 流式调用完成: conversation_id={result.conversation_id}, 长度={len(result.text)}")
+    return result
+
+
+def _error_message(error: Exception) -> str:
+    """从 HTTP 错误或流错误中提取 Dify 的错误信息"""
+    if isinstance(error, httpx.HTTPStatusError):
+        try:
+            return error.response.json().get("message", str(error))
+        except Exception:
+            return str(error)
+    if isinstance(error, DifyStreamError):
+        return error.message
+    return str(error)
+
+
+def _error_status(error: Exception) -> Optional[int]:
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code
+    if isinstance(error, DifyStreamError):
+        return error.status
+    return None
+
+
+async def run_dify_agent(
+    client: DifyClient,
+    agent_type: str,
+    query: str,
+    user_id: str,
+    inputs: Optional[Dict[str, Any]] = None,
+    session_id: Optional[str] = None,
+    agent_id: Optional[str] = None,
+    on_delta: Optional[DeltaCallback] = None,
+) -> DifyStreamResult:
+    """
+    流式调用 Dify，并在同一会话内复用 Dify conversation_id
+
+    对话类型会按 (session_id, agent_id) 取出之前的 conversation_id；Dify 提示会话不存在时
+    清除映射并以新会话重试一次，成功后记录新的 conversation_id。
+    """
+    if agent_type == "workflow":
+        return await stream_dify_response(
+            client, agent_type=agent_type, query=query, user_id=user_id,
+            inputs=inputs, on_delta=on_delta,
+        )
+
+    conversation_id = await dify_conversation_store.get(session_id, agent_id)
+    try:
+        result = await stream_dify_response(
+            client, agent_type=agent_type, query=query, user_id=user_id,
+            inputs=inputs, conversation_id=conversation_id, on_delta=on_delta,
+        )
+    except (httpx.HTTPStatusError, DifyStreamError) as e:
+        if not conversation_id or not is_conversation_missing(_error_status(e), _error_message(e)):
+            raise
+        logger.info(f"Dify 会话 {conversation_id} 已失效，重置后使用新会话: session_id={session_id}")
+        await dify_conversation_store.reset(session_id, agent_id)
+        result = await stream_dify_response(
+            client, agent_type=agent_type, query=query, user_id=user_id,
+            inputs=inputs, conversation_id=None, on_delta=on_delta,
+        )
+
+    await dify_conversation_store.save(session_id, agent_id, result.conversation_id)
+    return result
@@ -0,0 +1,405 @@
+"""Dify 工作流后台运行 - 提交后立即返回句柄，可轮询进度或限时等待结果"""
+
+import asyncio
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from uuid import uuid4
+
+import psycopg2
+from psycopg2.extras import Json, RealDictCursor
+
+from app.core.config import settings
+from app.core.logger import logger
+from app.services.dify.circuit_breaker import (
+    DifyCallTimeoutError,
+    DifyCircuitOpenError,
+    dify_breakers,
+    format_unavailable_message,
+)
+from app.services.dify.client import DifyClient
+from app.services.dify.streaming import _error_message, stream_dify_response
+
+# 运行状态
+STATUS_RUNNING = "running"
+STATUS_SUCCEEDED = "succeeded"
+STATUS_FAILED = "failed"
+
+# 运行不在本进程时轮询数据库的间隔（秒）
+POLL_INTERVAL = 2.0
+
+
+@dataclass
+class WorkflowRun:
+    """一次后台工作流运行"""
+    id: str
+    agent_id: Optional[str]
+    agent_name: str
+    session_id: Optional[str]
+    status: str = STATUS_RUNNING
+    workflow_run_id: Optional[str] = None
+    # 节点ID -> 节点进度（按开始顺序）
+    nodes: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    result: Optional[str] = None
+    error: Optional[str] = None
+    created_at: datetime = field(default_factory=datetime.now)
+    finished_at: Optional[datetime] = None
+    done: asyncio.Event = field(default_factory=asyncio.Event)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "run_id": self.id,
+            "agent_id": self.agent_id,
+            "agent_name": self.agent_name,
+            "session_id": self.session_id,
+            "status": self.status,
+            "workflow_run_id": self.workflow_run_id,
+            "progress": list(self.nodes.values()),
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at.isoformat(),
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+
+class DifyWorkflowRunManager:
+    """
+    Dify 工作流后台运行管理
+
+    工作流以流式模式在后台任务中执行，节点开始/结束事件记录为进度；运行状态、进度和结果
+    写入 dify_workflow_runs 表，客户端重连或其他工作进程都能查询到。本进程内的运行可直接
+    等待完成事件，其他进程的运行通过轮询数据库等待。
+    """
+
+    def __init__(self):
+        self.db_url = settings.database_url
+        self._runs: Dict[str, WorkflowRun] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._flush_tasks: Dict[str, asyncio.Task] = {}
+        self._dirty: set = set()
+
+    # ---------- 数据库 ----------
+
+    def _insert(self, run: WorkflowRun) -> None:
+        conn = psycopg2.connect(self.db_url)
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    "DELETE FROM dify_workflow_runs WHERE created_at < NOW() - make_interval(hours => %s)",
+                    (settings.dify_workflow_run_retention_hours,),
+                )
+                cursor.execute(
+                    """
+                    INSERT INTO dify_workflow_runs (id, agent_id, agent_name, session_id, status)
+                    VALUES (%s, %s, %s, %s, %s)
+                    """,
+                    (run.id, run.agent_id, run.agent_name, run.session_id, run.status),
+                )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _update(self, run_id: str, values: Dict[str, Any]) -> None:
+        conn = psycopg2.connect(self.db_url)
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    """
+                    UPDATE dify_workflow_runs
+                    SET status = %s, workflow_run_id = %s, progress = %s,
+                        result = %s, error = %s, finished_at = %s,
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE id = %s
+                    """,
+                    (
+                        values["status"], values["workflow_run_id"], Json(values["progress"]),
+                        values["result"], values["error"], values["finished_at"], run_id,
+                    ),
+                )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _load(self, run_id: str) -> Optional[Dict[str, Any]]:
+        conn = psycopg2.connect(self.db_url)
+        try:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute("SELECT * FROM dify_workflow_runs WHERE id = %s", (run_id,))
+                row = cursor.fetchone()
+        finally:
+            conn.close()
+        return self._row_to_dict(row) if row else None
+
+    def _list(self, session_id: Optional[str], limit: int) -> List[Dict[str, Any]]:
+        conn = psycopg2.connect(self.db_url)
+        try:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                if session_id:
+                    cursor.execute(
+                        "SELECT * FROM dify_workflow_runs WHERE session_id = %s ORDER BY created_at DESC LIMIT %s",
+                        (session_id, limit),
+                    )
+                else:
+                    cursor.execute(
+                        "SELECT * FROM dify_workflow_runs ORDER BY created_at DESC LIMIT %s",
+                        (limit,),
+                    )
+                rows = cursor.fetchall()
+        finally:
+            conn.close()
+        return [self._row_to_dict(row) for row in rows]
+
+    @staticmethod
+    def _row_to_dict(row: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "run_id": row["id"],
+            "agent_id": row["agent_id"],
+            "agent_name": row["agent_name"],
+            "session_id": row["session_id"],
+            "status": row["status"],
+            "workflow_run_id": row["workflow_run_id"],
+            "progress": row["progress"] or [],
+            "result": row["result"],
+            "error": row["error"],
+            "created_at": row["created_at"].isoformat() if row["created_at"] else None,
+            "finished_at": row["finished_at"].isoformat() if row["finished_at"] else None,
+        }
+
+    # ---------- 持久化 ----------
+
+    @staticmethod
+    def _values(run: WorkflowRun) -> Dict[str, Any]:
+        return {
+            "status": run.status,
+            "workflow_run_id": run.workflow_run_id,
+            "progress": list(run.nodes.values()),
+            "result": run.result,
+            "error": run.error,
+            "finished_at": run.finished_at,
+        }
+
+    def _schedule_flush(self, run: WorkflowRun) -> None:
+        """进度变化后异步写库，写库期间的新变化合并到下一次写入"""
+        self._dirty.add(run.id)
+        task = self._flush_tasks.get(run.id)
+        if task is None or task.done():
+            self._flush_tasks[run.id] = asyncio.create_task(self._flush(run))
+
+    async def _flush(self, run: WorkflowRun) -> None:
+        while run.id in self._dirty:
+            self._dirty.discard(run.id)
+            try:
+                await asyncio.to_thread(self._update, run.id, self._values(run))
+            except Exception as e:
+                logger.warning(f"保存 Dify 工作流进度失败: run_id={run.id}, {e}")
+
+    async def _persist_final(self, run: WorkflowRun) -> None:
+        """等待进行中的进度写入后保存最终状态"""
+        self._dirty.discard(run.id)
+        task = self._flush_tasks.pop(run.id, None)
+        if task is not None and not task.done():
+            try:
+                await task
+            except Exception:
+                pass
+        try:
+            await asyncio.to_thread(self._update, run.id, self._values(run))
+        except Exception as e:
+            logger.error(f"保存 Dify 工作流结果失败: run_id={run.id}, {e}")
+
+    # ---------- 运行 ----------
+
+    def _on_event(self, run: WorkflowRun, event: Dict[str, Any]) -> None:
+        """记录工作流事件中的节点进度"""
+        event_name = event.get("event")
+        data = event.get("data") or {}
+        if event_name == "workflow_started":
+            run.workflow_run_id = event.get("workflow_run_id") or data.get("id")
+        elif event_name == "node_started":
+            node_id = data.get("node_id") or data.get("id")
+            run.nodes[node_id] = {
+                "node_id": node_id,
+                "title": data.get("title"),
+                "node_type": data.get("node_type"),
+                "status": "running",
+                "elapsed_time": None,
+            }
+        elif event_name == "node_finished":
+            node_id = data.get("node_id") or data.get("id")
+            node = run.nodes.setdefault(node_id, {"node_id": node_id, "title": data.get("title"), "node_type": data.get("node_type")})
+            node["status"] = data.get("status")
+            node["elapsed_time"] = data.get("elapsed_time")
+            if data.get("error"):
+                node["error"] = data.get("error")
+        else:
+            return
+        self._schedule_flush(run)
+
+    async def submit(
+        self,
+        client: DifyClient,
+        agent_id: Optional[str],
+        agent_name: str,
+        query: str,
+        user_id: str,
+        inputs: Optional[Dict[str, Any]] = None,
+        session_id: Optional[str] = None,
+        max_timeout: Optional[float] = None,
+    ) -> WorkflowRun:
+        """
+        在后台启动工作流
+
+        Args:
+            client: Dify 客户端
+            agent_id: Dify Agent ID（熔断统计与查询用）
+            agent_name: Agent 名称
+            query: 查询内容（合并进工作流输入）
+            user_id: 用户 ID
+            inputs: 工作流输入
+            session_id: 会话 ID
+            max_timeout: 整个工作流的超时上限（秒），默认 DIFY_WORKFLOW_ASYNC_TIMEOUT
+
+        Returns:
+            运行记录，run.id 为句柄
+        """
+        run = WorkflowRun(
+            id=uuid4().hex[:12],
+            agent_id=agent_id,
+            agent_name=agent_name,
+            session_id=str(session_id) if session_id else None,
+        )
+        if max_timeout is None:
+            max_timeout = settings.dify_workflow_async_timeout
+        await asyncio.to_thread(self._insert, run)
+        self._runs[run.id] = run
+        self._tasks[run.id] = asyncio.create_task(
+            self._execute(run, client, query, user_id, inputs, max_timeout)
+        )
+        logger.info(f"Dify 工作流 '{agent_name}' 已在后台启动: run_id={run.id}")
+        return run
+
+    async def _execute(
+        self,
+        run: WorkflowRun,
+        client: DifyClient,
+        query: str,
+        user_id: str,
+        inputs: Optional[Dict[str, Any]],
+        max_timeout: float,
+    ) -> None:
+        # 与交互调用共用熔断器（Dify 故障时同样拒绝提交），但固定超时、不计慢调用和耗时样本
+        breaker = dify_breakers.get(run.agent_id, run.agent_name)
+        try:
+            result = await breaker.call(
+                lambda: stream_dify_response(
+                    client,
+                    agent_type="workflow",
+                    query=query,
+                    user_id=user_id,
+                    inputs=inputs,
+                    on_event=lambda event: self._on_event(run, event),
+                ),
+                max_timeout=max_timeout,
+                adaptive=False,
+            )
+            run.status = STATUS_SUCCEEDED
+            run.result = result.text
+            logger.info(f"Dify 工作流后台运行完成: run_id={run.id}, 节点数={len(run.nodes)}")
+        except asyncio.CancelledError:
+            run.status = STATUS_FAILED
+            run.error = "服务关闭，工作流运行被中断"
+            run.finished_at = datetime.now()
+            await self._persist_final(run)
+            self._finish(run)
+            raise
+        except Exception as e:
+            run.status = STATUS_FAILED
+            if isinstance(e, (DifyCircuitOpenError, DifyCallTimeoutError)):
+                run.error = format_unavailable_message(e)
+            else:
+                run.error = _error_message(e)
+            logger.error(f"Dify 工作流后台运行失败: run_id={run.id}, {run.error}")
+
+        run.finished_at = datetime.now()
+        await self._persist_final(run)
+        self._finish(run)
+
+    def _finish(self, run: WorkflowRun) -> None:
+        run.done.set()
+        self._tasks.pop(run.id, None)
+        self._runs.pop(run.id, None)
+
+    # ---------- 查询 ----------
+
+    async def get(self, run_id: str) -> Optional[Dict[str, Any]]:
+        """获取运行状态（本进程内存优先，其次数据库）"""
+        run = self._runs.get(run_id)
+        if run is not None:
+            return run.to_dict()
+        return await asyncio.to_thread(self._load, run_id)
+
+    async def wait(self, run_id: str, timeout: float) -> Optional[Dict[str, Any]]:
+        """
+        等待运行结束，最多等待 timeout 秒
+
+        Returns:
+            运行状态（超时返回当前进度），运行不存在时返回 None
+        """
+        run = self._runs.get(run_id)
+        if run is not None:
+            if timeout > 0:
+                try:
+                    await asyncio.wait_for(run.done.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+            return run.to_dict()
+
+        deadline = time.monotonic() + max(timeout, 0)
+        while True:
+            state = await asyncio.to_thread(self._load, run_id)
+            if state is None or state["status"] != STATUS_RUNNING:
+                return state
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return state
+            await asyncio.sleep(min(POLL_INTERVAL, remaining))
+
+    async def list_runs(self, session_id: Optional[str] = None, limit: int = 20) -> List[Dict[str, Any]]:
+        """列出最近的运行"""
+        return await asyncio.to_thread(self._list, session_id, limit)
+
+    async def shutdown(self) -> None:
+        """取消本进程内仍在运行的工作流，并记录为中断"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+            logger.info(f"已中断 {len(tasks)} 个后台 Dify 工作流")
+
+
+def summarize_run(state: Dict[str, Any]) -> str:
+    """把运行状态整理成给模型看的文本"""
+    progress = state.get("progress") or []
+    finished = [node for node in progress if node.get("status") not in (None, "running")]
+    running = [node.get("title") or node.get("node_id") for node in progress if node.get("status") == "running"]
+
+    if state["status"] == STATUS_SUCCEEDED:
+        return state.get("result") or ""
+    if state["status"] == STATUS_FAILED:
+        return f"工作流 '{state['agent_name']}' 执行失败: {state.get('error')}"
+
+    lines = [
+        f"工作流 '{state['agent_name']}' 仍在后台运行（run_id={state['run_id']}），已完成 {len(finished)} 个节点。",
+    ]
+    if running:
+        lines.append(f"正在执行: {', '.join(str(title) for title in running)}")
+    lines.append(
+        f"可调用 get_dify_workflow_result(run_id=\"{state['run_id']}\", wait_seconds=...) 查询进度或等待结果。"
+    )
+    return "\n".join(lines)
+
+
+# 全局工作流运行管理实例
+dify_workflow_runs = DifyWorkflowRunManager()
@@ -2,23 +2,36 @@
 MCP服务器配置管理服务
 """
 
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Callable, Tuple
 from uuid import UUID, uuid4
+import copy
 import psycopg2
 import psycopg2.extras
 import json
+import threading
+import time
 from datetime import datetime, timezone
 
 from app.core.config import settings
 from app.core.logger import logger
 from app.models.schemas import MCPServerConfig, MCPServerConfigCreate, MCPServerConfigUpdate
 
+# mcp_server_configs 表变更通知频道（与 init_db.py 中的触发器保持一致）
+MCP_CONFIG_CHANNEL = "mcp_server_configs_changed"
+
 
 class MCPConfigService:
     """MCP配置服务"""
 
     def __init__(self):
         self.db_url = settings.database_url
+        # 启用配置的内存快照，由变更通知或版本探测失效
+        self._enabled_snapshot: Optional[Dict[str, Dict[str, Any]]] = None
+        self._snapshot_version: Optional[Tuple[int, Optional[datetime]]] = None
+        self._snapshot_checked_at: float = 0.0
+        self._snapshot_dirty = False
+        self._snapshot_lock = threading.Lock()
+        self._change_listeners: List[Callable[[], Any]] = []
 
     def _get_connection(self):
         """获取数据库连接"""
@@ -300,7 +313,47 @@ class MCPConfigService:
                 conn.close()
 
     def get_enabled_configs_dict(self) -> Dict[str, Dict[str, Any]]:
-        """获取启用的MCP配置，返回字典格式用于MultiServerMCPClient"""
+        """
+        获取启用的MCP配置，返回字典格式用于MultiServerMCPClient
+
+        优先返回内存快照：监听到变更通知时快照失效；没有可用的通知监听时，
+        每隔 MCP_CONFIG_PROBE_INTERVAL 秒用一次 count/max(updated_at) 探测判断是否需要重新加载。
+        """
+        with self._snapshot_lock:
+            version = None
+            if self._enabled_snapshot is not None and not self._snapshot_dirty:
+                if self._is_change_listener_active():
+                    return copy.deepcopy(self._enabled_snapshot)
+
+                if time.monotonic() - self._snapshot_checked_at < settings.mcp_config_probe_interval:
+                    return copy.deepcopy(self._enabled_snapshot)
+
+                try:
+                    version = self._probe_version()
+                except Exception as e:
+                    logger.warning(f"探测MCP配置版本失败，继续使用内存快照: {e}")
+                    return copy.deepcopy(self._enabled_snapshot)
+                self._snapshot_checked_at = time.monotonic()
+                if version == self._snapshot_version:
+                    return copy.deepcopy(self._enabled_snapshot)
+                logger.info("检测到MCP配置版本变化，重新加载启用的配置")
+
+            # 先取版本再读数据：两者之间发生的修改会在下一次探测时被发现
+            self._snapshot_dirty = False
+            try:
+                if version is None:
+                    version = self._probe_version()
+                result = self._load_enabled_configs_dict()
+            except Exception:
+                self._snapshot_dirty = True
+                raise
+            self._enabled_snapshot = result
+            self._snapshot_version = version
+            self._snapshot_checked_at = time.monotonic()
+            return copy.deepcopy(result)
+
+    def _load_enabled_configs_dict(self) -> Dict[str, Dict[str, Any]]:
+        """从数据库读取启用的MCP配置并转换为客户端格式"""
         configs = self.list_mcp_configs(enabled_only=True)
         result = {}
 
@@ -319,6 +372,65 @@ class MCPConfigService:
         logger.info(f"加载了 {len(result)} 个启用的MCP服务器配置: {list(result.keys())}")
         return result
 
+    def _probe_version(self) -> Tuple[int, Optional[datetime]]:
+        """读取配置表的版本标识（行数和最近更新时间）"""
+        conn = None
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            cursor.execute("SELECT count(*), max(updated_at) FROM mcp_server_configs")
+            count, last_updated = cursor.fetchone()
+            return count, last_updated
+        finally:
+            if conn:
+                cursor.close()
+                conn.close()
+
+    def _is_change_listener_active(self) -> bool:
+        """变更通知监听是否有效"""
+        from app.core.pg_notify import get_pg_notify_hub
+        return get_pg_notify_hub().is_listening(MCP_CONFIG_CHANNEL)
+
+    def invalidate_snapshot(self) -> None:
+        """使启用配置快照失效，下次读取时重新加载"""
+        self._snapshot_dirty = True
+
+    def add_change_listener(self, listener: Callable[[], Any]) -> None:
+        """注册配置变更监听器（在事件循环中被调用）"""
+        self._change_listeners.append(listener)
+
+    def publish_config_change(self, event: str, config_name: Optional[str] = None) -> None:
+        """
+        发布配置变更事件
+
+        立即使本进程的快照失效，并通过 NOTIFY 通知其他工作进程。
+        表上的触发器也会发送同样的通知，重复通知是幂等的。
+        """
+        self.invalidate_snapshot()
+        payload = json.dumps({"event": event, "name": config_name}, ensure_ascii=False)
+        try:
+            from app.core.pg_notify import publish_sync
+            publish_sync(MCP_CONFIG_CHANNEL, payload)
+            logger.info(f"已发布MCP配置变更事件: {payload}")
+        except Exception as e:
+            logger.warning(f"发布MCP配置变更事件失败，其他进程将通过版本探测发现变更: {e}")
+
+    async def start_change_listener(self) -> None:
+        """订阅配置表的变更通知"""
+        from app.core.pg_notify import get_pg_notify_hub
+        await get_pg_notify_hub().subscribe(MCP_CONFIG_CHANNEL, self._on_config_changed)
+        logger.info(f"已订阅MCP配置变更通知: {MCP_CONFIG_CHANNEL}")
+
+    async def _on_config_changed(self, payload: Optional[str]) -> None:
+        """收到变更通知：使快照失效并通知监听器"""
+        logger.info(f"收到MCP配置变更通知: {payload}")
+        self.invalidate_snapshot()
+        for listener in list(self._change_listeners):
+            try:
+                listener()
+            except Exception as e:
+                logger.error(f"MCP配置变更监听器执行失败: {e}", exc_info=True)
+
 
 # 全局MCP配置服务实例
 mcp_config_service = MCPConfigService()
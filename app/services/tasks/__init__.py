@@ -0,0 +1,21 @@
+"""任务服务"""
+
+from app.services.tasks.query import (
+    MAX_PAGE_SIZE,
+    TASK_VIEWS,
+    VIEW_FLAT,
+    VIEW_TREE,
+    build_task_page,
+    build_task_queries,
+    format_task,
+)
+
+__all__ = [
+    "MAX_PAGE_SIZE",
+    "TASK_VIEWS",
+    "VIEW_FLAT",
+    "VIEW_TREE",
+    "build_task_page",
+    "build_task_queries",
+    "format_task",
+]
@@ -0,0 +1,104 @@
+"""任务更新通知 - 按会话防抖合并，通知中携带变更任务的最新状态"""
+
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, Optional
+
+from app.core.config import settings
+from app.core.logger import logger
+
+
+@dataclass
+class _PendingUpdate:
+    """某个会话等待发送的变更"""
+    # task_id -> 最新任务状态（同一任务多次变更只保留最后一次）
+    tasks: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    # 本轮第一次变更的时间，用于限制最长延迟
+    first_at: float = field(default_factory=time.monotonic)
+    # 本轮是否需要客户端整体刷新（变更数超过上限或调用方未提供任务内容）
+    refetch: bool = False
+    timer: Optional[asyncio.Task] = None
+
+
+class TaskUpdateNotifier:
+    """
+    会话级任务更新通知防抖器
+
+    同一会话在 TASK_NOTIFY_DEBOUNCE 秒内的多次变更合并为一条 task_update 消息，
+    持续有变更时最迟 TASK_NOTIFY_MAX_DELAY 秒也会发送一次。消息的 tasks 字段是变更任务的最新状态，
+    客户端按 id 原地更新；变更数超过 TASK_NOTIFY_MAX_TASKS 时只发送 refetch 标记，由客户端整体刷新。
+    """
+
+    def __init__(self):
+        self._pending: Dict[str, _PendingUpdate] = {}
+
+    def publish(self, session_id: str, tasks: Optional[Iterable[Dict[str, Any]]] = None) -> None:
+        """
+        记录会话的任务变更并安排发送
+
+        Args:
+            session_id: 会话ID
+            tasks: 变更后的任务（需包含 id）；不传时本轮通知要求客户端整体刷新
+        """
+        if not session_id:
+            return
+        session_id = str(session_id)
+        pending = self._pending.get(session_id)
+        if pending is None:
+            pending = self._pending[session_id] = _PendingUpdate()
+
+        if tasks is None:
+            pending.refetch = True
+        else:
+            for task in tasks:
+                pending.tasks[str(task["id"])] = task
+        if len(pending.tasks) > settings.task_notify_max_tasks:
+            pending.refetch = True
+            pending.tasks.clear()
+
+        # 重新计时：等待窗口内没有新变更再发送，但不超过最长延迟
+        if pending.timer is not None and not pending.timer.done():
+            pending.timer.cancel()
+        elapsed = time.monotonic() - pending.first_at
+        delay = max(min(settings.task_notify_debounce, settings.task_notify_max_delay - elapsed), 0.0)
+        pending.timer = asyncio.create_task(self._flush_later(session_id, pending, delay))
+
+    async def _flush_later(self, session_id: str, pending: _PendingUpdate, delay: float) -> None:
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            return
+        # 发送前先摘下本轮变更，发送期间产生的新变更进入下一轮
+        if self._pending.get(session_id) is pending:
+            del self._pending[session_id]
+        await self._send(session_id, pending)
+
+    async def _send(self, session_id: str, pending: _PendingUpdate) -> None:
+        # 延迟导入以避免循环导入
+        from app.api.routes.tasks import notify_task_update
+
+        tasks = None if pending.refetch else list(pending.tasks.values())
+        try:
+            await notify_task_update(session_id, tasks)
+        except Exception as e:
+            logger.error(f"发送任务更新通知失败: session_id={session_id}, error={e}", exc_info=True)
+
+    async def flush(self, session_id: Optional[str] = None) -> None:
+        """立即发送等待中的变更（不传 session_id 时发送全部会话）"""
+        session_ids = [str(session_id)] if session_id else list(self._pending)
+        for sid in session_ids:
+            pending = self._pending.pop(sid, None)
+            if pending is None:
+                continue
+            if pending.timer is not None and not pending.timer.done():
+                pending.timer.cancel()
+            await self._send(sid, pending)
+
+    async def shutdown(self) -> None:
+        """关闭前发送所有等待中的变更"""
+        await self.flush()
+
+
+# 全局任务更新通知器
+task_update_notifier = TaskUpdateNotifier()
@@ -0,0 +1,247 @@
+"""任务查询 - 平铺/树形两种视图，支持状态筛选、分页和按状态汇总
+
+SQL 只使用 %(name)s 占位符，psycopg2（接口）和 psycopg3（工具）的游标都可以直接执行。
+"""
+
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+VIEW_FLAT = "flat"
+VIEW_TREE = "tree"
+TASK_VIEWS = (VIEW_FLAT, VIEW_TREE)
+
+# 单页最多返回的任务数（树形视图中为根任务数）
+MAX_PAGE_SIZE = 500
+
+TASK_COLUMNS = ("id", "user_id", "session_id", "content", "status", "parent_task_id", "created_at", "updated_at")
+
+Query = Tuple[str, Dict[str, Any]]
+
+
+def _columns(alias: str) -> str:
+    return ", ".join(f"{alias}.{column}" for column in TASK_COLUMNS)
+
+
+def _scope(alias: str, user_id: Optional[str]) -> str:
+    """任务属于当前会话（以及当前用户）的条件"""
+    condition = f"{alias}.session_id = %(session_id)s"
+    if user_id is not None:
+        condition += f" AND {alias}.user_id = %(user_id)s"
+    return condition
+
+
+def _params(session_id: str, user_id: Optional[str], **extra) -> Dict[str, Any]:
+    params = {"session_id": str(session_id), **extra}
+    if user_id is not None:
+        params["user_id"] = str(user_id)
+    return params
+
+
+def build_status_counts_query(session_id: str, user_id: Optional[str] = None) -> Query:
+    """会话内各状态的任务数"""
+    sql = f"""
+        SELECT t.status, COUNT(*) AS count
+        FROM tasks t
+        WHERE {_scope("t", user_id)}
+        GROUP BY t.status
+    """
+    return sql, _params(session_id, user_id)
+
+
+def build_flat_query(
+    session_id: str,
+    user_id: Optional[str] = None,
+    status: Optional[str] = None,
+    limit: Optional[int] = None,
+    offset: int = 0,
+) -> Query:
+    """按创建时间排序的平铺任务列表（limit 为 None 时不分页）"""
+    sql = f"SELECT {_columns('t')} FROM tasks t WHERE {_scope('t', user_id)}"
+    if status:
+        sql += " AND t.status = %(status)s"
+    sql += " ORDER BY t.created_at, t.id LIMIT %(limit)s OFFSET %(offset)s"
+    return sql, _params(session_id, user_id, status=status, limit=limit, offset=offset)
+
+
+def build_tree_query(
+    session_id: str,
+    user_id: Optional[str] = None,
+    status: Optional[str] = None,
+    limit: Optional[int] = None,
+    offset: int = 0,
+) -> Query:
+    """
+    树形任务查询：按根任务分页，递归取出每个根任务的完整子树
+
+    父任务不在当前范围内的任务视为根任务。指定 status 时先从匹配的任务向上递归找到所属根任务，
+    只对这些根任务分页；返回的子树不做筛选，由 assemble_task_tree 计算汇总后再裁剪。
+    结果第一列为根任务总数；没有任务时仍返回一行，其余列为 NULL。
+    """
+    params = _params(session_id, user_id, status=status, limit=limit, offset=offset)
+    if status:
+        candidate_roots = f"""
+        ancestors AS (
+            SELECT t.id, t.parent_task_id, ARRAY[t.id]::varchar[] AS path
+            FROM tasks t
+            WHERE {_scope("t", user_id)} AND t.status = %(status)s
+            UNION ALL
+            SELECT p.id, p.parent_task_id, a.path || p.id
+            FROM tasks p
+            JOIN ancestors a ON p.id = a.parent_task_id
+            WHERE {_scope("p", user_id)} AND NOT p.id = ANY(a.path)
+        ),
+        candidate_roots AS (
+            SELECT DISTINCT a.id
+            FROM ancestors a
+            WHERE NOT EXISTS (
+                SELECT 1 FROM tasks p WHERE p.id = a.parent_task_id AND {_scope("p", user_id)}
+            )
+        ),"""
+    else:
+        candidate_roots = f"""
+        candidate_roots AS (
+            SELECT t.id
+            FROM tasks t
+            WHERE {_scope("t", user_id)}
+              AND NOT EXISTS (
+                  SELECT 1 FROM tasks p WHERE p.id = t.parent_task_id AND {_scope("p", user_id)}
+              )
+        ),"""
+
+    sql = f"""
+        WITH RECURSIVE {candidate_roots}
+        page_roots AS (
+            SELECT t.id
+            FROM tasks t
+            JOIN candidate_roots r ON r.id = t.id
+            ORDER BY t.created_at, t.id
+            LIMIT %(limit)s OFFSET %(offset)s
+        ),
+        tree AS (
+            SELECT {_columns("t")}, 0 AS depth, ARRAY[t.id]::varchar[] AS path
+            FROM tasks t
+            JOIN page_roots r ON r.id = t.id
+            UNION ALL
+            SELECT {_columns("c")}, tree.depth + 1, tree.path || c.id
+            FROM tasks c
+            JOIN tree ON c.parent_task_id = tree.id
+            WHERE {_scope("c", user_id)} AND NOT c.id = ANY(tree.path)
+        )
+        SELECT total.total_roots, tree.*
+        FROM (SELECT COUNT(*) AS total_roots FROM candidate_roots) total
+        LEFT JOIN tree ON true
+        ORDER BY tree.depth, tree.created_at, tree.id
+    """
+    return sql, params
+
+
+def format_task(row) -> Dict[str, Any]:
+    """把任务行转换为可序列化的字典"""
+    task = {column: row[column] for column in TASK_COLUMNS}
+    for key in ("created_at", "updated_at"):
+        if task[key] is not None:
+            task[key] = task[key].isoformat()
+    for key in ("user_id", "session_id"):
+        if task[key] is not None:
+            task[key] = str(task[key])
+    return task
+
+
+def summarize_counts(rows: Iterable) -> Dict[str, int]:
+    """把状态计数查询结果转换为 {status: count}"""
+    return {row["status"]: row["count"] for row in rows}
+
+
+def assemble_task_tree(rows: Iterable, status: Optional[str] = None) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    把 build_tree_query 的结果组装为嵌套结构
+
+    每个任务带 children 和 rollup（全部后代按状态计数，不含自身）；
+    指定 status 时剪掉不含匹配任务的分支，保留的祖先任务以 matched=False 标记。
+
+    Returns:
+        (根任务列表, 根任务总数)
+    """
+    total_roots = 0
+    nodes: Dict[str, Dict[str, Any]] = {}
+    roots: List[Dict[str, Any]] = []
+    # 行按深度排序，父任务总在子任务之前
+    for row in rows:
+        total_roots = row["total_roots"]
+        if row["id"] is None:
+            continue
+        node = format_task(row)
+        node["depth"] = row["depth"]
+        node["children"] = []
+        nodes[node["id"]] = node
+        parent = nodes.get(node["parent_task_id"]) if row["depth"] > 0 else None
+        if parent is None:
+            roots.append(node)
+        else:
+            parent["children"].append(node)
+
+    def _rollup(node: Dict[str, Any]) -> Dict[str, int]:
+        counts: Dict[str, int] = {}
+        for child in node["children"]:
+            counts[child["status"]] = counts.get(child["status"], 0) + 1
+            for child_status, count in _rollup(child).items():
+                counts[child_status] = counts.get(child_status, 0) + count
+        node["rollup"] = counts
+        return counts
+
+    def _prune(node: Dict[str, Any]) -> bool:
+        node["children"] = [child for child in node["children"] if _prune(child)]
+        node["matched"] = node["status"] == status
+        return node["matched"] or bool(node["children"])
+
+    for root in roots:
+        _rollup(root)
+    if status:
+        roots = [root for root in roots if _prune(root)]
+    return roots, total_roots
+
+
+def build_task_page(
+    view: str,
+    counts_rows: Iterable,
+    task_rows: Iterable,
+    status: Optional[str] = None,
+    limit: Optional[int] = None,
+    offset: int = 0,
+) -> Dict[str, Any]:
+    """
+    组装任务查询的返回结构
+
+    total 在平铺视图中为匹配的任务数，在树形视图中为匹配的根任务数；
+    has_more 表示按 limit/offset 翻页后是否还有剩余。
+    """
+    counts = summarize_counts(counts_rows)
+    if view == VIEW_TREE:
+        tasks, total = assemble_task_tree(task_rows, status)
+    else:
+        tasks = [format_task(row) for row in task_rows]
+        total = counts.get(status, 0) if status else sum(counts.values())
+    return {
+        "view": view,
+        "tasks": tasks,
+        "total": total,
+        "counts": counts,
+        "limit": limit,
+        "offset": offset,
+        "has_more": limit is not None and offset + limit < total,
+    }
+
+
+def build_task_queries(
+    view: str,
+    session_id: str,
+    user_id: Optional[str] = None,
+    status: Optional[str] = None,
+    limit: Optional[int] = None,
+    offset: int = 0,
+) -> Tuple[Query, Query]:
+    """返回 (状态计数查询, 任务查询)"""
+    builder = build_tree_query if view == VIEW_TREE else build_flat_query
+    return (
+        build_status_counts_query(session_id, user_id),
+        builder(session_id, user_id, status, limit, offset),
+    )
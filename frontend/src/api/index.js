@@ -171,6 +171,13 @@ export const interruptAPI = {
     apiClient.post(`/sessions/${sessionId}/interrupt`, { reason })
 }
 
+// 用户确认相关 API（回答后对话从暂停处继续，返回与聊天接口相同的响应）
+export const confirmationAPI = {
+  list: (sessionId) => apiClient.get(`/sessions/${sessionId}/confirmations`),
+  respond: (sessionId, confirmationId, answerData) =>
+    apiClient.post(`/sessions/${sessionId}/confirmations/${confirmationId}`, answerData, { timeout: 0 })
+}
+
 // Dify Agent 相关 API
 export const difyAgentAPI = {
   list: (enabledOnly = false) => apiClient.get(`/dify-agents${enabledOnly ? '?enabled_only=true' : ''}`),
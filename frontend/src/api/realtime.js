@@ -0,0 +1,95 @@
+// 实时通道客户端：一个 WebSocket 同时承载对话流、工具事件、任务变更、用户确认和中断
+// 对话流帧带 seq，客户端处理后累计确认；服务端未确认帧达到 flow_window 时暂停输出
+
+export class RealtimeChannel {
+  constructor(sessionId) {
+    this.sessionId = sessionId
+    this.socket = null
+    this.handlers = new Map()
+    this.flowWindow = 64
+    this.lastSeq = 0
+    this.ackedSeq = 0
+    this.heartbeatTimer = null
+  }
+
+  // 注册帧处理函数，type 为 '*' 时接收全部帧
+  on(type, handler) {
+    if (!this.handlers.has(type)) {
+      this.handlers.set(type, new Set())
+    }
+    this.handlers.get(type).add(handler)
+    return () => this.handlers.get(type)?.delete(handler)
+  }
+
+  connect() {
+    const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:'
+    this.socket = new WebSocket(`${protocol}//${window.location.host}/api/realtime/ws/${this.sessionId}`)
+    this.socket.onmessage = (event) => this.handleFrame(event)
+    this.socket.onopen = () => {
+      this.heartbeatTimer = setInterval(() => this.send({ type: 'heartbeat' }), 30000)
+    }
+    this.socket.onclose = (event) => {
+      clearInterval(this.heartbeatTimer)
+      this.emit({ type: 'closed', code: event.code })
+    }
+    return this
+  }
+
+  close() {
+    clearInterval(this.heartbeatTimer)
+    this.socket?.close()
+  }
+
+  send(frame) {
+    if (this.socket && this.socket.readyState === WebSocket.OPEN) {
+      this.socket.send(JSON.stringify(frame))
+    }
+  }
+
+  chat(message, requestId = crypto.randomUUID().slice(0, 8)) {
+    this.send({ type: 'chat', message, request_id: requestId })
+    return requestId
+  }
+
+  interrupt(reason = 'User requested interrupt') {
+    this.send({ type: 'interrupt', reason })
+  }
+
+  respondConfirmation(confirmationId, status, value) {
+    this.send({ type: 'user_confirmation_response', confirmation_id: confirmationId, status, value })
+  }
+
+  handleFrame(event) {
+    let frame
+    try {
+      frame = JSON.parse(event.data)
+    } catch (error) {
+      console.error('解析实时通道消息失败:', error, event.data)
+      return
+    }
+    if (frame.type === 'connected' && frame.flow_window) {
+      this.flowWindow = frame.flow_window
+    }
+    this.emit(frame)
+    if (frame.seq) {
+      this.lastSeq = frame.seq
+      // 处理完一半窗口或对话结束时确认，避免服务端等待
+      if (this.lastSeq - this.ackedSeq >= this.flowWindow / 2 || frame.type === 'chat_done' || frame.type === 'chat_error') {
+        this.ackedSeq = this.lastSeq
+        this.send({ type: 'ack', seq: this.lastSeq })
+      }
+    }
+  }
+
+  emit(frame) {
+    for (const key of [frame.type, '*']) {
+      for (const handler of this.handlers.get(key) || []) {
+        try {
+          handler(frame)
+        } catch (error) {
+          console.error('处理实时通道消息失败:', error)
+        }
+      }
+    }
+  }
+}